@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from services.gemini_service import GeminiService
+from services.image_service import ImageService
+from models.thread_manager import ThreadManager
+from utils.job_journal import JobJournal
+from utils.encoded_image import EncodedImage
+from utils.config import Config
+from utils.metrics import metrics
+
+IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'bmp', 'gif', 'webp']
+
+def collect_items(input_dir=None, manifest_path=None, instruction=None):
+    """処理対象の (画像パス, 指示テキスト) の一覧を作成"""
+    items = []
+
+    if input_dir:
+        for name in sorted(os.listdir(input_dir)):
+            if name.lower().split('.')[-1] in IMAGE_EXTENSIONS:
+                items.append((os.path.join(input_dir, name), instruction))
+
+    if manifest_path:
+        # マニフェストはJSON Lines形式: {"image": "...", "instruction": "..."}
+        # instructionを省略した行は --instruction の値を使う
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                entry = json.loads(line)
+                image_path = entry["image"]
+                if not os.path.isabs(image_path):
+                    image_path = os.path.join(base_dir, image_path)
+                items.append((image_path, entry.get("instruction") or instruction))
+
+    return [(path, text) for path, text in items if text]
+
+class BatchEditor:
+    """複数画像への一括編集を並列で実行する"""
+
+    def __init__(self, gemini_service, thread_manager, image_service, journal, max_workers=4):
+        self.gemini_service = gemini_service
+        self.thread_manager = thread_manager
+        self.image_service = image_service
+        self.journal = journal
+        self.max_workers = max(1, max_workers)
+        # ThreadManager/ImageServiceはスレッドセーフではないため保存処理は直列化する
+        self._save_lock = threading.Lock()
+
+    def run(self, items):
+        """未完了のジョブを実行し、状態ごとの件数を返す"""
+        pending = []
+        for image_path, instruction in items:
+            key = JobJournal.make_key(image_path, instruction)
+            if self.journal.is_done(key):
+                continue
+            pending.append((key, image_path, instruction))
+
+        skipped = len(items) - len(pending)
+        print(f"対象: {len(items)}件 (完了済みスキップ: {skipped}件, 実行: {len(pending)}件, 並列数: {self.max_workers})")
+
+        # 同時に投入するジョブ数を並列数に抑える（数千件でもメモリを使いすぎない）
+        queue = iter(pending)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while True:
+                    while len(in_flight) < self.max_workers:
+                        job = next(queue, None)
+                        if job is None:
+                            break
+                        in_flight.add(executor.submit(self._process, *job))
+
+                    if not in_flight:
+                        break
+
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            except KeyboardInterrupt:
+                # 実行中のジョブはrunningのまま残り、次回実行時に再試行される
+                print("中断しました。実行中のジョブの完了を待っています...")
+                wait(in_flight)
+                raise
+
+        keys = [JobJournal.make_key(image_path, instruction) for image_path, instruction in items]
+        return self.journal.summary(keys)
+
+    def _resumable_thread(self, key):
+        """前回の実行で保存を始めていたスレッドのIDとメッセージ数（なければ (None, None)）"""
+        thread_id = self.journal.entries.get(key, {}).get("thread_id")
+        if not thread_id:
+            return None, None
+        message_count = self.thread_manager.get_message_count(thread_id)
+        if message_count is None:
+            return None, None
+        return thread_id, message_count
+
+    def _process(self, key, image_path, instruction):
+        """1件の画像を編集してスレッドに保存
+
+        スレッドを作成したら保存を始める前に thread_id をジャーナルに記録し、
+        保存の途中で中断された場合は次回そのスレッドに続きを保存する（スレッドを重複して作らない）。
+        """
+        self.journal.record(key, JobJournal.STATUS_RUNNING, image=image_path, instruction=instruction)
+        try:
+            with self._save_lock:
+                thread_id, message_count = self._resumable_thread(key)
+            if message_count is not None and message_count >= 2:
+                # 前回は保存を終えてからジャーナルに記録する前に中断された
+                save_path = self.thread_manager.get_latest_image_path(thread_id)
+                self.journal.record(key, JobJournal.STATUS_DONE, thread_id=thread_id, result_path=save_path, error=None)
+                print(f"完了（前回の保存を再利用）: {image_path} -> {save_path}")
+                return
+
+            # エンコード済みのまま渡し、送信条件を満たせばデコードせずに送る
+            image = EncodedImage.from_file(image_path)
+
+            result = self.gemini_service.modify_image(image, instruction)
+            if not result.get("image"):
+                raise RuntimeError("画像データが応答に含まれていませんでした: " + result.get("text", ""))
+
+            with self._save_lock:
+                if thread_id is None:
+                    thread_id = self.thread_manager.create_new_thread(os.path.basename(image_path))
+                    message_count = 0
+                    self.journal.record(key, JobJournal.STATUS_SAVING, thread_id=thread_id)
+                if message_count == 0:
+                    self.thread_manager.add_message("user", instruction, image_path, thread_id=thread_id)
+                save_path = self.image_service.save_edited_image(result["image"], thread_id)
+                if not save_path:
+                    raise RuntimeError("編集結果の保存に失敗しました")
+                self.thread_manager.add_message("assistant", result.get("text", ""), save_path, thread_id=thread_id)
+
+            self.journal.record(key, JobJournal.STATUS_DONE, thread_id=thread_id, result_path=save_path, error=None)
+            print(f"完了: {image_path} -> {save_path}")
+        except Exception as e:
+            self.journal.record(key, JobJournal.STATUS_FAILED, error=str(e))
+            print(f"失敗: {image_path}: {e}")
+
+def main(argv=None):
+    """バッチ編集のエントリーポイント"""
+    parser = argparse.ArgumentParser(description="複数の画像にGeminiの編集指示を一括適用します")
+    parser.add_argument("--input", help="画像が入ったディレクトリ")
+    parser.add_argument("--manifest", help="画像と指示を列挙したJSON Linesファイル")
+    parser.add_argument("--instruction", help="全画像に適用する指示テキスト")
+    parser.add_argument("--workers", type=int, default=4, help="同時に送信するリクエスト数")
+    parser.add_argument("--journal", default=os.path.join(Config.SAVE_DIRECTORY, "batch_journal.jsonl"),
+                        help="進捗ジャーナルのパス（再実行時は完了済みをスキップ）")
+    parser.add_argument("--metrics", action="store_true",
+                        help="段階ごとの所要時間を記録し、終了時に計測結果ディレクトリへ書き出す")
+    parser.add_argument("--log-level", help="ログの出力レベル（DEBUG, INFO, WARNING, ERROR）")
+    args = parser.parse_args(argv)
+    Config.configure_logging(args.log_level)
+    if args.metrics:
+        metrics.enable()
+
+    if not args.input and not args.manifest:
+        parser.error("--input または --manifest を指定してください")
+
+    items = collect_items(args.input, args.manifest, args.instruction)
+    if not items:
+        parser.error("処理対象がありません（指示テキストを確認してください）")
+
+    if not Config.validate_config():
+        return 1
+
+    Config.ensure_directories()
+    journal = JobJournal(args.journal)
+    thread_manager = ThreadManager()
+    image_service = ImageService(thread_manager)
+    gemini_service = GeminiService()
+    if Config.HTTP_WARMUP:
+        gemini_service.warm_up()
+
+    editor = BatchEditor(gemini_service, thread_manager, image_service, journal, args.workers)
+    summary = editor.run(items)
+    print(f"バッチ編集終了: {summary}")
+    paths = metrics.export()
+    if paths:
+        print("計測結果: " + ", ".join(paths.values()))
+
+    return 0 if not summary.get(JobJournal.STATUS_FAILED) else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
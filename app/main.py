@@ -3,17 +3,40 @@
 
 import os
 import sys
+import time
+import logging
 from PySide6.QtWidgets import QApplication
 from PySide6.QtCore import QCoreApplication
 
 # 相対パスを使用したインポート
-print("アプリ起動開始...")
 from ui.main_window import MainWindow
 from utils.config import Config
 
+logger = logging.getLogger(__name__)
+
+# この環境変数があると起動時間を出力して終了する（tools/startup_bench.py が使う）
+STARTUP_BENCH_ENV = "GEMINI_IMG_EDITOR_STARTUP_BENCH"
+
+def attach_startup_bench(app, window):
+    """最初の描画と操作可能になった時刻（エポック秒）を出力し、両方そろったら終了する"""
+    marks = {}
+    
+    def mark(name):
+        marks[name] = time.time()
+        print(f"STARTUP {name} {marks[name]:.6f}", flush=True)
+        if "first_paint" in marks and "ready" in marks:
+            for step, seconds in window.initializer.timings.items():
+                print(f"STARTUP step:{step} {seconds:.6f}", flush=True)
+            window.close()
+            app.quit()
+    
+    window.first_painted.connect(lambda: mark("first_paint"))
+    window.services_ready.connect(lambda: mark("ready"))
+
 def main():
     """アプリケーションのメインエントリーポイント"""
-    print("main関数開始")
+    Config.configure_logging()
+    logger.info("アプリ起動開始")
     
     # アプリケーション情報を設定
     QCoreApplication.setApplicationName(Config.APP_NAME)
@@ -21,17 +44,19 @@ def main():
     QCoreApplication.setOrganizationName("GeminiImgEditor")
     
     # PySide6アプリケーションを作成
-    print("QApplicationを作成")
+    logger.debug("QApplicationを作成")
     app = QApplication(sys.argv)
     
     # メインウィンドウを作成
-    print("MainWindowを作成")
+    logger.debug("MainWindowを作成")
     window = MainWindow()
-    print("ウィンドウを表示")
+    if os.environ.get(STARTUP_BENCH_ENV):
+        attach_startup_bench(app, window)
+    logger.debug("ウィンドウを表示")
     window.show()
     
     # アプリケーションを実行
-    print("アプリケーション実行開始")
+    logger.debug("アプリケーション実行開始")
     sys.exit(app.exec())
 
 if __name__ == "__main__":
@@ -1,14 +1,28 @@
 import os
 import json
 import datetime
+import threading
 from utils.config import Config
-from utils.file_manager import FileManager
+from models.thread_store import ThreadStore
 
 class ThreadManager:
-    def __init__(self):
-        """スレッド管理の初期化"""
-        self.threads = {}  # thread_id をキーとした辞書
+    def __init__(self, store=None, writer=None):
+        """スレッド管理の初期化
+
+        writer（PersistenceQueue）を渡すとデータベースへの書き込みをバックグラウンドで行う。
+        メモリ上の要約はすぐに更新し、読み込み時は書き込み待ちのメッセージ・バリエーションをメモリ上から補う
+        （UIスレッドから呼ばれるので、書き込みの完了は待たない）。
+        UIスレッドと EditScheduler の両方から呼ばれるため、要約の読み書きはロックで保護する。
+        """
+        self.store = store or ThreadStore()
+        self.writer = writer
+        self._lock = threading.RLock()
+        self.threads = {}  # thread_id をキーとした要約（タイトル・日時・最新画像・メッセージ数）
         self.current_thread_id = None
+        # 書き込み待ちの内容（書き込みスレッドで書き終えたら取り除く）
+        self._pending_messages = {}  # thread_id -> メッセージのリスト
+        self._pending_variants = {}  # thread_id -> バリエーションのリスト
+        self._pending_variant_deletes = []  # 削除待ちの (thread_id, message_id)
         self._load_existing_threads()
         
         # 既存のスレッドがなければ新規作成
@@ -16,109 +30,248 @@ class ThreadManager:
             self.create_new_thread()
     
     def _load_existing_threads(self):
-        """既存のスレッドを読み込み"""
-        thread_ids = FileManager.get_all_thread_ids()
-        for thread_id in thread_ids:
-            thread_data = FileManager.load_thread_data(thread_id)
-            if thread_data:
-                self.threads[thread_id] = thread_data
+        """既存のスレッドの要約を読み込み（会話本体は選択されたときに読む）"""
+        # 旧形式のスレッドJSONと最新画像の複製があれば初回のみ取り込み・整理する
+        self.store.migrate_from_json()
+        self.store.collapse_latest_duplicates()
+        
+        for summary in self.store.list_threads():
+            self.threads[summary["thread_id"]] = summary
         
         # 既存のスレッドがあれば最初のスレッドを現在のスレッドに設定
-        if thread_ids:
-            self.current_thread_id = thread_ids[0]
+        if self.threads:
+            self.current_thread_id = next(iter(self.threads))
+    
+    def _write(self, fn, *args, key=None, done=None):
+        """データベースへ書き込む（writerがあればバックグラウンドで、なければその場で）
+        
+        done はバックグラウンドで書き終えた後に書き込みスレッドでロック内で呼ぶ（書き込み待ちの記録を取り除く）。
+        """
+        if self.writer is not None:
+            if done is not None:
+                fn = self._then(fn, done)
+            self.writer.submit(fn, *args, key=key)
+            return True
+        return fn(*args)
+    
+    def _then(self, fn, done):
+        """fn を実行した後に done を呼ぶ書き込み関数"""
+        def write(*args):
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    done()
+        write.__name__ = getattr(fn, "__name__", "write")
+        return write
+    
+    def get_thread(self, thread_id):
+        """スレッドの全データを取得（書き込み待ちのメッセージも含む）"""
+        # 読み込み中に書き込み待ちの記録が取り除かれないようにロック内で読む（重複はメッセージ番号で除く）
+        with self._lock:
+            summary = self.threads.get(thread_id)
+            if summary is None:
+                return None
+            thread = self.store.get_thread(thread_id)
+            if thread is None:
+                # スレッドの作成がまだ書き込まれていない
+                thread = {key: value for key, value in summary.items() if key != "message_count"}
+                thread["conversations"] = []
+            else:
+                # タイトルなどの要約はメモリ上のほうが新しい
+                thread.update({key: summary[key] for key in ("title", "last_updated_at", "latest_image_path")})
+            stored_ids = {message["message_id"] for message in thread["conversations"]}
+            thread["conversations"] += [dict(message) for message in self._pending_messages.get(thread_id, [])
+                                        if message["message_id"] not in stored_ids]
+        return thread
     
     def create_new_thread(self, title="新規会話"):
         """新しいスレッドを作成"""
-        thread_id = f"thread_{len(self.threads) + 1:02d}"
-        current_time = datetime.datetime.now().isoformat()
-        
-        thread_data = {
-            "thread_id": thread_id,
-            "created_at": current_time,
-            "last_updated_at": current_time,
-            "title": title,
-            "conversations": [],
-            "latest_image_path": None
-        }
-        
-        self.threads[thread_id] = thread_data
-        self.current_thread_id = thread_id
-        
-        # スレッドデータを保存
-        FileManager.save_thread_data(thread_id, thread_data)
-        
-        return thread_id
+        with self._lock:
+            thread_id = f"thread_{len(self.threads) + 1:02d}"
+            current_time = datetime.datetime.now().isoformat()
+            
+            if not self._write(self.store.create_thread, thread_id, title, current_time):
+                return None
+            
+            self.threads[thread_id] = {
+                "thread_id": thread_id,
+                "title": title,
+                "created_at": current_time,
+                "last_updated_at": current_time,
+                "latest_image_path": None,
+                "message_count": 0
+            }
+            self.current_thread_id = thread_id
+            
+            return thread_id
     
     def get_current_thread(self):
         """現在のスレッドデータを取得"""
-        if not self.current_thread_id or self.current_thread_id not in self.threads:
+        if not self.current_thread_id:
             return None
-        return self.threads[self.current_thread_id]
+        return self.get_thread(self.current_thread_id)
     
     def set_current_thread(self, thread_id):
         """現在のスレッドを設定"""
-        if thread_id in self.threads:
-            self.current_thread_id = thread_id
-            return True
-        return False
-    
-    def add_message(self, role, content, image_path=None):
-        """メッセージを追加"""
-        if not self.current_thread_id:
+        with self._lock:
+            if thread_id in self.threads:
+                self.current_thread_id = thread_id
+                return True
             return False
-        
-        thread = self.threads[self.current_thread_id]
-        current_time = datetime.datetime.now().isoformat()
-        
-        message_id = len(thread["conversations"]) + 1
-        message = {
-            "message_id": message_id,
-            "timestamp": current_time,
-            "role": role,
-            "content": content
-        }
-        
-        if image_path:
-            message["image_path"] = image_path
-            # 最新の画像パスを更新
-            thread["latest_image_path"] = image_path
-        
-        thread["conversations"].append(message)
-        thread["last_updated_at"] = current_time
-        
-        # スレッドデータを保存
-        FileManager.save_thread_data(self.current_thread_id, thread)
-        
-        return message_id
+    
+    def add_message(self, role, content, image_path=None, thread_id=None):
+        """メッセージを追加（thread_id省略時は現在のスレッド）"""
+        with self._lock:
+            if thread_id is None:
+                thread_id = self.current_thread_id
+            if not thread_id or thread_id not in self.threads:
+                return False
+            
+            current_time = datetime.datetime.now().isoformat()
+            
+            # 1件のINSERTとして追記する（スレッド全体は書き直さない）
+            summary = self.threads[thread_id]
+            if self.writer is not None:
+                # 書き込みは投入順に実行されるので、番号はメモリ上の件数から決まる
+                message_id = summary["message_count"] + 1
+                message = {"message_id": message_id, "timestamp": current_time, "role": role, "content": content}
+                if image_path:
+                    message["image_path"] = image_path
+                pending = self._pending_messages.setdefault(thread_id, [])
+                pending.append(message)
+                self._write(self.store.append_message, thread_id, role, content, current_time, image_path,
+                            done=lambda: self._discard_pending(self._pending_messages, thread_id, message))
+            else:
+                message_id = self.store.append_message(thread_id, role, content, current_time, image_path)
+                if message_id is None:
+                    return False
+            
+            summary["message_count"] = message_id
+            summary["last_updated_at"] = current_time
+            if image_path:
+                # 最新の画像パスを更新
+                summary["latest_image_path"] = image_path
+            
+            return message_id
     
     def get_thread_titles(self):
         """全スレッドのタイトルと識別子を取得"""
-        return {thread_id: data["title"] for thread_id, data in self.threads.items()}
+        with self._lock:
+            return {thread_id: summary["title"] for thread_id, summary in self.threads.items()}
+    
+    def get_message_count(self, thread_id):
+        """スレッドのメッセージ数を取得（スレッドがなければNone）"""
+        with self._lock:
+            summary = self.threads.get(thread_id)
+            if not summary:
+                return None
+            return summary["message_count"]
     
     def get_conversation_history(self):
         """現在のスレッドの会話履歴を取得"""
-        if not self.current_thread_id:
+        thread = self.get_current_thread()
+        if not thread:
             return []
-        
-        thread = self.threads[self.current_thread_id]
         return thread["conversations"]
     
-    def get_latest_image_path(self):
-        """現在のスレッドの最新画像パスを取得"""
-        if not self.current_thread_id:
-            return None
+    def get_latest_image_path(self, thread_id=None):
+        """スレッドの最新画像パスを取得（thread_id省略時は現在のスレッド）"""
+        with self._lock:
+            thread_id = thread_id or self.current_thread_id
+            if not thread_id or thread_id not in self.threads:
+                return None
+            
+            summary = self.threads[thread_id]
+            return summary.get("latest_image_path")
+    
+    @staticmethod
+    def _discard_pending(pending, thread_id, item):
+        """書き終えた書き込み待ちの記録を取り除く（ロック内で呼ぶ）"""
+        items = pending.get(thread_id, [])
+        if item in items:
+            items.remove(item)
+        if not items:
+            pending.pop(thread_id, None)
+    
+    def get_image_versions(self, thread_id=None):
+        """スレッドの画像の版を古い順に取得（thread_id省略時は現在のスレッド。書き込み待ちも含む）"""
+        thread_id = thread_id or self.current_thread_id
+        if not thread_id:
+            return []
+        with self._lock:
+            versions = self.store.get_image_versions(thread_id)
+            stored_ids = {version["message_id"] for version in versions}
+            versions += [{"message_id": message["message_id"], "path": message["image_path"],
+                          "created_at": message["timestamp"]}
+                         for message in self._pending_messages.get(thread_id, [])
+                         if message.get("image_path") and message["message_id"] not in stored_ids]
+        return versions
+    
+    def add_variants(self, thread_id, message_id, paths):
+        """採用されなかったバリエーションの画像を、採用した版の兄弟として記録"""
+        if not paths:
+            return True
+        current_time = datetime.datetime.now().isoformat()
+        if self.writer is None:
+            return self._write(self.store.add_variants, thread_id, message_id, list(paths), current_time)
+        with self._lock:
+            variants = [{"message_id": message_id, "path": path, "created_at": current_time} for path in paths]
+            self._pending_variants.setdefault(thread_id, []).extend(variants)
             
-        thread = self.threads[self.current_thread_id]
-        return thread.get("latest_image_path")
+            def done():
+                for variant in variants:
+                    self._discard_pending(self._pending_variants, thread_id, variant)
+            return self._write(self.store.add_variants, thread_id, message_id, list(paths), current_time, done=done)
+    
+    def get_variants(self, thread_id=None, message_id=None):
+        """スレッドのバリエーションを取得（thread_id省略時は現在のスレッド。書き込み待ちの追加・削除も反映する）"""
+        thread_id = thread_id or self.current_thread_id
+        if not thread_id:
+            return []
+        with self._lock:
+            deleted = [deleted_id for deleted_thread_id, deleted_id in self._pending_variant_deletes
+                       if deleted_thread_id == thread_id]
+            variants = [variant for variant in self.store.get_variants(thread_id, message_id)
+                        if None not in deleted and variant["message_id"] not in deleted]
+            variants += [dict(variant) for variant in self._pending_variants.get(thread_id, [])
+                         if message_id is None or variant["message_id"] == message_id]
+        return variants
+    
+    def discard_variants(self, thread_id=None, message_id=None):
+        """バリエーションの記録と画像ファイルを削除（thread_id省略時は現在のスレッド）"""
+        thread_id = thread_id or self.current_thread_id
+        if not thread_id:
+            return False
+        if self.writer is None:
+            return self._write(self._delete_variants, thread_id, message_id)
+        with self._lock:
+            # 追加の書き込み待ちは削除より先に書かれて消えるので、読み込みの対象から外す
+            pending = self._pending_variants.get(thread_id, [])
+            pending[:] = [variant for variant in pending
+                          if message_id is not None and variant["message_id"] != message_id]
+            if not pending:
+                self._pending_variants.pop(thread_id, None)
+            marker = (thread_id, message_id)
+            self._pending_variant_deletes.append(marker)
+            return self._write(self._delete_variants, thread_id, message_id,
+                               done=lambda: self._pending_variant_deletes.remove(marker))
+    
+    def _delete_variants(self, thread_id, message_id):
+        """バリエーションを削除（書き込みキューの中で実行する）"""
+        for path in self.store.delete_variants(thread_id, message_id):
+            if os.path.exists(path):
+                os.remove(path)
+        return True
     
     def update_thread_title(self, title):
         """現在のスレッドのタイトルを更新"""
-        if not self.current_thread_id:
-            return False
+        with self._lock:
+            if not self.current_thread_id:
+                return False
             
-        thread = self.threads[self.current_thread_id]
-        thread["title"] = title
-        
-        # スレッドデータを保存
-        FileManager.save_thread_data(self.current_thread_id, thread)
-        return True
+            if not self._write(self.store.update_title, self.current_thread_id, title,
+                               key=("title", self.current_thread_id)):
+                return False
+            self.threads[self.current_thread_id]["title"] = title
+            return True
@@ -0,0 +1,331 @@
+import os
+import re
+import sqlite3
+import logging
+import filecmp
+import threading
+from utils.config import Config
+from utils.file_manager import FileManager
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class ThreadStore:
+    """スレッド・メッセージ・画像の版をSQLite（WALモード）に保存するストア
+
+    メッセージの追加は1行のINSERTと要約の更新だけで、スレッド全体を書き直さない。
+    """
+
+    SCHEMA_VERSION = 1
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS threads (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            created_at TEXT,
+            last_updated_at TEXT,
+            latest_image_path TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id TEXT NOT NULL REFERENCES threads(thread_id),
+            message_id INTEGER NOT NULL,
+            timestamp TEXT,
+            role TEXT NOT NULL,
+            content TEXT,
+            image_path TEXT,
+            UNIQUE (thread_id, message_id)
+        );
+        CREATE TABLE IF NOT EXISTS image_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id TEXT NOT NULL REFERENCES threads(thread_id),
+            message_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            created_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_image_versions_thread ON image_versions (thread_id, message_id);
+        CREATE TABLE IF NOT EXISTS image_variants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id TEXT NOT NULL REFERENCES threads(thread_id),
+            message_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            created_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_image_variants_thread ON image_variants (thread_id, message_id);
+    """
+
+    THREAD_COLUMNS = "thread_id, title, created_at, last_updated_at, latest_image_path, message_count"
+
+    def __init__(self, db_path=None):
+        """データベースを開き、必要ならテーブルを作成する"""
+        self.db_path = db_path or Config.THREAD_DB_FILE
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        # バッチ処理などで複数スレッドから使うため、1つの接続をロックで守って共有する
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self._conn.executescript(self.SCHEMA)
+            self._set_meta("schema_version", str(self.SCHEMA_VERSION))
+
+    def close(self):
+        """データベースを閉じる"""
+        with self._lock:
+            self._conn.close()
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _summary(row):
+        """threads の行を要約の辞書にする"""
+        return {
+            "thread_id": row["thread_id"],
+            "title": row["title"],
+            "created_at": row["created_at"],
+            "last_updated_at": row["last_updated_at"],
+            "latest_image_path": row["latest_image_path"],
+            "message_count": row["message_count"],
+        }
+
+    @staticmethod
+    def _message(row):
+        """messages の行をスレッドJSONと同じ形のメッセージにする"""
+        message = {
+            "message_id": row["message_id"],
+            "timestamp": row["timestamp"],
+            "role": row["role"],
+            "content": row["content"],
+        }
+        if row["image_path"]:
+            message["image_path"] = row["image_path"]
+        return message
+
+    def list_threads(self):
+        """全スレッドの要約を作成順に取得（会話本体は読まない）"""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {self.THREAD_COLUMNS} FROM threads ORDER BY seq").fetchall()
+        return [self._summary(row) for row in rows]
+
+    def get_summary(self, thread_id):
+        """スレッドの要約を取得（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {self.THREAD_COLUMNS} FROM threads WHERE thread_id = ?",
+                                     (thread_id,)).fetchone()
+        return self._summary(row) if row else None
+
+    def get_thread(self, thread_id):
+        """スレッドの全データをスレッドJSONと同じ形で取得（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {self.THREAD_COLUMNS} FROM threads WHERE thread_id = ?",
+                                     (thread_id,)).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT message_id, timestamp, role, content, image_path FROM messages "
+                "WHERE thread_id = ? ORDER BY message_id", (thread_id,)).fetchall()
+
+        thread = self._summary(row)
+        del thread["message_count"]
+        thread["conversations"] = [self._message(message) for message in messages]
+        return thread
+
+    def create_thread(self, thread_id, title, created_at):
+        """スレッドを作成"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO threads (thread_id, title, created_at, last_updated_at) VALUES (?, ?, ?, ?)",
+                    (thread_id, title, created_at, created_at))
+            return True
+        except sqlite3.Error as e:
+            logger.error("スレッド作成エラー: %s", e)
+            return False
+
+    def append_message(self, thread_id, role, content, timestamp, image_path=None):
+        """メッセージを追加し、付与したメッセージ番号を返す（失敗時はNone）"""
+        try:
+            with self._lock, metrics.span("persist", thread_id=thread_id):
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute("SELECT message_count FROM threads WHERE thread_id = ?",
+                                             (thread_id,)).fetchone()
+                    if row is None:
+                        self._conn.execute("ROLLBACK")
+                        return None
+                    message_id = row["message_count"] + 1
+                    self._insert_message(thread_id, message_id, role, content, timestamp, image_path)
+                    self._conn.execute(
+                        "UPDATE threads SET message_count = ?, last_updated_at = ?, "
+                        "latest_image_path = COALESCE(?, latest_image_path) WHERE thread_id = ?",
+                        (message_id, timestamp, image_path, thread_id))
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            return message_id
+        except sqlite3.Error as e:
+            logger.error("メッセージ保存エラー: %s", e)
+            return None
+
+    def _insert_message(self, thread_id, message_id, role, content, timestamp, image_path):
+        """メッセージと画像の版を1件挿入（トランザクション内で呼ぶ）"""
+        self._conn.execute(
+            "INSERT INTO messages (thread_id, message_id, timestamp, role, content, image_path) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (thread_id, message_id, timestamp, role, content, image_path))
+        if image_path:
+            self._conn.execute(
+                "INSERT INTO image_versions (thread_id, message_id, path, created_at) VALUES (?, ?, ?, ?)",
+                (thread_id, message_id, image_path, timestamp))
+
+    def update_title(self, thread_id, title):
+        """スレッドのタイトルを更新"""
+        try:
+            with self._lock:
+                cursor = self._conn.execute("UPDATE threads SET title = ? WHERE thread_id = ?", (title, thread_id))
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error("タイトル更新エラー: %s", e)
+            return False
+
+    def get_image_versions(self, thread_id):
+        """スレッドの画像の版を古い順に取得"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, path, created_at FROM image_versions WHERE thread_id = ? ORDER BY id",
+                (thread_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_variants(self, thread_id, message_id, paths, created_at):
+        """採用されなかったバリエーションを、採用した版（message_id）の兄弟として記録"""
+        try:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT INTO image_variants (thread_id, message_id, path, created_at) VALUES (?, ?, ?, ?)",
+                    [(thread_id, message_id, path, created_at) for path in paths])
+            return True
+        except sqlite3.Error as e:
+            logger.error("バリエーション保存エラー: %s", e)
+            return False
+
+    def get_variants(self, thread_id, message_id=None):
+        """スレッドのバリエーションを取得（message_id省略時は全ての版の分）"""
+        query = "SELECT message_id, path, created_at FROM image_variants WHERE thread_id = ?"
+        params = [thread_id]
+        if message_id is not None:
+            query += " AND message_id = ?"
+            params.append(message_id)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_variants(self, thread_id, message_id=None):
+        """バリエーションの記録を削除し、削除したパスを返す（message_id省略時は全ての版の分）"""
+        with self._lock:
+            paths = [variant["path"] for variant in self.get_variants(thread_id, message_id)]
+            query = "DELETE FROM image_variants WHERE thread_id = ?"
+            params = [thread_id]
+            if message_id is not None:
+                query += " AND message_id = ?"
+                params.append(message_id)
+            self._conn.execute(query, params)
+        return paths
+
+    def migrate_from_json(self):
+        """既存のスレッドJSONを一度だけ取り込む（JSONファイルはそのまま残す）"""
+        with self._lock:
+            if self._get_meta("json_migrated"):
+                return 0
+
+        thread_ids = FileManager.get_all_thread_ids()
+        migrated = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for thread_id in thread_ids:
+                    thread = FileManager.load_thread_data(thread_id)
+                    if not thread or self._conn.execute(
+                            "SELECT 1 FROM threads WHERE thread_id = ?", (thread_id,)).fetchone():
+                        continue
+                    conversations = thread.get("conversations", [])
+                    self._conn.execute(
+                        "INSERT INTO threads (thread_id, title, created_at, last_updated_at, latest_image_path, "
+                        "message_count) VALUES (?, ?, ?, ?, ?, ?)",
+                        (thread_id, thread.get("title", ""), thread.get("created_at"),
+                         thread.get("last_updated_at"), thread.get("latest_image_path"), len(conversations)))
+                    # 番号は並び順で振り直す（JSONの message_id は重複していることがある）
+                    for message_id, message in enumerate(conversations, 1):
+                        self._insert_message(thread_id, message_id, message.get("role", ""),
+                                             message.get("content", ""), message.get("timestamp"),
+                                             message.get("image_path"))
+                    migrated += 1
+                self._set_meta("json_migrated", "1")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if migrated:
+            logger.info("スレッドJSONをデータベースに取り込みました: %s件", migrated)
+        return migrated
+
+    def collapse_latest_duplicates(self, save_dir=None):
+        """旧形式の {thread_id}_latest.* の複製を一度だけ整理する
+
+        最新の編集結果と同じ内容なら削除する。最新の編集結果が見つからない場合は
+        latest_image_path をそのファイルに向けて残す。内容が異なるものは残す。
+        """
+        with self._lock:
+            if self._get_meta("latest_collapsed"):
+                return 0
+
+        save_dir = save_dir or Config.SAVE_DIRECTORY
+        pattern = re.compile(r"^(?P<thread_id>.+)_latest\.[A-Za-z0-9]+$")
+        removed = 0
+        try:
+            names = os.listdir(save_dir)
+        except OSError:
+            names = []
+
+        for name in names:
+            match = pattern.match(name)
+            if not match:
+                continue
+            summary = self.get_summary(match.group("thread_id"))
+            if summary is None:
+                continue
+
+            path = os.path.join(save_dir, name)
+            latest = summary["latest_image_path"]
+            try:
+                if latest and os.path.abspath(latest) != os.path.abspath(path) and os.path.exists(latest):
+                    if filecmp.cmp(latest, path, shallow=False):
+                        os.remove(path)
+                        removed += 1
+                elif not latest or not os.path.exists(latest):
+                    with self._lock:
+                        self._conn.execute("UPDATE threads SET latest_image_path = ? WHERE thread_id = ?",
+                                           (path, summary["thread_id"]))
+            except OSError as e:
+                logger.warning("最新画像の整理エラー: %s: %s", path, e)
+
+        with self._lock:
+            self._set_meta("latest_collapsed", "1")
+        if removed:
+            logger.info("最新画像の複製を削除しました: %s件", removed)
+        return removed
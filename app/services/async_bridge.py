@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import itertools
+from concurrent.futures import CancelledError
+from PySide6.QtCore import QObject, Signal
+
+class AsyncBridge(QObject):
+    """Qtとasyncioの橋渡し（1本のバックグラウンドスレッドでイベントループを回す）"""
+
+    # ジョブID と結果
+    finished = Signal(int, object)
+    # ジョブID と エラーメッセージ
+    error = Signal(int, str)
+    # キャンセルされたジョブID
+    cancelled = Signal(int)
+    # ジョブID と 途中経過（submit_streaming で投入したジョブのみ）
+    progress = Signal(int, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.loop = asyncio.new_event_loop()
+        self._futures = {}  # ジョブIDをキーとした concurrent.futures.Future
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run_loop, name="AsyncBridge", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        """イベントループをバックグラウンドスレッドで実行"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """コルーチンをイベントループに投入し、ジョブIDを返す"""
+        return self._submit(next(self._job_ids), coro)
+
+    def submit_streaming(self, fn, *args, **kwargs):
+        """fn(*args, on_progress=..., **kwargs) のコルーチンを投入し、ジョブIDを返す
+
+        on_progress に渡した途中経過は progress シグナルでUIスレッドに届く。
+        """
+        job_id = next(self._job_ids)
+        on_progress = lambda event: self.progress.emit(job_id, event)
+        return self._submit(job_id, fn(*args, on_progress=on_progress, **kwargs))
+
+    def _submit(self, job_id, coro):
+        """ジョブIDを付けてコルーチンを投入"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        """ジョブ完了時にシグナルを発行（ループのスレッドから呼ばれ、UIスレッドへキューイングされる）"""
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+        try:
+            result = future.result()
+        except CancelledError:
+            self.cancelled.emit(job_id)
+        except Exception as e:
+            self.error.emit(job_id, str(e) or type(e).__name__)
+        else:
+            self.finished.emit(job_id, result)
+
+    def cancel(self, job_id):
+        """ジョブをキャンセル（実行中の通信も中断される）"""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            return False
+        return future.cancel()
+
+    def pending_count(self):
+        """未完了のジョブ数を取得"""
+        with self._lock:
+            return len(self._futures)
+
+    def shutdown(self, timeout=5.0):
+        """全ジョブをキャンセルしてイベントループを停止"""
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            future.cancel()
+
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,339 @@
+import time
+import asyncio
+import logging
+from services.gemini_service import GeminiService
+from services.rate_limiter import RateLimiter
+from utils.config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class AsyncGeminiService(GeminiService):
+    """asyncio版のGemini API連携サービス（client.aioを使用）"""
+
+    def __init__(self, max_concurrency=None, timeout=None, client=None, backup_model=None):
+        """同時実行数とタイムアウトを指定して初期化"""
+        super().__init__(client, backup_model)
+        self.max_concurrency = max_concurrency or Config.MAX_CONCURRENT_REQUESTS
+        self.timeout = timeout or Config.REQUEST_TIMEOUT
+        # セマフォはイベントループ上で最初に使うときに作成する
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        """同時実行数を制限するセマフォを取得"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def warm_up_async(self):
+        """APIサーバーへの接続を先に確立し、接続の統計を返す（リクエストを送るイベントループ上で実行する）"""
+        if self.transport is None:
+            return {}
+        await self.transport.warm_up_async()
+        return self.get_connection_stats()
+
+    async def modify_image_async(self, image, instruction_text, thread_id=None, timeout=None, use_cache=True,
+                                 on_progress=None):
+        """画像を指定した指示に基づいて編集する（タスクのキャンセルで通信も中断される）
+
+        on_progress を渡すとストリーミングで受信し、テキストと画像を届いた時点で通知する
+        （キャッシュから返す場合は通知しない）。
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        # キャッシュの読み書きはハッシュ計算とディスクI/Oを伴うためループの外で行う
+        loop = asyncio.get_running_loop()
+        cache_key = None
+        if use_cache and self.response_cache:
+            cache_key = await loop.run_in_executor(
+                None, self.response_cache.make_key, image, instruction_text, self.MODEL_NAME, self._build_config()
+            )
+            cached = await loop.run_in_executor(None, self.response_cache.get, cache_key)
+            if cached:
+                return cached
+
+        # 送信用の縮小・再エンコードもループの外で行う（アップロード済みの参照で送れるなら必要になるまで行わない）
+        upload = await loop.run_in_executor(None, self._defer_upload, image)
+
+        # 空き枠と送信枠（レート制限）を待つ時間はタイムアウトに含めない
+        async with self._get_semaphore():
+            granted = asyncio.Event()
+            if on_progress is not None:
+                request = self._modify_image_stream_async(upload, instruction_text, thread_id, on_progress, granted)
+            else:
+                request = self._modify_image_async(upload, instruction_text, thread_id, granted)
+            task = asyncio.ensure_future(request)
+            try:
+                await self._wait_granted(granted, task)
+                result = await asyncio.wait_for(task, timeout)
+            except asyncio.TimeoutError:
+                logger.warning("画像編集がタイムアウトしました: %s秒", timeout)
+                raise TimeoutError(f"リクエストが{timeout}秒以内に完了しませんでした")
+            finally:
+                task.cancel()
+
+        if cache_key and result["image"]:
+            await loop.run_in_executor(None, self.response_cache.put, cache_key, result)
+        return result
+
+    @staticmethod
+    async def _wait_granted(granted, task):
+        """送信枠が得られる（granted がセットされる）か task が終わるまで待つ"""
+        waiter = asyncio.ensure_future(granted.wait())
+        try:
+            await asyncio.wait({waiter, task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+
+    async def _modify_image_async(self, upload, instruction_text, thread_id=None, granted=None):
+        """modify_image と同じ処理を非同期で実行（granted は最初の送信枠を得たときにセットする）"""
+        logger.info("非同期画像編集開始: スレッドID=%s, 指示テキスト=%s", thread_id, instruction_text)
+        logger.debug("使用モデル: %s", self.MODEL_NAME)
+
+        # 結果格納用
+        result = {"text": "", "image": None}
+        with metrics.span("edit", thread_id=thread_id) as span:
+            await self._run_models_async(
+                lambda: self._request_primary_async(upload, instruction_text), upload, instruction_text, result,
+                granted=granted,
+            )
+            span.set(model=result["model"], hedged=result["hedged"])
+        result["upload"] = upload.get_stats()
+        return self._finish(result)
+
+    async def _request_primary_async(self, upload, instruction_text):
+        """主モデルにリクエストを送り、テキストと画像を返す"""
+        if not self.client:
+            logger.error("Clientが初期化されていないため、リクエストを送信できません")
+            return {"text": "", "image": None}
+
+        return await self._with_image_part_async(
+            upload, lambda image_part: self._send_primary_async(image_part, instruction_text))
+
+    async def _send_primary_async(self, image_part, instruction_text):
+        """画像のPartを付けて主モデルに送信する"""
+        part = {"text": "", "image": None}
+        logger.debug("Geminiに改造リクエストを送信中...")
+        with self.track_connection() as connection, metrics.span("api_wait", model=self.MODEL_NAME):
+            response = await self.client.aio.models.generate_content(
+                model=self.MODEL_NAME,
+                contents=[instruction_text, image_part],
+                config=self._build_config(),
+            )
+        part["connection"] = connection
+        self._log_connection(connection)
+        return self._parse_response(response, part)
+
+    async def _with_image_part_async(self, upload, request):
+        """_with_image_part の非同期版（request は image_part を受け取ってコルーチンを作る関数）"""
+        entry = None
+        if self.file_uploads is not None:
+            entry = await self.file_uploads.get_async(self.client, upload)
+        if entry is None:
+            await upload.prepare_async()
+            return await request(self._inline_image_part(upload))
+        try:
+            return await request(self._uploaded_image_part(entry))
+        except Exception as e:
+            self._raise_if_stale_reference(upload, e)
+            raise
+
+    async def _request_backup_async(self, upload, instruction_text, on_progress=None, timing=None):
+        """バックアップモデルにリクエストを送り、テキストと画像を返す
+
+        timing を渡すと、まだ記録がなければ送信から画像を受け取るまでの秒数を time_to_image に記録する。
+        """
+        # バックアップモデルには参照で送れないので、まだならループの外でエンコードする
+        await upload.prepare_async()
+        model, contents, options = self._build_backup_request(upload, instruction_text)
+
+        logger.debug("バックアップモデルにリクエスト送信...")
+        sent = time.perf_counter()
+        with metrics.span("api_wait", model=self.BACKUP_MODEL_NAME):
+            response = await model.generate_content_async(contents, **options)
+        part = self._parse_backup_response(response, {"text": "", "image": None})
+        if timing is not None and part["image"] and timing["time_to_image"] is None:
+            timing["time_to_image"] = time.perf_counter() - sent
+        if on_progress is not None and part["image"]:
+            on_progress({"type": "image", "image": part["image"]})
+        return part
+
+    async def _call_model_async(self, model_name, request, tokens=0, can_retry=None, on_acquired=None):
+        """送信枠を待ってからモデルを呼び出し、成否（画像が得られたか）とレイテンシを記録して結果を返す
+
+        request はコルーチンを作る関数（再試行のたびに呼ぶ）。can_retry() が False なら再試行しない。
+        on_acquired() は送信枠を得て送信する直前に呼ばれる。
+        """
+        started = time.perf_counter()
+        try:
+            part = await self.retry_policy.call_async(
+                self._rate_limiter(model_name), request, tokens, can_retry, on_acquired)
+        except asyncio.CancelledError:
+            # 打ち切ったリクエストは成否を記録しない
+            self.model_health.release(model_name)
+            raise
+        except Exception as e:
+            # CancelledErrorはExceptionではないためここでは捕まえない
+            logger.error("%s の呼び出しエラー: %s", model_name, e)
+            self.model_health.record_failure(model_name)
+            return {"text": "", "image": None}
+
+        if part["image"]:
+            self.model_health.record_success(model_name, time.perf_counter() - started)
+        else:
+            self.model_health.record_failure(model_name)
+        return part
+
+    async def _run_models_async(self, primary_request, upload, instruction_text, result, on_progress=None,
+                                primary_can_retry=None, granted=None, timing=None):
+        """主モデル（必要ならバックアップモデルも）を呼び出して result に反映する
+
+        主モデルが送信枠を得てから HEDGE_DELAY 秒以内に画像を返さなければバックアップにも送り、先に画像を返したほうを使う。
+        負けたほうのリクエストはキャンセルする。primary_request は主モデルのコルーチンを作る関数。
+        granted（asyncio.Event）は最初のモデルが送信枠を得たときにセットする。
+        timing はバックアップモデルの画像が使われたときの time_to_image の記録先。
+        """
+        if granted is None:
+            granted = asyncio.Event()
+        backup_request = lambda: self._request_backup_async(upload, instruction_text, on_progress, timing)
+        result["model"] = None
+        result["hedged"] = False
+        tokens = RateLimiter.estimate_tokens(instruction_text, upload.size)
+
+        first = self._choose_first_model()
+        if first == self.BACKUP_MODEL_NAME:
+            self._merge_part(result, first, await self._call_model_async(
+                first, backup_request, tokens, on_acquired=granted.set))
+            return result
+
+        primary = asyncio.ensure_future(
+            self._call_model_async(first, primary_request, tokens, primary_can_retry, granted.set))
+        tasks = {primary: first}
+        try:
+            if self._can_hedge():
+                # 送信枠を待っている間はヘッジの待ち時間に数えない
+                await self._wait_granted(granted, primary)
+                done, _ = await asyncio.wait(tasks, timeout=self.model_health.hedge_delay(first))
+                if not done and self.model_health.allow(self.BACKUP_MODEL_NAME):
+                    logger.info("主モデルの応答が遅いため、バックアップモデルにも送信します: %s", self.BACKUP_MODEL_NAME)
+                    backup_task = asyncio.ensure_future(
+                        self._call_model_async(self.BACKUP_MODEL_NAME, backup_request, tokens)
+                    )
+                    tasks[backup_task] = self.BACKUP_MODEL_NAME
+                    result["hedged"] = True
+
+            # 先に画像を返したほうを使う
+            pending = set(tasks)
+            while pending and not result["image"]:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self._merge_part(result, tasks[task], task.result())
+        finally:
+            # 負けたほう（タイムアウトやキャンセルの場合は両方）の通信を止める
+            for task in tasks:
+                task.cancel()
+
+        if result["image"] or result["hedged"]:
+            return result
+        if not self.backup_enabled or not self.model_health.allow(self.BACKUP_MODEL_NAME):
+            return result
+
+        # 主モデルが画像を返さなかったので、バックアップモデルで再試行
+        logger.info("画像が取得できなかったため、画像生成専用モデルで再試行します")
+        self._merge_part(result, self.BACKUP_MODEL_NAME,
+                         await self._call_model_async(self.BACKUP_MODEL_NAME, backup_request, tokens))
+        return result
+
+    def _finish(self, result):
+        """完了のログを出して結果を返す"""
+        logger.info("画像編集が完了しました")
+        if not result["image"]:
+            logger.warning("画像データが応答に含まれていませんでした")
+        return result
+
+    async def _modify_image_stream_async(self, upload, instruction_text, thread_id, on_progress, granted=None):
+        """generate_content_stream で受信し、テキストと画像を届いた時点で on_progress に渡す
+
+        on_progress には {"type": "text", "text": 追加分} と {"type": "image", "image": EncodedImage} を渡す。
+        result["timing"] には送信から最初のチャンクまで（ttfb）・送信から画像まで・全体の秒数を記録する
+        （ttfb と画像までは送信枠・アップロード・再試行の待ちを含まない）。
+        主モデルが遅くバックアップモデルの画像が先に届いた場合は、その画像を on_progress に渡し、
+        バックアップへの送信から画像までを time_to_image とする。
+        """
+        logger.info("非同期画像編集開始（ストリーミング）: スレッドID=%s, 指示テキスト=%s", thread_id, instruction_text)
+        logger.debug("使用モデル: %s", self.MODEL_NAME)
+
+        # 結果格納用
+        timing = {"ttfb": None, "time_to_image": None, "total": None}
+        result = {"text": "", "image": None, "timing": timing}
+
+        started = time.perf_counter()
+        with metrics.span("edit", thread_id=thread_id, streaming=True) as span:
+            await self._run_models_async(
+                lambda: self._request_primary_stream_async(upload, instruction_text, on_progress, timing),
+                upload, instruction_text, result, on_progress,
+                # 途中まで受信して表示したストリームは再試行しない（同じテキストが二重に表示されるため）
+                primary_can_retry=lambda: timing["ttfb"] is None,
+                granted=granted,
+                timing=timing,
+            )
+            span.set(model=result["model"], hedged=result["hedged"])
+        timing["total"] = time.perf_counter() - started
+        result["upload"] = upload.get_stats()
+        logger.debug("ストリーミング: %s", ", ".join(
+            f"{name}={seconds * 1000:.0f}ms" for name, seconds in timing.items() if seconds is not None))
+        return self._finish(result)
+
+    async def _request_primary_stream_async(self, upload, instruction_text, on_progress, timing):
+        """主モデルからストリーミングで受信し、チャンクごとにテキストと画像を通知する"""
+        if not self.client:
+            logger.error("Clientが初期化されていないため、リクエストを送信できません")
+            return {"text": "", "image": None}
+
+        # 参照のエラーは最初のチャンクより前に返るので、送り直すかは primary_can_retry で決まる
+        return await self._with_image_part_async(
+            upload,
+            lambda image_part: self._send_primary_stream_async(image_part, instruction_text, on_progress, timing),
+        )
+
+    async def _send_primary_stream_async(self, image_part, instruction_text, on_progress, timing):
+        """画像のPartを付けて主モデルに送信し、チャンクごとにテキストと画像を通知する
+
+        ttfb と time_to_image はこの送信（送信枠を得て再試行の待ちも終えた後）から数える。
+        """
+        part = {"text": "", "image": None}
+        logger.debug("Geminiに改造リクエストを送信中...")
+        sent = time.perf_counter()
+        with self.track_connection() as connection, metrics.span("api_wait", model=self.MODEL_NAME, streaming=True):
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self.MODEL_NAME,
+                contents=[instruction_text, image_part],
+                config=self._build_config(),
+            )
+            try:
+                async for chunk in stream:
+                    elapsed = time.perf_counter() - sent
+                    if timing["ttfb"] is None:
+                        timing["ttfb"] = elapsed
+                        metrics.observe("api_ttfb", elapsed, sent, model=self.MODEL_NAME)
+
+                    # チャンクごとに解析し、届いた分だけ通知する
+                    received = {"text": "", "image": None}
+                    self._parse_response(chunk, received)
+                    if received["text"]:
+                        part["text"] += received["text"]
+                        on_progress({"type": "text", "text": received["text"]})
+                    if received["image"] is not None:
+                        if timing["time_to_image"] is None:
+                            timing["time_to_image"] = elapsed
+                        part["image"] = received["image"]
+                        on_progress({"type": "image", "image": received["image"]})
+            except Exception as e:
+                if part["image"] is None:
+                    raise
+                # 画像は届いて表示済みなので、その後で途切れたストリームは受信した分で完了とする
+                logger.warning("画像の受信後にストリームが中断しました: %s", e)
+        part["connection"] = connection
+        self._log_connection(connection)
+        return part
@@ -0,0 +1,338 @@
+import itertools
+from collections import deque
+from PySide6.QtCore import QObject, Signal
+from utils.config import Config
+
+class _EditJob:
+    """編集キューの1件"""
+
+    def __init__(self, job_id, thread_id, instruction, priority, seq, variants=1):
+        self.job_id = job_id
+        self.thread_id = thread_id
+        self.instruction = instruction
+        self.priority = priority
+        self.seq = seq
+        self.variants = variants
+        self.bridge_job_ids = set()  # 未完了の AsyncBridge のジョブID
+        self.results = [None] * variants  # バリエーションごとの結果
+        self.errors = []
+        self.cancelled = False
+        # ストリーミングで受信済みのテキストと画像（スレッドを切り替えて戻ったときの再表示用）
+        self.text = ""
+        self.image = None
+
+    def variant_images(self):
+        """画像が得られたバリエーションを (番号, 結果) のリストで返す"""
+        return [(index, result) for index, result in enumerate(self.results) if result and result.get("image")]
+
+class EditScheduler(QObject):
+    """画像編集ジョブのスケジューラ（複数スレッドの編集を並行して実行する）
+
+    同じスレッドのジョブは投入順に1件ずつ実行し、前の編集結果を次の編集の入力にする。
+    スレッドをまたいだ実行順は優先度（小さいほど先）と投入順で決め、同時に max_running 件まで実行する。
+    編集結果の保存もここで行うので、表示していないスレッドのジョブも最後まで進む。
+    ユーザーの指示は投入時ではなく結果と一緒に保存する（待機中の指示が先の編集の応答より前に並ばないように）。
+
+    variants に2以上を指定したジョブは同じ指示を並行して送り、届いた順に variant_ready で通知する。
+    全て揃うと variants_ready を発行し、choose_variant で1つを採用するまでスレッドの次のジョブは待つ。
+    シグナルの受け取りとジョブの操作はUIスレッドで行う。
+    """
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    # ジョブID と スレッドID
+    job_queued = Signal(int, str)
+    job_started = Signal(int, str)
+    # ジョブID と スレッドID と 途中経過（{"type": "text" | "image", ...}。バリエーションが1つのジョブのみ）
+    job_progress = Signal(int, str, object)
+    # ジョブID と スレッドID と 結果（保存先の image_path を追加した辞書）
+    job_finished = Signal(int, str, object)
+    # ジョブID と スレッドID と エラーメッセージ
+    job_failed = Signal(int, str, str)
+    job_cancelled = Signal(int, str)
+    # ジョブID と スレッドID と バリエーション番号 と 結果（届いた順に1件ずつ）
+    variant_ready = Signal(int, str, int, object)
+    # ジョブID と スレッドID と 画像が得られたバリエーションの番号のリスト（採用待ちになったとき）
+    variants_ready = Signal(int, str, object)
+    # 待機中・実行中のジョブ数が変わったとき
+    state_changed = Signal()
+
+    def __init__(self, bridge, gemini_service, thread_manager, image_service, max_running=None, parent=None):
+        super().__init__(parent)
+        self.bridge = bridge
+        self.gemini_service = gemini_service
+        self.thread_manager = thread_manager
+        self.image_service = image_service
+        self.max_running = max_running or Config.MAX_CONCURRENT_REQUESTS
+
+        self._queues = {}  # thread_id -> 待機中の _EditJob の deque
+        self._running = {}  # thread_id -> 実行中の _EditJob（スレッドごとに1件まで）
+        self._choosing = {}  # thread_id -> バリエーションの採用待ちの _EditJob
+        self._bridge_jobs = {}  # AsyncBridge のジョブID -> (_EditJob, バリエーション番号)
+        self._job_ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._closed = False
+
+        self.bridge.finished.connect(self._on_bridge_finished)
+        self.bridge.error.connect(self._on_bridge_error)
+        self.bridge.cancelled.connect(self._on_bridge_cancelled)
+        self.bridge.progress.connect(self._on_bridge_progress)
+
+    def submit(self, thread_id, instruction, priority=None, variants=1):
+        """編集ジョブを投入し、ジョブIDを返す（variants は並行して生成するバリエーション数）"""
+        if priority is None:
+            priority = self.PRIORITY_NORMAL
+        variants = max(1, min(variants, Config.MAX_VARIANTS))
+        job = _EditJob(next(self._job_ids), thread_id, instruction, priority, next(self._seq), variants)
+        self._queues.setdefault(thread_id, deque()).append(job)
+        self.job_queued.emit(job.job_id, thread_id)
+        self._dispatch()
+        self.state_changed.emit()
+        return job.job_id
+
+    def cancel(self, job_id):
+        """ジョブをキャンセル（待機中なら取り除き、実行中なら通信を中断し、採用待ちなら全て破棄する）"""
+        for thread_id, queue in self._queues.items():
+            for job in queue:
+                if job.job_id == job_id:
+                    queue.remove(job)
+                    self.job_cancelled.emit(job_id, thread_id)
+                    self.state_changed.emit()
+                    return True
+
+        for job in self._running.values():
+            if job.job_id == job_id:
+                return self._cancel_running(job)
+
+        for job in self._choosing.values():
+            if job.job_id == job_id:
+                return self.discard_variants(job_id)
+        return False
+
+    def cancel_thread(self, thread_id):
+        """スレッドのジョブを全てキャンセルし、キャンセルした件数を返す"""
+        # 実行中のジョブを止めたときに次のジョブが始まらないよう、待機中のものから取り除く
+        queue = self._queues.pop(thread_id, deque())
+        for job in queue:
+            self.job_cancelled.emit(job.job_id, thread_id)
+        count = len(queue)
+
+        job = self._running.get(thread_id)
+        if job is not None and self._cancel_running(job):
+            count += 1
+        job = self._choosing.get(thread_id)
+        if job is not None and self.discard_variants(job.job_id):
+            count += 1
+        if count:
+            self.state_changed.emit()
+        return count
+
+    def _cancel_running(self, job):
+        """実行中のジョブの通信を全て中断する"""
+        job.cancelled = True
+        cancelled = False
+        for bridge_job_id in list(job.bridge_job_ids):
+            cancelled = self.bridge.cancel(bridge_job_id) or cancelled
+        return cancelled
+
+    def choose_variant(self, job_id, index):
+        """採用待ちのジョブのバリエーションを採用してスレッドに保存し、残りは兄弟として残す"""
+        job = self._find_choosing(job_id)
+        if job is None or not (0 <= index < job.variants) or not (job.results[index] or {}).get("image"):
+            return False
+        del self._choosing[job.thread_id]
+
+        result = self._commit(job, job.results[index])
+        siblings = [other["image"] for other_index, other in job.variant_images() if other_index != index]
+        if siblings and result["message_id"]:
+            # 兄弟は採用した版と同じ編集番号で保存し、あとで discard_variants で削除できるようにする
+            paths = self.image_service.save_variant_images(siblings, job.thread_id, result["message_id"])
+            self.thread_manager.add_variants(job.thread_id, result["message_id"], paths)
+        result["variant"] = index
+
+        self.job_finished.emit(job.job_id, job.thread_id, result)
+        self._dispatch()
+        self.state_changed.emit()
+        return True
+
+    def discard_variants(self, job_id):
+        """採用待ちのジョブのバリエーションを全て破棄する（スレッドの画像は変えない）"""
+        job = self._find_choosing(job_id)
+        if job is None:
+            return False
+        del self._choosing[job.thread_id]
+        self.job_cancelled.emit(job.job_id, job.thread_id)
+        self._dispatch()
+        self.state_changed.emit()
+        return True
+
+    def _find_choosing(self, job_id):
+        for job in self._choosing.values():
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def active_count(self, thread_id=None):
+        """実行中（採用待ちを含む）と待機中のジョブ数を (実行中, 待機中) で返す（thread_id省略時は全スレッド）"""
+        if thread_id is None:
+            return (len(self._running) + len(self._choosing),
+                    sum(len(queue) for queue in self._queues.values()))
+        running = 1 if thread_id in self._running or thread_id in self._choosing else 0
+        return running, len(self._queues.get(thread_id, ()))
+
+    def get_running_job(self, thread_id):
+        """スレッドで実行中・採用待ちのジョブの状態を返す（なければNone）"""
+        job = self._running.get(thread_id) or self._choosing.get(thread_id)
+        if job is None:
+            return None
+        return {
+            "job_id": job.job_id,
+            "instruction": job.instruction,
+            "text": job.text,
+            "image": job.image,
+            "variants": job.variants,
+            "results": list(job.results),
+            "choosing": thread_id in self._choosing,
+        }
+
+    def get_queued_instructions(self, thread_id):
+        """スレッドの待機中のジョブの指示を実行順に返す（まだ保存されていないので表示用）"""
+        return [job.instruction for job in self._queues.get(thread_id, ())]
+
+    def shutdown(self):
+        """待機中のジョブを破棄し、以降は投入されても実行しない（実行中のジョブは AsyncBridge が止める）"""
+        self._closed = True
+        self._queues.clear()
+        self._choosing.clear()
+
+    def _dispatch(self):
+        """空き枠がある限り、各スレッドの先頭のジョブを優先度順に開始する"""
+        while not self._closed and len(self._running) < self.max_running:
+            candidates = [
+                (min((job.priority, job.seq) for job in queue), thread_id)
+                for thread_id, queue in self._queues.items()
+                if queue and thread_id not in self._running and thread_id not in self._choosing
+            ]
+            if not candidates:
+                return
+            # 後ろに優先度の高いジョブが待っているスレッドは先頭から前倒しで実行する（スレッド内の順序は変えない）
+            _, thread_id = min(candidates)
+            queue = self._queues[thread_id]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[thread_id]
+            self._start(job)
+
+    def _start(self, job):
+        """ジョブを開始（入力はスレッドの現在の画像＝直前の編集結果）"""
+        image = self.image_service.get_thread_image(job.thread_id)
+        if image is None:
+            self._record_instruction(job)
+            self.job_failed.emit(job.job_id, job.thread_id, "画像が読み込まれていません。画像を開いてください。")
+            return
+
+        modify = self.gemini_service.modify_image_async
+        if job.variants > 1:
+            # 同じ指示を並行して送る（キャッシュを使うと同じ結果が返るので使わない）
+            for index in range(job.variants):
+                bridge_job_id = self.bridge.submit(
+                    modify(image, job.instruction, thread_id=job.thread_id, use_cache=False)
+                )
+                self._track(job, bridge_job_id, index)
+        elif Config.STREAMING_ENABLED:
+            # テキストと画像は届いた時点で job_progress に渡される
+            self._track(job, self.bridge.submit_streaming(modify, image, job.instruction, thread_id=job.thread_id), 0)
+        else:
+            self._track(job, self.bridge.submit(modify(image, job.instruction, thread_id=job.thread_id)), 0)
+        self._running[job.thread_id] = job
+        self.job_started.emit(job.job_id, job.thread_id)
+
+    def _track(self, job, bridge_job_id, index):
+        job.bridge_job_ids.add(bridge_job_id)
+        self._bridge_jobs[bridge_job_id] = (job, index)
+
+    def _record_instruction(self, job):
+        """ジョブの指示をユーザーのメッセージとしてスレッドに保存する"""
+        self.thread_manager.add_message("user", job.instruction, thread_id=job.thread_id)
+
+    def _commit(self, job, result):
+        """指示と編集結果をスレッドに保存する（スレッドの画像も更新され、次のジョブの入力になる）"""
+        result = dict(result)
+        result["image_path"] = None
+        result["message_id"] = None
+        self._record_instruction(job)
+        if result.get("image"):
+            # 保存は書き込みキューに投入するだけで、スレッドの画像はすぐに更新される
+            image_path = self.image_service.save_edited_image(result["image"], job.thread_id)
+            result["image_path"] = image_path
+            result["message_id"] = self.thread_manager.add_message(
+                "assistant", result.get("text", ""), image_path, thread_id=job.thread_id)
+        return result
+
+    def _on_bridge_progress(self, bridge_job_id, event):
+        """ストリーミングの途中経過"""
+        entry = self._bridge_jobs.get(bridge_job_id)
+        if entry is None:
+            return
+        job = entry[0]
+        if event["type"] == "text":
+            job.text += event["text"]
+        elif event["type"] == "image":
+            job.image = event["image"]
+        self.job_progress.emit(job.job_id, job.thread_id, event)
+
+    def _on_bridge_finished(self, bridge_job_id, result):
+        """バリエーションが1件届いたとき"""
+        entry = self._bridge_jobs.pop(bridge_job_id, None)
+        if entry is None:
+            return
+        job, index = entry
+        job.results[index] = result
+        if job.variants > 1 and not job.cancelled:
+            self.variant_ready.emit(job.job_id, job.thread_id, index, result)
+        self._complete(job, bridge_job_id)
+
+    def _on_bridge_error(self, bridge_job_id, error_message):
+        """編集でエラーが発生したとき"""
+        entry = self._bridge_jobs.pop(bridge_job_id, None)
+        if entry is None:
+            return
+        job, index = entry
+        job.errors.append(error_message)
+        if job.variants > 1 and not job.cancelled:
+            self.variant_ready.emit(job.job_id, job.thread_id, index, {"text": error_message, "image": None})
+        self._complete(job, bridge_job_id)
+
+    def _on_bridge_cancelled(self, bridge_job_id):
+        """実行中の編集がキャンセルされたとき"""
+        entry = self._bridge_jobs.pop(bridge_job_id, None)
+        if entry is None:
+            return
+        entry[0].cancelled = True
+        self._complete(entry[0], bridge_job_id)
+
+    def _complete(self, job, bridge_job_id):
+        """ジョブの通信が全て終わったら結果を保存してから、同じスレッドの次のジョブを開始する"""
+        job.bridge_job_ids.discard(bridge_job_id)
+        if job.bridge_job_ids:
+            return
+        self._running.pop(job.thread_id, None)
+
+        if job.cancelled:
+            self.job_cancelled.emit(job.job_id, job.thread_id)
+        elif job.variants > 1 and job.variant_images():
+            # 採用されるまでスレッドの次のジョブは始めない
+            self._choosing[job.thread_id] = job
+            self.variants_ready.emit(job.job_id, job.thread_id, [index for index, _ in job.variant_images()])
+        elif any(job.results):
+            result = next(result for result in job.results if result)
+            self.job_finished.emit(job.job_id, job.thread_id, self._commit(job, result))
+        else:
+            # 応答は得られなかったが、指示は履歴に残す
+            self._record_instruction(job)
+            self.job_failed.emit(job.job_id, job.thread_id, job.errors[0] if job.errors else "")
+
+        self._dispatch()
+        self.state_changed.emit()
@@ -0,0 +1,271 @@
+import os
+import io
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+from datetime import datetime
+from utils.config import Config
+from utils.encoded_image import EncodedImage
+from utils.metrics import metrics
+from services.rate_limiter import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+class StaleReferenceError(Exception):
+    """アップロード済みの参照が使えなくなっていた（参照は取り除いてあるので、送り直せばアップロードし直すか画像データで送る）
+
+    RetryPolicy は一時的なエラーとして扱うので、送り直しも送信枠と再試行の回数に従う。
+    """
+
+class FileUploadCache:
+    """送信画像を Files API に一度だけアップロードし、返されたファイルの参照を元の画像の内容のハッシュで記録する
+
+    同じ画像を再び送るとき（バリエーション・同じ画像への別の指示など）は画像データの代わりに参照（URI）を送る。
+    キーは送信用にエンコードする前の画像なので、参照があれば送信用のエンコードも省ける。
+    1回しか送らない画像はアップロードの往復が無駄になるため、min_uses 回目に送るときからアップロードする。
+    参照には有効期限があり、期限が近いものは使わずにアップロードし直す。
+    参照は CACHE_DIRECTORY の索引ファイルに保存し、再起動後も期限内なら使い回す。
+    同じ画像の同時のアップロードは1回にまとめる。
+    """
+
+    INDEX_FILE = "uploaded_files.json"
+    # 参照が使えなくなっていたとき（期限切れ・削除済み・別のAPIキー）の応答コード
+    STALE_REFERENCE_CODES = {403, 404}
+    # そのうちエラーメッセージが参照先のファイルについてのもの
+    # （例: "You do not have permission to access the File files/abc or it may not exist."。APIキーの権限不足などは含めない）
+    STALE_REFERENCE_MESSAGE = re.compile(r"\bfiles?\b", re.IGNORECASE)
+    # アップロードに失敗したら、この間はアップロードを試さずに直接送る（毎回の失敗で往復を増やさないように）
+    FAILURE_COOLDOWN_SECONDS = 300
+    # 送った回数を覚えておく画像の数（古いものから忘れる）
+    MAX_TRACKED_IMAGES = 1024
+
+    def __init__(self, cache_dir=None, min_bytes=None, min_uses=None, ttl_seconds=None, margin_seconds=None,
+                 clock=time.time):
+        self.index_path = os.path.join(cache_dir or Config.CACHE_DIRECTORY, self.INDEX_FILE)
+        self.min_bytes = min_bytes if min_bytes is not None else Config.FILE_UPLOAD_MIN_BYTES
+        self.min_uses = min_uses if min_uses is not None else Config.FILE_UPLOAD_MIN_USES
+        self.ttl_seconds = ttl_seconds or Config.FILE_UPLOAD_TTL_SECONDS
+        self.margin_seconds = margin_seconds if margin_seconds is not None else Config.FILE_UPLOAD_EXPIRY_MARGIN_SECONDS
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}  # キー -> {"name", "uri", "mime_type", "bytes"（アップロードしたバイト数）, "expires_at"（エポック秒）}
+        self._key_locks = {}  # キー -> [同期版のロック, 待っている数]
+        self._async_key_locks = {}  # キー -> [非同期版のロック, 待っている数]（イベントループ上でのみ使う）
+        self._retry_at = 0.0  # アップロードを再び試す時刻（失敗後の待機）
+        self._uses = OrderedDict()  # キー -> この画像を送った編集の数
+
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.reused = 0
+        self.reused_bytes = 0
+        self.failures = 0
+        self.invalidated = 0
+
+        self._load()
+
+    @staticmethod
+    def make_key(upload):
+        """エンコード前の画像の内容のハッシュ（EncodedImage でなければNoneを返し、アップロードしない）"""
+        if not isinstance(upload.image, EncodedImage):
+            return None
+        return upload.image.digest()
+
+    def note_use(self, upload):
+        """この画像を送る編集を1件数え、期限内の参照があるかを返す（あれば送信用のエンコードを省ける）"""
+        key = self.make_key(upload)
+        if key is None:
+            return False
+        with self._lock:
+            self._uses[key] = self._uses.pop(key, 0) + 1
+            while len(self._uses) > self.MAX_TRACKED_IMAGES:
+                self._uses.popitem(last=False)
+            entry = self._entries.get(key)
+            return entry is not None and self._is_valid(entry, self._clock())
+
+    def _check(self, key):
+        """(期限内の参照 or None, アップロードを試してよいか) を返す
+
+        失敗後の待機中と、まだ min_uses 回送っていない画像は試さない。
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            return entry, self._clock() >= self._retry_at and self._uses.get(key, 0) >= self.min_uses
+
+    def _load(self):
+        """保存済みの索引を読み込む（期限が近いものは読み飛ばす）"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("アップロード済みファイルの索引を読み込めませんでした: %s", e)
+            return
+        now = self._clock()
+        self._entries = {key: entry for key, entry in entries.items() if self._is_valid(entry, now)}
+
+    def _save(self):
+        """索引を一時ファイル経由で書き出す（ロック内で呼ぶ）"""
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning("アップロード済みファイルの索引を保存できませんでした: %s", e)
+
+    def _is_valid(self, entry, now):
+        return entry["expires_at"] - self.margin_seconds > now
+
+    def _lookup(self, key):
+        """ロック内で呼ぶ"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not self._is_valid(entry, self._clock()):
+            del self._entries[key]
+            return None
+        self.reused += 1
+        self.reused_bytes += entry.get("bytes", 0)
+        return entry
+
+    def _expires_at(self, file):
+        """応答の有効期限（エポック秒。なければ保持期間から計算）"""
+        expiration = getattr(file, "expiration_time", None)
+        if isinstance(expiration, str):
+            try:
+                expiration = datetime.fromisoformat(expiration.replace("Z", "+00:00"))
+            except ValueError:
+                expiration = None
+        if isinstance(expiration, datetime):
+            return expiration.timestamp()
+        return self._clock() + self.ttl_seconds
+
+    def _store(self, key, upload, file):
+        """アップロードしたファイルの参照を記録して返す"""
+        entry = {
+            "name": getattr(file, "name", None),
+            "uri": file.uri,
+            "mime_type": getattr(file, "mime_type", None) or upload.mime_type,
+            "bytes": len(upload.data),
+            "expires_at": self._expires_at(file),
+        }
+        logger.debug("画像をアップロードしました: %s (%.0fKB)", entry["uri"], len(upload.data) / 1024)
+        with self._lock:
+            self._entries[key] = entry
+            self.uploads += 1
+            self.uploaded_bytes += len(upload.data)
+            now = self._clock()
+            self._entries = {key: entry for key, entry in self._entries.items() if self._is_valid(entry, now)}
+            self._save()
+        return entry
+
+    def _on_upload_error(self, error):
+        logger.warning("画像をアップロードできなかったため、画像データを直接送ります: %s", error)
+        with self._lock:
+            self.failures += 1
+            self._retry_at = self._clock() + self.FAILURE_COOLDOWN_SECONDS
+
+    @contextlib.contextmanager
+    def _key_lock(self, key):
+        """同じキーのアップロードを1回にまとめるロック（最後に待っていたものが抜けたら取り除く）"""
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    @contextlib.asynccontextmanager
+    async def _async_key_lock(self, key):
+        """_key_lock の非同期版"""
+        entry = self._async_key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._async_key_locks[key]
+
+    def get(self, client, upload):
+        """参照を返す（なければアップロードする。Noneなら呼び出し側は画像データを直接送る）
+
+        小さい画像はアップロードの往復のほうが高くつくので、アップロードせずにNoneを返す。
+        """
+        key = self.make_key(upload)
+        if key is None:
+            return None
+        with self._key_lock(key):
+            entry, can_upload = self._check(key)
+            if entry is not None or not can_upload or len(upload.data) < self.min_bytes:
+                return entry
+            try:
+                with metrics.span("file_upload", bytes=len(upload.data)):
+                    file = client.files.upload(
+                        file=io.BytesIO(upload.data), config={"mime_type": upload.mime_type})
+            except Exception as e:
+                self._on_upload_error(e)
+                return None
+            return self._store(key, upload, file)
+
+    async def get_async(self, client, upload):
+        """get の非同期版（client.aio.files を使う）"""
+        key = self.make_key(upload)
+        if key is None:
+            return None
+        async with self._async_key_lock(key):
+            entry, can_upload = self._check(key)
+            if entry is not None or not can_upload:
+                return entry
+            await upload.prepare_async()
+            if len(upload.data) < self.min_bytes:
+                return None
+            try:
+                with metrics.span("file_upload", bytes=len(upload.data)):
+                    file = await client.aio.files.upload(
+                        file=io.BytesIO(upload.data), config={"mime_type": upload.mime_type})
+            except Exception as e:
+                self._on_upload_error(e)
+                return None
+            return self._store(key, upload, file)
+
+    def invalidate(self, upload):
+        """使えなくなっていた参照を取り除く"""
+        key = self.make_key(upload)
+        if key is None:
+            return
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidated += 1
+                self._save()
+
+    def is_stale_reference_error(self, error):
+        """参照が使えなくなっていたことによるエラーか"""
+        return (RetryPolicy.status_code(error) in self.STALE_REFERENCE_CODES
+                and self.STALE_REFERENCE_MESSAGE.search(str(error)) is not None)
+
+    def get_stats(self):
+        """アップロード回数・参照を使い回した回数と、それぞれのバイト数"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "uploads": self.uploads,
+                "uploaded_bytes": self.uploaded_bytes,
+                "reused": self.reused,
+                "reused_bytes": self.reused_bytes,
+                "failures": self.failures,
+                "invalidated": self.invalidated,
+            }
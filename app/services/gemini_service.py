@@ -1,17 +1,61 @@
 import os
-import io
-import base64
+import ssl
+import logging
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
 import certifi
-import httplib2
-from PIL import Image
 from google import genai
+from google.genai import types
 from utils.config import Config
+from services.response_cache import ResponseCache
+from services.upload_encoder import UploadEncoder
+from services.file_upload_cache import FileUploadCache, StaleReferenceError
+from services.http_transport import HttpTransport
+from services.model_health import ModelHealth
+from services.rate_limiter import RateLimiter, RetryPolicy
+from utils.encoded_image import EncodedImage
+from utils.metrics import metrics
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 class GeminiService:
-    def __init__(self):
-        """Gemini API連携サービスの初期化"""
-        self._setup_api()
+    MODEL_NAME = Config.MODEL_NAME
+    BACKUP_MODEL_NAME = "gemini-2.0-flash-exp-image-generation-image-generation"
+    
+    def __init__(self, client=None, backup_model=None):
+        """Gemini API連携サービスの初期化（clientを渡すとAPI初期化を省略。backup_model はバックアップモデルの差し替え用）"""
+        # 画像が得られなかったときにバックアップモデルで再試行するか
+        self.backup_enabled = Config.BACKUP_MODEL_ENABLED
+        
+        # 同じ入力に対する結果のキャッシュ
+        self.response_cache = ResponseCache() if Config.RESPONSE_CACHE_ENABLED else None
+        
+        # 送信画像の縮小・再エンコード（帯域の実測値も保持する）
+        self.upload_encoder = UploadEncoder()
+        # 送信画像を Files API に一度だけアップロードし、同じ画像は参照で送る
+        self.file_uploads = FileUploadCache() if Config.FILE_UPLOAD_ENABLED else None
+        
+        # API呼び出しで共有するkeep-aliveのHTTPクライアント（clientを渡した場合は使わない）
+        self.transport = None
+        
+        # バックアップモデルは初回に一度だけ設定・作成して使い回す
+        self._backup_model = backup_model
+        self._backup_lock = threading.Lock()
+        
+        # モデルごとの成功率・レイテンシ（ヘッジの待ち時間とサーキットブレーカーに使う）
+        self.model_health = ModelHealth()
+        # 一時的なエラー（429・5xx）の再試行（送信枠はプロセス全体でモデルごとに共有する RateLimiter で待つ）
+        self.retry_policy = RetryPolicy()
+        # ヘッジ実行で主モデルとバックアップを並行して呼ぶためのスレッド（同期版のみ。初回に作成）
+        self._hedge_executor = None
+        
+        if client is not None:
+            self.client = client
+        else:
+            self._setup_api()
     
     def _setup_api(self):
         """API初期化とSSL証明書の設定"""
@@ -19,243 +63,466 @@ class GeminiService:
         api_key = Config.API_KEY
         
         if not api_key:
-            print("エラー: Google API キーが設定されていません。")
+            logger.error("Google API キーが設定されていません。")
+            self.client = None
             return False
         
         # SSL証明書の設定
         cert_path = os.environ.get("SSL_CERT_FILE")
         if cert_path and os.path.exists(cert_path):
             os.environ["SSL_CERT_FILE"] = cert_path
-            print(f"SSL証明書を使用: {cert_path}")
+            logger.debug("SSL証明書を使用: %s", cert_path)
         else:
             # 証明書が設定されていない場合、certifiのパスを使用
             default_cert = certifi.where()
             os.environ["SSL_CERT_FILE"] = default_cert
             os.environ["REQUESTS_CA_BUNDLE"] = default_cert
-            print(f"標準SSL証明書を使用: {default_cert}")
+            logger.debug("標準SSL証明書を使用: %s", default_cert)
         
-        # HTTPクライアントのCA証明書を設定
-        self.http = httplib2.Http(ca_certs=os.environ["SSL_CERT_FILE"])
+        # 接続を使い回すHTTPクライアント（送信帯域を計測するフック付き）を同期・非同期の両方で共有する
+        ssl_context = ssl.create_default_context(cafile=os.environ["SSL_CERT_FILE"])
+        self.transport = HttpTransport(
+            verify=ssl_context,
+            request_hooks=[self.upload_encoder.on_request],
+            async_request_hooks=[self.upload_encoder.on_async_request],
+        )
+        http_options = types.HttpOptions(
+            httpx_client=self.transport.client,
+            httpx_async_client=self.transport.async_client,
+        )
         
         # 絵を改造させる.pyと同じ方法でクライアント初期化
         try:
-            self.client = genai.Client(api_key=api_key)
-            print("genai.Client を使用して初期化しました")
+            self.client = genai.Client(api_key=api_key, http_options=http_options)
+            logger.debug("genai.Client を使用して初期化しました")
         except Exception as e:
-            print(f"genai.Client 初期化エラー: {e}")
+            logger.error("genai.Client 初期化エラー: %s", e)
             self.client = None
             return False
         
-        print("Gemini API初期化が完了しました")
+        logger.info("Gemini API初期化が完了しました")
         return True
     
-    def modify_image(self, image, instruction_text, thread_id=None):
-        """画像を指定した指示に基づいて編集する"""
-        print(f"画像編集開始: スレッドID={thread_id}, 指示テキスト={instruction_text}")
+    def track_connection(self):
+        """この中で送ったリクエストの接続情報（新規接続かどうか等）を記録する"""
+        if self.transport is None:
+            return contextlib.nullcontext({})
+        return self.transport.track()
+    
+    def get_connection_stats(self):
+        """接続の再利用の統計を取得（共有クライアントを使っていなければNone）"""
+        if self.transport is None:
+            return None
+        return self.transport.get_stats()
+    
+    def get_model_stats(self):
+        """モデルごとの成功率・レイテンシ・回路の状態を取得"""
+        return self.model_health.get_stats()
+    
+    def warm_up(self):
+        """APIサーバーへの接続とTLSハンドシェイクを先に済ませる（同期クライアント）"""
+        if self.transport is None:
+            return False
+        return self.transport.warm_up()
+    
+    @staticmethod
+    def _log_connection(connection):
+        """リクエストが既存の接続を使ったかどうかをログに出力"""
+        if not connection.get("requests"):
+            return
+        if connection["new_connection"]:
+            logger.debug("接続: 新規 (TCP %.0fms, TLS %.0fms)",
+                         connection["connect_seconds"] * 1000, connection["tls_seconds"] * 1000)
+        else:
+            logger.debug("接続: 再利用")
+    
+    def modify_image(self, image, instruction_text, thread_id=None, use_cache=True):
+        """画像を指定した指示に基づいて編集する（use_cache=Falseでキャッシュを使わない）"""
+        logger.info("画像編集開始: スレッドID=%s, 指示テキスト=%s", thread_id, instruction_text)
         
         try:
             # サンプルコードと同じモデル名を使用
-            model_name = "gemini-2.0-flash-exp-image-generation"
-            print(f"使用モデル: {model_name}")
+            model_name = self.MODEL_NAME
+            logger.debug("使用モデル: %s", model_name)
             
             # 結果格納用
             result = {"text": "", "image": None}
+            config = self._build_config()
             
-            # 設定オブジェクト - テキストと画像の両方を返すように設定
-            print("GenerateContentConfig で設定")
-            from google.genai.types import GenerateContentConfig
-            config = GenerateContentConfig(response_modalities=['Text', 'Image'])
+            # 同じ画像・指示・設定の結果がキャッシュにあればAPIを呼ばない
+            cache_key = None
+            if use_cache and self.response_cache:
+                cache_key = self.response_cache.make_key(image, instruction_text, model_name, config)
+                cached = self.response_cache.get(cache_key)
+                if cached:
+                    return cached
             
-            if self.client:
-                try:
-                    print("Geminiに改造リクエストを送信中...")
-                    response = self.client.models.generate_content(
-                        model=model_name,
-                        contents=[
-                            instruction_text,
-                            image  # 画像オブジェクトをそのまま使用
-                        ],
-                        config=config,
-                    )
-                    
-                    print(f"レスポンスタイプ: {type(response)}")
-                    
-                    # レスポンスから画像とテキストを取り出す（サンプルコードに合わせる）
-                    if hasattr(response, 'candidates') and response.candidates:
-                        parts = response.candidates[0].content.parts
-                        print(f"レスポンスのパート数: {len(parts)}")
-                        
-                        for i, part in enumerate(parts):
-                            if hasattr(part, 'inline_data') and part.inline_data:
-                                # 画像データを取得
-                                print(f"Part {i} は画像データです")
-                                image_data = part.inline_data.data
-                                mime_type = part.inline_data.mime_type
-                                print(f"MIMEタイプ: {mime_type}")
-                                
-                                # ファイル拡張子を決定
-                                ext = mime_type.split('/')[-1]
-                                
-                                try:
-                                    # サンプルコードと同様のBase64デコード処理
-                                    if isinstance(image_data, str):
-                                        # 引用符などの余分な文字を削除
-                                        if image_data.startswith('"') and image_data.endswith('"'):
-                                            image_data = image_data[1:-1]
-                                        # Base64デコード
-                                        image_bytes = base64.b64decode(image_data)
-                                    else:
-                                        # すでにバイナリデータの場合
-                                        image_bytes = image_data
-                                    
-                                    # デバッグ情報
-                                    print(f"デコード後バイト長: {len(image_bytes)}")
-                                    print(f"デコード後バイト先頭: {image_bytes[:20]}")
-                                    
-                                    # デバッグ用ファイル保存（設定がオンの場合のみ）
-                                    if Config.DEBUG_SAVE_IMAGES:
-                                        debug_path = os.path.join(Config.SAVE_DIRECTORY, f"debug_raw.{ext}")
-                                        with open(debug_path, "wb") as f:
-                                            f.write(image_bytes)
-                                        print(f"デバッグ用に生データを保存: {debug_path}")
-                                    
-                                    # 画像を開く
-                                    result_image = Image.open(io.BytesIO(image_bytes))
-                                    print(f"画像を正常に開きました: サイズ={result_image.size}, モード={result_image.mode}")
-                                    result["image"] = result_image
-                                    
-                                    # デバッグ用に保存（設定がオンの場合のみ）
-                                    if Config.DEBUG_SAVE_IMAGES:
-                                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                        debug_image_path = os.path.join(Config.SAVE_DIRECTORY, f"debug_image_{timestamp}.{ext}")
-                                        result_image.save(debug_image_path)
-                                        print(f"デバッグ用に画像を保存: {debug_image_path}")
-                                    
-                                except Exception as img_err:
-                                    print(f"画像処理エラー: {img_err}")
-                                    import traceback
-                                    traceback.print_exc()
-                                    
-                                    # バイナリ形式で直接保存を試みる（サンプルコードと同様）
-                                    try:
-                                        if isinstance(image_bytes, bytes) and Config.DEBUG_SAVE_IMAGES:
-                                            bin_path = os.path.join(Config.SAVE_DIRECTORY, f"direct_binary_{timestamp}.{ext}")
-                                            with open(bin_path, "wb") as f:
-                                                f.write(image_bytes)
-                                            print(f"バイナリとして直接保存しました: {bin_path}")
-                                    except Exception as bin_error:
-                                        print(f"バイナリ保存エラー: {bin_error}")
-                            
-                            elif hasattr(part, 'text') and part.text:
-                                # テキストを取得
-                                print(f"Part {i} はテキストデータです: {part.text[:50]}...")
-                                result["text"] += part.text
-                    else:
-                        print("レスポンスにcandidatesが含まれていません")
-                
-                except Exception as e:
-                    print(f"Gemini API呼び出しエラー: {e}")
-                    import traceback
-                    traceback.print_exc()
-            else:
-                print("Clientが初期化されていないため、リクエストを送信できません")
+            # 送信用に縮小・再エンコード（アップロード済みの参照で送れるなら必要になるまで行わない）
+            upload = self._defer_upload(image)
             
-            # 画像がない場合は、バックアップモデルを試す
-            if not result["image"]:
-                print("画像が取得できなかったため、画像生成専用モデルで再試行します")
-                try:
-                    # バックアップはサンプルコードとは異なるAPIを使用
-                    backup_model_name = "gemini-2.0-flash-exp-image-generation-image-generation"
-                    print(f"バックアップモデル使用: {backup_model_name}")
-                    
-                    # genaiモジュールを直接使用
-                    import google.generativeai as genai_alt
-                    genai_alt.configure(api_key=Config.API_KEY)
-                    model = genai_alt.GenerativeModel(backup_model_name)
-                    
-                    # 設定
-                    generation_config = {
-                        "temperature": 1.0,
-                        "top_p": 0.95,
-                        "top_k": 40,
-                        "max_output_tokens": 8192,
-                    }
-                    
-                    # 安全設定を緩和
-                    safety_settings = {
-                        "harassment": "block_none",
-                        "hate_speech": "block_none",
-                        "dangerous_content": "block_none"
-                    }
-                    
-                    # バイト配列に変換
-                    img_byte_arr = io.BytesIO()
-                    image.save(img_byte_arr, format=image.format or 'PNG')
-                    img_byte_arr.seek(0)
-                    
-                    print("バックアップモデルにリクエスト送信...")
-                    response = model.generate_content(
-                        [instruction_text, {"mime_type": "image/png", "data": img_byte_arr.getvalue()}],
-                        generation_config=generation_config,
-                        safety_settings=safety_settings
-                    )
-                    
-                    # レスポンスの処理
-                    if hasattr(response, "parts"):
-                        parts = response.parts
-                        print(f"バックアップモデル: レスポンスのパート数: {len(parts)}")
-                        
-                        for i, part in enumerate(parts):
-                            if hasattr(part, 'inline_data') and part.inline_data:
-                                # 画像データを取得
-                                print(f"Part {i} は画像データです")
-                                image_data = part.inline_data.data
-                                
-                                try:
-                                    # サンプルコードと同様のBase64デコード処理
-                                    if isinstance(image_data, str):
-                                        # 引用符などの余分な文字を削除
-                                        if image_data.startswith('"') and image_data.endswith('"'):
-                                            image_data = image_data[1:-1]
-                                    
-                                    # Base64デコード
-                                    image_bytes = base64.b64decode(image_data)
-                                    
-                                    # 画像を開く
-                                    backup_image = Image.open(io.BytesIO(image_bytes))
-                                    print(f"バックアップ画像を取得: サイズ={backup_image.size}, モード={backup_image.mode}")
-                                    result["image"] = backup_image
-                                    
-                                    # デバッグ用に保存（設定がオンの場合のみ）
-                                    if Config.DEBUG_SAVE_IMAGES:
-                                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                        debug_path = os.path.join(Config.SAVE_DIRECTORY, f"backup_image_{timestamp}.png")
-                                        backup_image.save(debug_path)
-                                        print(f"バックアップ画像を保存: {debug_path}")
-                                    
-                                except Exception as img_err:
-                                    print(f"バックアップ画像処理エラー: {img_err}")
-                    
-                    # テキスト応答の処理
-                    if hasattr(response, "text") and not result["text"]:
-                        result["text"] = response.text
-                
-                except Exception as backup_err:
-                    print(f"バックアップモデルでのリトライ中にエラー: {backup_err}")
-                    import traceback
-                    traceback.print_exc()
+            # 主モデルの状態に応じてバックアップモデルも使う（遅ければ並行して送り、先に画像を返したほうを使う）
+            with metrics.span("edit", thread_id=thread_id) as span:
+                self._run_models(upload, instruction_text, config, result)
+                span.set(model=result["model"], hedged=result["hedged"])
+            result["upload"] = upload.get_stats()
             
-            print("画像編集が完了しました")
+            logger.info("画像編集が完了しました")
             if not result["image"]:
-                print("警告: 画像データが応答に含まれていませんでした")
+                logger.warning("画像データが応答に含まれていませんでした")
+            elif cache_key:
+                self.response_cache.put(cache_key, result)
             
             return result
             
         except Exception as e:
-            print(f"画像編集中にエラーが発生しました: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("画像編集中にエラーが発生しました: %s", e)
+            raise
+    
+    def _request_primary(self, upload, instruction_text, config):
+        """主モデルにリクエストを送り、テキストと画像を返す"""
+        if not self.client:
+            logger.error("Clientが初期化されていないため、リクエストを送信できません")
+            return {"text": "", "image": None}
+        
+        return self._with_image_part(
+            upload, lambda image_part: self._send_primary(image_part, instruction_text, config))
+    
+    def _send_primary(self, image_part, instruction_text, config):
+        """画像のPartを付けて主モデルに送信する"""
+        part = {"text": "", "image": None}
+        logger.debug("Geminiに改造リクエストを送信中...")
+        with self.track_connection() as connection, metrics.span("api_wait", model=self.MODEL_NAME):
+            response = self.client.models.generate_content(
+                model=self.MODEL_NAME,
+                contents=[instruction_text, image_part],
+                config=config,
+            )
+        part["connection"] = connection
+        self._log_connection(connection)
+        return self._parse_response(response, part)
+    
+    @staticmethod
+    def _inline_image_part(upload):
+        """画像データをそのまま載せるPart"""
+        return types.Part.from_bytes(data=upload.data, mime_type=upload.mime_type)
+    
+    @staticmethod
+    def _uploaded_image_part(entry):
+        """アップロード済みのファイルを参照するPart"""
+        return types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mime_type"])
+    
+    def _defer_upload(self, image):
+        """送信画像を用意する（アップロード済みの参照があれば、送信用のエンコードは必要になるまで行わない）
+        
+        参照がなければここでエンコードしておく（送信枠を得てからエンコードを待たないように）。
+        """
+        upload = self.upload_encoder.defer(image)
+        if self.file_uploads is None or not self.file_uploads.note_use(upload):
+            upload.prepare()
+        return upload
+    
+    def _with_image_part(self, upload, request):
+        """送信画像のPartを付けて request(image_part) を呼ぶ
+        
+        アップロード済みの参照があれば（なければアップロードして）参照で送り、アップロードできなければ画像データを直接送る。
+        参照が使えなくなっていた（期限切れ・削除済み）ときは取り除いて StaleReferenceError を送出する
+        （送り直しは RetryPolicy が送信枠を得てから行い、そのときはアップロードし直すか画像データで送る）。
+        """
+        entry = self.file_uploads.get(self.client, upload) if self.file_uploads is not None else None
+        if entry is None:
+            return request(self._inline_image_part(upload))
+        try:
+            return request(self._uploaded_image_part(entry))
+        except Exception as e:
+            self._raise_if_stale_reference(upload, e)
             raise
+    
+    def _raise_if_stale_reference(self, upload, error):
+        """参照が使えなくなっていたエラーなら参照を取り除いて StaleReferenceError を送出する"""
+        if not self.file_uploads.is_stale_reference_error(error):
+            return
+        logger.warning("アップロード済みの画像を参照できなかったため、参照を使わずに送り直します: %s", error)
+        self.file_uploads.invalidate(upload)
+        raise StaleReferenceError(str(error)) from error
+    
+    def get_file_upload_stats(self):
+        """送信画像のアップロード回数・参照を使い回した回数（アップロードが無効なら空）"""
+        return self.file_uploads.get_stats() if self.file_uploads is not None else {}
+    
+    def _request_backup(self, upload, instruction_text):
+        """バックアップモデルにリクエストを送り、テキストと画像を返す"""
+        model, contents, options = self._build_backup_request(upload, instruction_text)
+        
+        logger.debug("バックアップモデルにリクエスト送信...")
+        with metrics.span("api_wait", model=self.BACKUP_MODEL_NAME):
+            response = model.generate_content(contents, **options)
+        return self._parse_backup_response(response, {"text": "", "image": None})
+    
+    @staticmethod
+    def _rate_limiter(model_name):
+        """モデルの送信枠（レート制限が無効ならNone）"""
+        if not Config.RATE_LIMIT_ENABLED:
+            return None
+        return RateLimiter.for_model(model_name)
+    
+    def get_rate_limit_stats(self):
+        """モデルごとの送信枠の統計（待ち行列の長さ・待った時間・429の回数・再試行回数）"""
+        return RateLimiter.all_stats()
+    
+    def _call_model(self, model_name, request, tokens=0, on_acquired=None):
+        """送信枠を待ってからモデルを呼び出し、成否（画像が得られたか）とレイテンシを記録して結果を返す
+        
+        一時的なエラーは RetryPolicy に従って再試行し、それでも失敗したものを失敗として記録する。
+        on_acquired() は送信枠を得て送信する直前に呼ばれる。
+        """
+        started = time.perf_counter()
+        try:
+            part = self.retry_policy.call(self._rate_limiter(model_name), request, tokens, on_acquired)
+        except Exception as e:
+            logger.exception("%s の呼び出しエラー: %s", model_name, e)
+            self.model_health.record_failure(model_name)
+            return {"text": "", "image": None}
+        
+        if part["image"]:
+            self.model_health.record_success(model_name, time.perf_counter() - started)
+        else:
+            self.model_health.record_failure(model_name)
+        return part
+    
+    def _choose_first_model(self):
+        """最初に送るモデルを決める（主モデルの回路が開いていて、バックアップが使えればバックアップ）
+        
+        どのモデルにも送れなければ、失敗するだけのリクエストを送らずにすぐエラーにする。
+        """
+        if self.model_health.allow(self.MODEL_NAME):
+            return self.MODEL_NAME
+        if self.backup_enabled and self.model_health.allow(self.BACKUP_MODEL_NAME):
+            logger.warning("主モデルへの送信を停止中のため、バックアップモデルに直接送ります: %s", self.BACKUP_MODEL_NAME)
+            return self.BACKUP_MODEL_NAME
+        
+        models = [self.MODEL_NAME] + ([self.BACKUP_MODEL_NAME] if self.backup_enabled else [])
+        retry_in = min(self.model_health.retry_in(model) for model in models)
+        logger.warning("全てのモデルへの送信を停止中のため、リクエストを送りません: %s", ", ".join(models))
+        raise RuntimeError(
+            f"モデルの呼び出しが続けて失敗したため、送信を停止しています。{max(1, round(retry_in))}秒ほど後に再度お試しください。"
+        )
+    
+    def _can_hedge(self):
+        """主モデルが遅いときにバックアップにも送れるか"""
+        return self.backup_enabled and Config.HEDGE_ENABLED
+    
+    def _merge_part(self, result, model_name, part):
+        """モデルの結果を result に反映する（画像は最初に得られたものを使い、テキストは主モデルを優先）"""
+        if model_name == self.MODEL_NAME:
+            result["text"] += part["text"]
+            if "connection" in part:
+                result["connection"] = part["connection"]
+        elif not result["text"]:
+            result["text"] = part["text"]
+        if part["image"] and not result["image"]:
+            result["image"] = part["image"]
+            result["model"] = model_name
+    
+    def _get_hedge_executor(self):
+        with self._backup_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=2 * Config.MAX_CONCURRENT_REQUESTS, thread_name_prefix="GeminiHedge"
+                )
+            return self._hedge_executor
+    
+    def _run_models(self, upload, instruction_text, config, result):
+        """主モデル（必要ならバックアップモデルも）を呼び出して result に反映する
+        
+        主モデルが送信枠を得てから HEDGE_DELAY 秒以内に応答しなければバックアップにも送り、先に画像を返したほうを使う。
+        同期版では負けたほうのリクエストは止められないため、バックグラウンドで終わるのを待たずに返す。
+        """
+        requests = {
+            self.MODEL_NAME: lambda: self._request_primary(upload, instruction_text, config),
+            self.BACKUP_MODEL_NAME: lambda: self._request_backup(upload, instruction_text),
+        }
+        result["model"] = None
+        result["hedged"] = False
+        tokens = RateLimiter.estimate_tokens(instruction_text, upload.size)
+        
+        first = self._choose_first_model()
+        if first == self.BACKUP_MODEL_NAME:
+            self._merge_part(result, first, self._call_model(first, requests[first], tokens))
+            return result
+        
+        if not self._can_hedge():
+            self._merge_part(result, first, self._call_model(first, requests[first], tokens))
+            return self._retry_with_backup(result, requests, tokens)
+        
+        executor = self._get_hedge_executor()
+        granted = threading.Event()
+        primary = executor.submit(self._call_model, first, requests[first], tokens, granted.set)
+        futures = {primary: first}
+        # 送信枠を待っている間はヘッジの待ち時間に数えない（枠を得ずに終わった場合も先に進む）
+        primary.add_done_callback(lambda future: granted.set())
+        granted.wait()
+        try:
+            part = primary.result(timeout=self.model_health.hedge_delay(first))
+        except FutureTimeoutError:
+            if not self.model_health.allow(self.BACKUP_MODEL_NAME):
+                part = primary.result()
+            else:
+                logger.info("主モデルの応答が遅いため、バックアップモデルにも送信します: %s", self.BACKUP_MODEL_NAME)
+                futures[executor.submit(self._call_model, self.BACKUP_MODEL_NAME,
+                                        requests[self.BACKUP_MODEL_NAME], tokens)] = self.BACKUP_MODEL_NAME
+                result["hedged"] = True
+                
+                # 先に画像を返したほうを使う
+                pending = set(futures)
+                while pending and not result["image"]:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._merge_part(result, futures[future], future.result())
+                return result
+        
+        self._merge_part(result, first, part)
+        return self._retry_with_backup(result, requests, tokens)
+    
+    def _retry_with_backup(self, result, requests, tokens=0):
+        """主モデルが画像を返さなかったときはバックアップモデルで再試行する"""
+        if result["image"] or not self.backup_enabled or not self.model_health.allow(self.BACKUP_MODEL_NAME):
+            return result
+        logger.info("画像が取得できなかったため、画像生成専用モデルで再試行します")
+        self._merge_part(result, self.BACKUP_MODEL_NAME,
+                         self._call_model(self.BACKUP_MODEL_NAME, requests[self.BACKUP_MODEL_NAME], tokens))
+        return result
+    
+    def _build_config(self):
+        """設定オブジェクト - テキストと画像の両方を返すように設定"""
+        from google.genai.types import GenerateContentConfig
+        return GenerateContentConfig(response_modalities=['Text', 'Image'])
+    
+    def _parse_response(self, response, result):
+        """レスポンスから画像とテキストを取り出す（サンプルコードに合わせる）"""
+        logger.debug("レスポンスタイプ: %s", type(response))
+        
+        if not (hasattr(response, 'candidates') and response.candidates):
+            logger.debug("レスポンスにcandidatesが含まれていません")
+            return result
+        
+        # ストリーミングの最後のチャンクなど、終了理由だけでパートを含まない候補もある
+        parts = getattr(getattr(response.candidates[0], 'content', None), 'parts', None)
+        if not parts:
+            logger.debug("レスポンスにパートが含まれていません")
+            return result
+        logger.debug("レスポンスのパート数: %d", len(parts))
+        
+        for i, part in enumerate(parts):
+            if hasattr(part, 'inline_data') and part.inline_data:
+                # 画像データを取得
+                logger.debug("Part %d は画像データです", i)
+                image_data = part.inline_data.data
+                mime_type = part.inline_data.mime_type
+                logger.debug("MIMEタイプ: %s", mime_type)
+                
+                try:
+                    # バイト列は1つのバッファのまま保持し、表示・保存まで持ち回る
+                    with metrics.span("response_parse", mime_type=mime_type):
+                        encoded = EncodedImage.from_inline_data(image_data, mime_type)
+                        
+                        # ヘッダーのみ読んで画像として有効か確認（画素はデコードしない）
+                        width, height = encoded.size
+                    logger.debug("画像を正常に開きました: サイズ=%s, 形式=%s, %dバイト",
+                                 (width, height), encoded.mime_type, len(encoded.data))
+                    result["image"] = encoded
+                    
+                    # デバッグ用に保存（設定がオンの場合のみ）
+                    if Config.DEBUG_SAVE_IMAGES:
+                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        debug_image_path = os.path.join(Config.SAVE_DIRECTORY, f"debug_image_{timestamp}.{encoded.extension}")
+                        encoded.save(debug_image_path)
+                        logger.debug("デバッグ用に画像を保存: %s", debug_image_path)
+                    
+                except Exception as img_err:
+                    logger.exception("画像処理エラー: %s", img_err)
+            
+            elif hasattr(part, 'text') and part.text:
+                # テキストを取得
+                logger.debug("Part %d はテキストデータです: %s...", i, part.text[:50])
+                result["text"] += part.text
+        
+        return result
+    
+    def _build_backup_request(self, upload, instruction_text):
+        """バックアップモデル用のモデル・入力・オプションを作成"""
+        # バックアップはサンプルコードとは異なるAPIを使用
+        backup_model_name = self.BACKUP_MODEL_NAME
+        logger.debug("バックアップモデル使用: %s", backup_model_name)
+        
+        model = self._get_backup_model()
+        
+        # 設定
+        generation_config = {
+            "temperature": 1.0,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
+        
+        # 安全設定を緩和
+        safety_settings = {
+            "harassment": "block_none",
+            "hate_speech": "block_none",
+            "dangerous_content": "block_none"
+        }
+        
+        # 主モデルと同じ送信用データを使う（再エンコードしない）
+        contents = [instruction_text, {"mime_type": upload.mime_type, "data": upload.data}]
+        options = {
+            "generation_config": generation_config,
+            "safety_settings": safety_settings,
+        }
+        return model, contents, options
+    
+    def _get_backup_model(self):
+        """バックアップモデルを取得（設定とモデルの作成は初回のみ。以降は同じ接続を使い回す）"""
+        with self._backup_lock:
+            if self._backup_model is None:
+                # genaiモジュールを直接使用
+                import google.generativeai as genai_alt
+                genai_alt.configure(api_key=Config.API_KEY)
+                self._backup_model = genai_alt.GenerativeModel(self.BACKUP_MODEL_NAME)
+            return self._backup_model
+    
+    def _parse_backup_response(self, response, result):
+        """バックアップモデルのレスポンスを処理"""
+        if hasattr(response, "parts"):
+            parts = response.parts
+            logger.debug("バックアップモデル: レスポンスのパート数: %d", len(parts))
+            
+            for i, part in enumerate(parts):
+                if hasattr(part, 'inline_data') and part.inline_data:
+                    # 画像データを取得
+                    logger.debug("Part %d は画像データです", i)
+                    image_data = part.inline_data.data
+                    
+                    try:
+                        with metrics.span("response_parse", mime_type=part.inline_data.mime_type):
+                            backup_image = EncodedImage.from_inline_data(image_data, part.inline_data.mime_type or "image/png")
+                            size = backup_image.size
+                        logger.debug("バックアップ画像を取得: サイズ=%s, 形式=%s", size, backup_image.mime_type)
+                        result["image"] = backup_image
+                        
+                        # デバッグ用に保存（設定がオンの場合のみ）
+                        if Config.DEBUG_SAVE_IMAGES:
+                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                            debug_path = os.path.join(Config.SAVE_DIRECTORY, f"backup_image_{timestamp}.{backup_image.extension}")
+                            backup_image.save(debug_path)
+                            logger.debug("バックアップ画像を保存: %s", debug_path)
+                        
+                    except Exception as img_err:
+                        logger.error("バックアップ画像処理エラー: %s", img_err)
+        
+        # テキスト応答の処理
+        if hasattr(response, "text") and not result["text"]:
+            result["text"] = response.text
+        
+        return result
 
     def generate_text(self, text_prompt, thread_id=None):
         """テキスト生成リクエスト"""
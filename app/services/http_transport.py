@@ -0,0 +1,139 @@
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+import httpx
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 実行中のリクエストの接続情報（track() の中でのみ設定される）
+_current_connection = contextvars.ContextVar("current_connection", default=None)
+
+class HttpTransport:
+    """API呼び出しで共有するkeep-aliveのHTTPクライアント（同期・非同期）
+
+    接続プールの上限とkeep-aliveの保持時間は設定で決まる。
+    httpcore の trace 拡張で新規接続・TLSハンドシェイクを数え、接続の再利用率を取れるようにする。
+    """
+
+    def __init__(self, verify=True, pool_size=None, keepalive_expiry=None,
+                 request_hooks=None, async_request_hooks=None):
+        pool_size = pool_size or Config.HTTP_POOL_SIZE
+        limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry or Config.HTTP_KEEPALIVE_SECONDS,
+        )
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.connect_seconds = 0.0
+        self.tls_seconds = 0.0
+
+        self.client = httpx.Client(
+            verify=verify,
+            limits=limits,
+            event_hooks={"request": [self._on_request] + list(request_hooks or [])},
+        )
+        self.async_client = httpx.AsyncClient(
+            verify=verify,
+            limits=limits,
+            event_hooks={"request": [self._on_async_request] + list(async_request_hooks or [])},
+        )
+
+    @contextlib.contextmanager
+    def track(self):
+        """この中で送ったリクエストが新規接続だったかを記録する辞書を返す"""
+        connection = {"requests": 0, "new_connection": False, "connect_seconds": 0.0, "tls_seconds": 0.0}
+        token = _current_connection.set(connection)
+        try:
+            yield connection
+        finally:
+            _current_connection.reset(token)
+
+    def _on_request(self, request):
+        """送信前のフック（同期）"""
+        request.extensions["trace"] = self._make_trace()
+
+    async def _on_async_request(self, request):
+        """送信前のフック（非同期）"""
+        trace = self._make_trace()
+
+        async def async_trace(event_name, info):
+            trace(event_name, info)
+        request.extensions["trace"] = async_trace
+
+    def _make_trace(self):
+        """リクエスト1件分の trace コールバックを作成"""
+        connection = _current_connection.get()
+        started = {}
+        with self._lock:
+            self.requests += 1
+        if connection is not None:
+            connection["requests"] += 1
+
+        def trace(event_name, info):
+            # 例: connection.connect_tcp.started / connection.start_tls.complete
+            if event_name.endswith(".started"):
+                started[event_name[:-len(".started")]] = time.perf_counter()
+                return
+            if not event_name.endswith(".complete"):
+                return
+            step = event_name[:-len(".complete")]
+            if step not in ("connection.connect_tcp", "connection.start_tls"):
+                return
+
+            elapsed = time.perf_counter() - started.get(step, time.perf_counter())
+            with self._lock:
+                if step == "connection.connect_tcp":
+                    self.new_connections += 1
+                    self.connect_seconds += elapsed
+                else:
+                    self.tls_handshakes += 1
+                    self.tls_seconds += elapsed
+            if connection is not None:
+                if step == "connection.connect_tcp":
+                    connection["new_connection"] = True
+                    connection["connect_seconds"] += elapsed
+                else:
+                    connection["tls_seconds"] += elapsed
+        return trace
+
+    def warm_up(self, url=None):
+        """接続とTLSハンドシェイクを先に済ませておく（同期クライアント）"""
+        try:
+            self.client.head(url or Config.HTTP_WARMUP_URL)
+            return True
+        except httpx.HTTPError as e:
+            logger.warning("接続の事前確立に失敗しました: %s", e)
+            return False
+
+    async def warm_up_async(self, url=None):
+        """接続とTLSハンドシェイクを先に済ませておく（非同期クライアント。使うイベントループ上で呼ぶ）"""
+        try:
+            await self.async_client.head(url or Config.HTTP_WARMUP_URL)
+            return True
+        except httpx.HTTPError as e:
+            logger.warning("接続の事前確立に失敗しました: %s", e)
+            return False
+
+    def get_stats(self):
+        """接続の統計（reused_requests は既存の接続で送ったリクエスト数）"""
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reused_requests": reused,
+                "reuse_ratio": reused / self.requests if self.requests else 0.0,
+                "connect_seconds": self.connect_seconds,
+                "tls_seconds": self.tls_seconds,
+            }
+
+    def close(self):
+        """同期クライアントを閉じる（非同期クライアントはイベントループ上で aclose する）"""
+        self.client.close()
@@ -1,82 +1,195 @@
 import os
+import logging
+import threading
 from PIL import Image
 from utils.file_manager import FileManager
+from utils.encoded_image import EncodedImage
 from utils.config import Config
 
+logger = logging.getLogger(__name__)
+
 class ImageService:
-    def __init__(self, thread_manager):
-        """画像処理サービスの初期化"""
+    def __init__(self, thread_manager, writer=None):
+        """画像処理サービスの初期化
+
+        writer（PersistenceQueue）を渡すと画像の書き込みをバックグラウンドで行う。
+        画像はスレッドごとに持ち、複数のスレッドの編集を並行して扱える（UIスレッドと
+        EditScheduler の両方から呼ばれるためロックで保護する）。
+        """
         self.thread_manager = thread_manager
-        self.current_image = None
-        self.current_image_path = None
+        self.writer = writer
+        self._images = {}  # thread_id をキーとした（画像, パス）
+        self._pending_saves = {}  # 保存パス -> 書き込み待ちの画像（書き終えるまではこちらを読む）
+        self._lock = threading.RLock()
+    
+    @property
+    def current_image(self):
+        """現在のスレッドの画像"""
+        return self.get_current_image()
+    
+    @property
+    def current_image_path(self):
+        """現在のスレッドの画像のパス"""
+        return self.get_current_image_path()
+    
+    def _set_thread_image(self, thread_id, image, image_path):
+        """スレッドの画像を設定"""
+        with self._lock:
+            self._images[thread_id] = (image, image_path)
+    
+    def _submit_save(self, image, save_path):
+        """画像の保存を書き込みキューに投入（書き終えるまでの読み込みにはメモリ上の画像を使う）"""
+        with self._lock:
+            self._pending_saves[save_path] = image
+        self.writer.submit(self._write_image, image, save_path)
+    
+    def _write_image(self, image, save_path):
+        """画像を保存し、書き込み待ちから取り除く（書き込みスレッド）"""
+        try:
+            return FileManager.save_image(image, save_path)
+        finally:
+            with self._lock:
+                if self._pending_saves.get(save_path) is image:
+                    del self._pending_saves[save_path]
     
-    def load_image(self, image_path):
-        """画像をロード"""
+    def load_image(self, image_path, thread_id=None):
+        """画像をロード（thread_id省略時は現在のスレッド）"""
+        if thread_id is None:
+            thread_id = self.thread_manager.current_thread_id
+        with self._lock:
+            pending = self._pending_saves.get(image_path)
+        if pending is not None:
+            # まだ書き込まれていない画像はメモリ上のものを使う（書き込みの完了を待たない）
+            self._set_thread_image(thread_id, pending, image_path)
+            return True
         try:
             if not os.path.exists(image_path):
-                print(f"エラー: 画像が見つかりません: {image_path}")
+                logger.error("画像が見つかりません: %s", image_path)
                 return False
                 
-            # PIL Imageとして読み込み
-            image = Image.open(image_path)
-            self.current_image = image
-            self.current_image_path = image_path
+            # エンコード済みのまま読み込み（デコードは必要になった時点で行う）
+            image = FileManager.load_encoded_image(image_path)
+            self._set_thread_image(thread_id, image, image_path)
             
-            print(f"画像をロードしました: {image_path}")
+            logger.info("画像をロードしました: %s", image_path)
             return True
         except Exception as e:
-            print(f"画像のロード中にエラーが発生しました: {e}")
+            logger.error("画像のロード中にエラーが発生しました: %s", e)
             return False
     
-    def load_latest_image(self):
-        """現在のスレッドの最新画像をロード"""
-        image_path = self.thread_manager.get_latest_image_path()
-        if image_path and os.path.exists(image_path):
-            return self.load_image(image_path)
+    def load_latest_image(self, thread_id=None):
+        """スレッドの最新画像をロード（thread_id省略時は現在のスレッド）"""
+        if thread_id is None:
+            thread_id = self.thread_manager.current_thread_id
+        image_path = self.thread_manager.get_latest_image_path(thread_id)
+        if not image_path:
+            return False
+        with self._lock:
+            pending = image_path in self._pending_saves
+        if pending or os.path.exists(image_path):
+            return self.load_image(image_path, thread_id)
         return False
     
+    def get_thread_image(self, thread_id):
+        """スレッドの画像を取得（まだ読み込んでいなければ最新画像を読み込む）"""
+        if not thread_id:
+            return None
+        with self._lock:
+            if thread_id in self._images:
+                return self._images[thread_id][0]
+        if self.load_latest_image(thread_id):
+            with self._lock:
+                return self._images[thread_id][0]
+        return None
+    
+    def clear_thread_image(self, thread_id=None):
+        """スレッドの画像をリセット（thread_id省略時は現在のスレッド）"""
+        if thread_id is None:
+            thread_id = self.thread_manager.current_thread_id
+        with self._lock:
+            self._images.pop(thread_id, None)
+    
     def save_edited_image(self, image_data, thread_id=None):
         """編集された画像を保存"""
         if thread_id is None:
             thread_id = self.thread_manager.current_thread_id
             
         if not thread_id:
-            print("エラー: スレッドIDが指定されていません")
+            logger.error("スレッドIDが指定されていません")
             return None
             
-        # 編集番号を取得（現在の会話数）
-        thread = self.thread_manager.get_current_thread()
-        if not thread:
-            print("エラー: 現在のスレッドが見つかりません")
+        # 編集番号を取得（対象スレッドの会話数。索引の要約から取得し、会話本体は読まない）
+        message_count = self.thread_manager.get_message_count(thread_id)
+        if message_count is None:
+            logger.error("スレッドが見つかりません: %s", thread_id)
             return None
             
-        edit_number = len(thread["conversations"]) + 1
+        edit_number = message_count + 1
+        
+        # 保存パスを取得（タイルストアが無効なら、エンコード済み画像は受信した形式のまま保存する）
+        ext = FileManager.image_extension(image_data)
+        # 最新の編集結果は別ファイルに複製せず、スレッドの latest_image_path がこのパスを指す
+        save_path = FileManager.get_image_save_path(thread_id, edit_number, ext)
         
-        # 保存パスを取得
-        save_path = FileManager.get_image_save_path(thread_id, edit_number)
-        latest_path = FileManager.get_image_save_path(thread_id)
+        if self.writer is not None and isinstance(image_data, (Image.Image, EncodedImage)):
+            # 保存はバックグラウンドで行い、パスだけ先に返す
+            self._submit_save(image_data, save_path)
+            self._set_thread_image(thread_id, image_data, save_path)
+            return save_path
         
         # 画像を保存
         if FileManager.save_image(image_data, save_path):
-            # 最新の編集結果も保存
-            FileManager.save_image(image_data, latest_path)
-            
             # 現在の画像を更新
-            if isinstance(image_data, Image.Image):
-                self.current_image = image_data
+            if isinstance(image_data, (Image.Image, EncodedImage)):
+                image = image_data
             else:
-                self.current_image = Image.open(save_path)
+                image = FileManager.load_encoded_image(save_path)
                 
-            self.current_image_path = save_path
+            self._set_thread_image(thread_id, image, save_path)
             
             return save_path
         
         return None
         
+    def save_variant_images(self, images, thread_id, edit_number):
+        """採用されなかったバリエーションを保存し、保存パスのリストを返す（スレッドの画像は変えない）"""
+        paths = []
+        for index, image in enumerate(images, 1):
+            save_path = FileManager.get_variant_save_path(thread_id, edit_number, index,
+                                                          FileManager.image_extension(image))
+            if self.writer is not None:
+                self._submit_save(image, save_path)
+            elif not FileManager.save_image(image, save_path):
+                continue
+            paths.append(save_path)
+        return paths
+        
+    def store_input_image(self, thread_id=None):
+        """読み込んだ画像をスレッドの入力画像として保存し、保存パスを返す"""
+        if thread_id is None:
+            thread_id = self.thread_manager.current_thread_id
+        message_count = self.thread_manager.get_message_count(thread_id)
+        with self._lock:
+            image = self._images.get(thread_id, (None, None))[0]
+        if image is None or message_count is None:
+            return None
+        
+        save_path = FileManager.get_input_save_path(thread_id, message_count + 1,
+                                                    FileManager.image_extension(image))
+        if self.writer is not None:
+            self._submit_save(image, save_path)
+        elif not FileManager.save_image(image, save_path):
+            return None
+        
+        self._set_thread_image(thread_id, image, save_path)
+        return save_path
+        
     def get_current_image(self):
-        """現在ロードされている画像を取得"""
-        return self.current_image
+        """現在のスレッドにロードされている画像を取得"""
+        with self._lock:
+            return self._images.get(self.thread_manager.current_thread_id, (None, None))[0]
         
     def get_current_image_path(self):
-        """現在ロードされている画像のパスを取得"""
-        return self.current_image_path
+        """現在のスレッドにロードされている画像のパスを取得"""
+        with self._lock:
+            return self._images.get(self.thread_manager.current_thread_id, (None, None))[1]
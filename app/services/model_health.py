@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+from collections import deque
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+class ModelHealth:
+    """モデルごとの成功率・レイテンシの記録とサーキットブレーカー
+
+    成功は「画像が得られた」こと。連続して failure_threshold 回失敗したモデルは回路を開き、
+    reset_seconds の間は呼ばない。その後は1件だけ試し（半開）、成功すれば元に戻す。
+    同期版（ワーカースレッド）と非同期版（イベントループ）の両方から呼ばれるためロックで保護する。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window=None, failure_threshold=None, reset_seconds=None, clock=time.monotonic):
+        self.window = window or Config.MODEL_HEALTH_WINDOW
+        self.failure_threshold = failure_threshold or Config.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds if reset_seconds is not None else Config.CIRCUIT_RESET_SECONDS
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _model(self, model):
+        """モデルの記録を取得（なければ作成。ロック内で呼ぶ）"""
+        if model not in self._models:
+            self._models[model] = {
+                "outcomes": deque(maxlen=self.window),  # 直近の成否
+                "latencies": deque(maxlen=self.window),  # 直近の成功時のレイテンシ（秒）
+                "requests": 0,
+                "successes": 0,
+                "consecutive_failures": 0,
+                "state": self.CLOSED,
+                "opened_at": None,
+                "probing": False,
+            }
+        return self._models[model]
+
+    def allow(self, model):
+        """モデルにリクエストを送ってよいか（回路が開いていれば False。半開なら1件だけ許可）"""
+        with self._lock:
+            entry = self._model(model)
+            if entry["state"] == self.CLOSED:
+                return True
+            if entry["state"] == self.OPEN:
+                if self._clock() - entry["opened_at"] < self.reset_seconds:
+                    return False
+                entry["state"] = self.HALF_OPEN
+                entry["probing"] = False
+            if entry["probing"]:
+                return False
+            entry["probing"] = True
+            return True
+
+    def record_success(self, model, latency):
+        """画像が得られたリクエストを記録"""
+        with self._lock:
+            entry = self._model(model)
+            entry["requests"] += 1
+            entry["successes"] += 1
+            entry["outcomes"].append(True)
+            entry["latencies"].append(latency)
+            entry["consecutive_failures"] = 0
+            if entry["state"] != self.CLOSED:
+                logger.info("モデルが回復しました: %s", model)
+            entry["state"] = self.CLOSED
+            entry["probing"] = False
+
+    def record_failure(self, model):
+        """エラーまたは画像が得られなかったリクエストを記録"""
+        with self._lock:
+            entry = self._model(model)
+            entry["requests"] += 1
+            entry["outcomes"].append(False)
+            entry["consecutive_failures"] += 1
+            entry["probing"] = False
+            if entry["state"] == self.HALF_OPEN or entry["consecutive_failures"] >= self.failure_threshold:
+                if entry["state"] != self.OPEN:
+                    logger.warning("モデルへの送信を%.0f秒間停止します（連続失敗 %d回）: %s",
+                                   self.reset_seconds, entry["consecutive_failures"], model)
+                entry["state"] = self.OPEN
+                entry["opened_at"] = self._clock()
+
+    def retry_in(self, model):
+        """回路が開いているモデルを再び試せるまでの秒数（開いていなければ0）"""
+        with self._lock:
+            entry = self._model(model)
+            if entry["state"] != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (self._clock() - entry["opened_at"]))
+
+    def release(self, model):
+        """結果を待たずに打ち切ったリクエストの半開の枠を戻す（成否は記録しない）"""
+        with self._lock:
+            self._model(model)["probing"] = False
+
+    def latency_percentile(self, model, percentile):
+        """直近の成功時のレイテンシのパーセンタイル（記録がなければNone）"""
+        with self._lock:
+            latencies = sorted(self._model(model)["latencies"])
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def hedge_delay(self, model):
+        """バックアップにも送るまでの待ち時間（十分な記録があれば直近の p95 と設定値の小さいほう）"""
+        with self._lock:
+            samples = len(self._model(model)["latencies"])
+        if samples < Config.HEDGE_MIN_SAMPLES:
+            return Config.HEDGE_DELAY_SECONDS
+        return min(Config.HEDGE_DELAY_SECONDS, self.latency_percentile(model, 95))
+
+    def get_stats(self):
+        """モデルごとの統計（成功率は直近 window 件）"""
+        stats = {}
+        with self._lock:
+            models = {model: (list(entry["outcomes"]), entry) for model, entry in self._models.items()}
+            for model, (outcomes, entry) in models.items():
+                stats[model] = {
+                    "requests": entry["requests"],
+                    "successes": entry["successes"],
+                    "success_rate": sum(outcomes) / len(outcomes) if outcomes else None,
+                    "consecutive_failures": entry["consecutive_failures"],
+                    "state": entry["state"],
+                }
+        for model in stats:
+            stats[model]["latency_p50"] = self.latency_percentile(model, 50)
+            stats[model]["latency_p95"] = self.latency_percentile(model, 95)
+        return stats
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from PySide6.QtCore import QObject, Signal
+
+logger = logging.getLogger(__name__)
+
+class _WriteTask:
+    """書き込みキューの1件"""
+
+    def __init__(self, job_id, fn, args, key, callback):
+        self.job_id = job_id
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.callback = callback
+
+class PersistenceQueue(QObject):
+    """保存処理をUIスレッドの外で順番に実行する書き込みキュー（write-behind）
+
+    投入順に1本のスレッドで実行するので、同じスレッドへの書き込みの順序は保たれる。
+    key を指定した書き込みは、まだ始まっていない同じ key のものを置き換える（最後の1回だけ書く）。
+    関数がNoneかFalseを返した場合も失敗とみなす。
+    """
+
+    # ジョブID と 結果
+    finished = Signal(int, object)
+    # ジョブID と エラーメッセージ
+    failed = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._tasks = deque()
+        self._pending_keys = {}  # key -> まだ始まっていない _WriteTask
+        self._callbacks = {}  # ジョブID -> 完了時にUIスレッドで呼ぶ関数
+        self._job_ids = itertools.count(1)
+        self._running = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.coalesced_count = 0
+
+        # 完了通知はUIスレッドに届いてからコールバックを呼ぶ
+        self.finished.connect(self._dispatch_callback)
+
+        self._thread = threading.Thread(target=self._run, name="PersistenceQueue", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, key=None, callback=None):
+        """書き込みを投入し、ジョブIDを返す（callback は完了後にUIスレッドで結果を渡して呼ぶ）"""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("書き込みキューは停止しています")
+
+            if key is not None and key in self._pending_keys:
+                # 未実行の同じ書き込みを最新の内容に置き換える
+                task = self._pending_keys[key]
+                task.fn = fn
+                task.args = args
+                self.coalesced_count += 1
+                if callback is not None:
+                    self._callbacks[task.job_id] = callback
+                return task.job_id
+
+            task = _WriteTask(next(self._job_ids), fn, args, key, callback)
+            if callback is not None:
+                self._callbacks[task.job_id] = callback
+            if key is not None:
+                self._pending_keys[key] = task
+            self._tasks.append(task)
+            self._condition.notify_all()
+            return task.job_id
+
+    def barrier(self, callback):
+        """ここまでに投入した書き込みがすべて終わったら callback をUIスレッドで呼ぶ"""
+        return self.submit(lambda: True, callback=lambda result: callback())
+
+    def _run(self):
+        """書き込みを投入順に実行（バックグラウンドスレッド）"""
+        while True:
+            with self._condition:
+                while not self._tasks and not self._closed:
+                    self._condition.wait()
+                if not self._tasks:
+                    return
+                task = self._tasks.popleft()
+                if task.key is not None:
+                    self._pending_keys.pop(task.key, None)
+                self._running += 1
+
+            try:
+                result = task.fn(*task.args)
+            except Exception as e:
+                result = None
+                error = str(e) or type(e).__name__
+            else:
+                error = None if result not in (None, False) else f"{getattr(task.fn, '__name__', '書き込み')} に失敗しました"
+
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+            if error is None:
+                self.finished.emit(task.job_id, result)
+            else:
+                logger.error("保存エラー: %s", error)
+                with self._condition:
+                    self._callbacks.pop(task.job_id, None)
+                self.failed.emit(task.job_id, error)
+
+    def _dispatch_callback(self, job_id, result):
+        """完了したジョブのコールバックを呼ぶ（UIスレッド）"""
+        with self._condition:
+            callback = self._callbacks.pop(job_id, None)
+        if callback is not None:
+            callback(result)
+
+    def pending_count(self):
+        """未完了の書き込み数を取得"""
+        with self._condition:
+            return len(self._tasks) + self._running
+
+    def flush(self, timeout=None):
+        """投入済みの書き込みが終わるまで待つ（時間内に終わればTrue）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._tasks or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=5.0):
+        """書き込みを最大 timeout 秒待ってから停止（時間内に終わればTrue）"""
+        done = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if done:
+            self._thread.join(timeout)
+        else:
+            logger.warning("保存が終わらないまま終了します（残り %d 件）", self.pending_count())
+        return done
@@ -0,0 +1,278 @@
+import re
+import math
+import logging
+import time
+import random
+import asyncio
+import threading
+from utils.config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """プロセス全体で共有するトークンバケット（リクエスト数/分 と トークン数/分）
+
+    呼び出し前に acquire でリクエスト1件分とトークン分の枠を予約し、足りない分だけ待つ。
+    予約は先着順に先へ積んでいくので、同時に待っている呼び出しは等間隔に送られ、
+    クォータちょうどの速度で送り続けられる（待ちが解けた瞬間にまとめて送って 429 になることがない）。
+    429 を受けたときは pause で全ての呼び出しを止める。
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, burst=None, utilization=None,
+                 clock=time.monotonic):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        burst = burst or Config.RATE_LIMIT_BURST
+        utilization = utilization or Config.RATE_LIMIT_UTILIZATION
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # 容量（バースト）は同じ時間分。トークンは1件で容量を超えても、待てば送れる
+        self._request_rate = requests_per_minute * utilization / 60.0
+        self._request_capacity = float(burst)
+        self._requests = self._request_capacity
+        self._token_rate = tokens_per_minute * utilization / 60.0 if tokens_per_minute else None
+        self._token_capacity = tokens_per_minute * burst / requests_per_minute if tokens_per_minute else None
+        self._tokens = self._token_capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+        self.waiting = 0
+        self.max_waiting = 0
+
+    @classmethod
+    def for_model(cls, model_name):
+        """モデルごとに1つの共有インスタンスを取得（クォータはモデルごとに決まっている）"""
+        with cls._registry_lock:
+            if model_name not in cls._registry:
+                requests_per_minute, tokens_per_minute = Config.RATE_LIMITS.get(
+                    model_name, (Config.RATE_LIMIT_RPM, Config.RATE_LIMIT_TPM))
+                cls._registry[model_name] = cls(requests_per_minute, tokens_per_minute)
+            return cls._registry[model_name]
+
+    @classmethod
+    def all_stats(cls):
+        """共有インスタンスの統計をモデルごとに取得"""
+        with cls._registry_lock:
+            limiters = dict(cls._registry)
+        return {model_name: limiter.get_stats() for model_name, limiter in limiters.items()}
+
+    @staticmethod
+    def estimate_tokens(instruction_text, image_size=None):
+        """リクエストのおおよそのトークン数（入力テキスト＋入力画像＋出力画像）"""
+        tokens = math.ceil(len(instruction_text or "") / 4)
+        if image_size:
+            # 画像は768ピクセル四方のタイルごとに258トークン
+            width, height = image_size
+            tokens += math.ceil(width / 768) * math.ceil(height / 768) * 258
+        return tokens + Config.RATE_LIMIT_OUTPUT_TOKENS
+
+    def _refill(self, now):
+        """経過時間分を補充（ロック内で呼ぶ）"""
+        elapsed = max(0.0, now - self._updated)
+        self._updated = now
+        self._requests = min(self._request_capacity, self._requests + elapsed * self._request_rate)
+        if self._token_rate:
+            self._tokens = min(self._token_capacity, self._tokens + elapsed * self._token_rate)
+
+    def _reserve(self, tokens):
+        """枠を予約し、送ってよくなるまでの秒数を返す"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._requests -= 1
+            wait = max(0.0, -self._requests / self._request_rate)
+            if self._token_rate:
+                self._tokens -= tokens
+                wait = max(wait, -self._tokens / self._token_rate)
+            wait = max(wait, self._paused_until - now)
+
+            self.acquired += 1
+            if wait > 0:
+                self.throttled += 1
+                self.throttled_seconds += wait
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            return wait
+
+    def _refund(self, tokens):
+        """使わなかった予約を戻す"""
+        with self._lock:
+            self._requests = min(self._request_capacity, self._requests + 1)
+            if self._token_rate:
+                self._tokens = min(self._token_capacity, self._tokens + tokens)
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, tokens=0):
+        """送信枠を得るまで待ち、待った秒数を返す"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+            metrics.observe("rate_limit_wait", wait)
+        return wait
+
+    async def acquire_async(self, tokens=0):
+        """送信枠を得るまで待ち、待った秒数を返す（キャンセルされたら予約を戻す）"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._refund(tokens)
+                raise
+            finally:
+                self._done_waiting()
+            metrics.observe("rate_limit_wait", wait)
+        return wait
+
+    def pause(self, seconds):
+        """429 を受けたとき、全ての呼び出しを seconds 秒止める（再開直後にまとめて送らないよう枠も空にする）"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._requests = min(self._requests, 0.0)
+            if self._token_rate:
+                self._tokens = min(self._tokens, 0.0)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def get_stats(self):
+        """送信枠の統計（waiting は現在の待ち行列の長さ）"""
+        with self._lock:
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "throttled_seconds": self.throttled_seconds,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+            }
+
+class RetryPolicy:
+    """一時的なエラー（429・5xx・通信エラー）を指数バックオフ＋ジッターで再試行する"""
+
+    RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+    # 通信エラーと、アップロード済みの参照が使えなくなっていたとき（取り除いた後は送り直せば通る）
+    RETRYABLE_ERROR_NAMES = {"TimeoutException", "ConnectError", "ReadError", "WriteError", "RemoteProtocolError",
+                             "StaleReferenceError"}
+
+    def __init__(self, max_attempts=None, base_seconds=None, max_seconds=None):
+        self.max_attempts = max_attempts or Config.RETRY_MAX_ATTEMPTS
+        self.base_seconds = base_seconds if base_seconds is not None else Config.RETRY_BASE_SECONDS
+        self.max_seconds = max_seconds or Config.RETRY_MAX_SECONDS
+        self._random = random.Random()
+
+    @staticmethod
+    def status_code(error):
+        """例外からHTTPステータスコードを取り出す（なければNone）"""
+        code = getattr(error, "code", None)
+        if isinstance(code, int):
+            return code
+        response = getattr(error, "response", None)
+        return getattr(response, "status_code", None)
+
+    @staticmethod
+    def retry_after(error):
+        """例外から再試行までの秒数の指定を取り出す（Retry-After ヘッダーか RetryInfo の retryDelay）"""
+        seconds = getattr(error, "retry_after", None)
+        if seconds is not None:
+            return float(seconds)
+
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            value = headers.get("retry-after")
+            if value:
+                try:
+                    return float(value)
+                except ValueError:
+                    pass
+
+        # 例: {"error": {"details": [{"@type": "...RetryInfo", "retryDelay": "30s"}]}}
+        match = re.search(r"""["']retryDelay["']:\s*["'](\d+(?:\.\d+)?)s""", str(getattr(error, "details", "") or ""))
+        if match:
+            return float(match.group(1))
+        return None
+
+    def is_retryable(self, error):
+        """一時的なエラーかどうか"""
+        if self.status_code(error) in self.RETRYABLE_CODES:
+            return True
+        return any(cls.__name__ in self.RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+    def delay(self, attempt, error):
+        """attempt 回目（0始まり）の失敗後に待つ秒数"""
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            # 指定された時間は必ず待ち、同時に再開しないよう少しずらす
+            return retry_after + self._random.uniform(0, self.base_seconds)
+        # フルジッター: 0 〜 base * 2^attempt（上限 max_seconds）
+        return self._random.uniform(0, min(self.max_seconds, self.base_seconds * 2 ** attempt))
+
+    def call(self, limiter, request, tokens=0, on_acquired=None):
+        """送信枠を得てから request() を呼び、一時的なエラーなら再試行する（limiter がNoneなら枠は待たない）
+
+        on_acquired() は送信枠を得るたびに送信の直前に呼ぶ（枠を待つ時間を呼び出し側の待ち時間から除くため）。
+        """
+        for attempt in range(self.max_attempts):
+            if limiter is not None:
+                limiter.acquire(tokens)
+            if on_acquired is not None:
+                on_acquired()
+            try:
+                return request()
+            except Exception as e:
+                wait = self._on_error(limiter, attempt, e)
+            time.sleep(wait)
+
+    async def call_async(self, limiter, request, tokens=0, can_retry=None, on_acquired=None):
+        """call の非同期版（request はコルーチンを返す関数。can_retry() が False なら再試行しない）"""
+        for attempt in range(self.max_attempts):
+            if limiter is not None:
+                await limiter.acquire_async(tokens)
+            if on_acquired is not None:
+                on_acquired()
+            try:
+                return await request()
+            except Exception as e:
+                if can_retry is not None and not can_retry():
+                    raise
+                wait = self._on_error(limiter, attempt, e)
+            await asyncio.sleep(wait)
+
+    def _on_error(self, limiter, attempt, error):
+        """再試行するなら待つ秒数を返し、しないなら例外をそのまま送出する"""
+        if attempt + 1 >= self.max_attempts or not self.is_retryable(error):
+            raise error
+        wait = self.delay(attempt, error)
+        logger.warning("一時的なエラーのため%.1f秒後に再試行します（%d/%d）: %s",
+                       wait, attempt + 1, self.max_attempts - 1, error)
+        if limiter is None:
+            return wait
+        limiter.record_retry()
+        if self.status_code(error) == 429:
+            # クォータ超過は全ての呼び出しを止めて他のワーカーも同じ時間待たせる（待つのは次の acquire の中）
+            limiter.pause(wait)
+            return 0.0
+        return wait
@@ -0,0 +1,168 @@
+import os
+import io
+import json
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from utils.config import Config
+from utils.encoded_image import EncodedImage
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """画像編集結果のディスクキャッシュ（入力内容のハッシュをキーとしたLRU）"""
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        """キャッシュディレクトリを開き、既存のエントリを読み込む"""
+        self.cache_dir = cache_dir or Config.CACHE_DIRECTORY
+        self.max_bytes = max_bytes if max_bytes is not None else Config.RESPONSE_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> 合計バイト数（古い順）
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def make_key(image, instruction_text, model_name, config=None):
+        """(画像データ, 指示テキスト, モデル名, 生成設定) からキャッシュキーを作成
+
+        エンコード済み画像はデコードせずにバイト列をハッシュし、PIL画像は画素をハッシュする。
+        """
+        digest = hashlib.sha256()
+        if isinstance(image, EncodedImage):
+            digest.update(f"{image.mime_type}\n".encode("utf-8"))
+            digest.update(image.data)
+        else:
+            digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}\n".encode("utf-8"))
+            digest.update(image.tobytes())
+        digest.update(b"\0" + instruction_text.encode("utf-8"))
+        digest.update(b"\0" + model_name.encode("utf-8"))
+        if config is not None:
+            if hasattr(config, "model_dump_json"):
+                config_repr = config.model_dump_json(exclude_none=True)
+            else:
+                config_repr = repr(config)
+            digest.update(b"\0" + config_repr.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        """エントリのメタデータと画像のパス"""
+        return (os.path.join(self.cache_dir, f"{key}.json"),
+                os.path.join(self.cache_dir, f"{key}.bin"))
+
+    def _scan(self):
+        """既存のエントリを最終アクセス時刻の順に読み込む"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            meta_path, data_path = self._paths(key)
+            try:
+                size = os.path.getsize(meta_path) + os.path.getsize(data_path)
+                entries.append((os.path.getmtime(meta_path), key, size))
+            except OSError:
+                continue
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key):
+        """キャッシュから結果を取得（なければNone）"""
+        meta_path, data_path = self._paths(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                with open(data_path, "rb") as f:
+                    data = f.read()
+                # 最近使ったものとして記録（再起動後もLRU順を保つ）
+                os.utime(meta_path)
+            except (OSError, ValueError) as e:
+                logger.warning("キャッシュ読み込みエラー: %s", e)
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        logger.debug("キャッシュヒット: %s (ヒット %s / ミス %s)", key[:12], self.hits, self.misses)
+        return {"text": meta.get("text", ""), "image": EncodedImage(data, meta.get("mime_type", "image/png"))}
+
+    def put(self, key, result):
+        """編集結果をキャッシュに保存"""
+        image = result.get("image")
+        if image is None:
+            return False
+
+        if isinstance(image, EncodedImage):
+            # 受信したバイト列をそのまま保存する
+            data = image.data
+            mime_type = image.mime_type
+        else:
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", compress_level=Config.PNG_COMPRESS_LEVEL)
+            data = buffer.getvalue()
+            mime_type = "image/png"
+        meta = json.dumps({"text": result.get("text", ""), "mime_type": mime_type}, ensure_ascii=False)
+
+        meta_path, data_path = self._paths(key)
+        with self._lock:
+            try:
+                with open(data_path, "wb") as f:
+                    f.write(data)
+                # メタデータを最後に書くことで、中途半端なエントリを読まないようにする
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    f.write(meta)
+            except OSError as e:
+                logger.warning("キャッシュ保存エラー: %s", e)
+                return False
+
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            size = len(data) + len(meta.encode("utf-8"))
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+        return True
+
+    def _evict(self):
+        """上限を超えた分を古い順に削除"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def _remove(self, key):
+        """エントリを削除"""
+        self._total_bytes -= self._entries.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """キャッシュをすべて削除"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def get_stats(self):
+        """ヒット数・ミス数・使用量を取得"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+from PySide6.QtCore import QObject, Signal
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+class ServiceInitializer(QObject):
+    """重いインポートとサービスの構築をバックグラウンドで行い、完了をシグナルで知らせる
+
+    google.genai などの読み込みとスレッドの読み込みはウィンドウの表示を待たせないように
+    UIスレッドの外で行う。UIスレッドで作る必要のあるQObjectはここでは作らない。
+    """
+
+    # 進捗メッセージ
+    progress = Signal(str)
+    # 構築したサービス（名前 -> オブジェクト）
+    ready = Signal(object)
+    # エラーメッセージ
+    failed = Signal(str)
+
+    def __init__(self, writer=None, parent=None):
+        super().__init__(parent)
+        self.writer = writer
+        self.timings = {}  # 段階名 -> 所要時間（秒）
+        self._thread = None
+
+    def start(self):
+        """初期化を開始（すでに開始していれば何もしない）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ServiceInitializer", daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        """初期化中かどうか"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _step(self, name, message, fn):
+        """1段階を実行して所要時間を記録"""
+        self.progress.emit(message)
+        started = time.perf_counter()
+        result = fn()
+        self.timings[name] = time.perf_counter() - started
+        return result
+
+    def _run(self):
+        """サービスを順に構築（バックグラウンドスレッド）"""
+        try:
+            self._step("directories", "保存ディレクトリを準備しています...", Config.ensure_directories)
+
+            def load_threads():
+                from models.thread_manager import ThreadManager
+                return ThreadManager(writer=self.writer)
+            thread_manager = self._step("threads", "スレッドを読み込んでいます...", load_threads)
+
+            def create_image_service():
+                from services.image_service import ImageService
+                return ImageService(thread_manager, writer=self.writer)
+            image_service = self._step("image_service", "画像サービスを準備しています...", create_image_service)
+
+            def create_gemini_service():
+                # google.genai の読み込みが起動時間の大半を占めるため、ここで初めてインポートする
+                from services.async_gemini_service import AsyncGeminiService
+                return AsyncGeminiService()
+            gemini_service = self._step("gemini_service", "Gemini APIに接続する準備をしています...", create_gemini_service)
+        except Exception as e:
+            logger.exception("サービスの初期化に失敗しました: %s", e)
+            self.failed.emit(str(e) or type(e).__name__)
+            return
+
+        logger.info("サービスの初期化完了: %s",
+                    ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.timings.items()))
+        self.ready.emit({
+            "thread_manager": thread_manager,
+            "image_service": image_service,
+            "gemini_service": gemini_service,
+        })
@@ -0,0 +1,160 @@
+import os
+import logging
+import hashlib
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, QSize, Signal, Slot
+from PySide6.QtGui import QImage, QImageReader
+from utils.config import Config
+from utils.image_cache import decoded_images, DecodedImageCache
+
+logger = logging.getLogger(__name__)
+
+class ThumbnailSignals(QObject):
+    """サムネイル作成ワーカーのシグナル"""
+    # 元画像のパス と サムネイル（失敗時は空のQImage）
+    finished = Signal(str, QImage)
+
+class ThumbnailWorker(QRunnable):
+    """ディスクキャッシュを確認し、なければ縮小デコードしてサムネイルを保存するワーカー"""
+
+    def __init__(self, path, cache_file, size):
+        super().__init__()
+        self.path = path
+        self.cache_file = cache_file
+        self.size = size
+        self.signals = ThumbnailSignals()
+
+    @Slot()
+    def run(self):
+        thumbnail = None
+        try:
+            thumbnail = ThumbnailService.load_cached(self.cache_file)
+            if thumbnail is None:
+                thumbnail = ThumbnailService.create_thumbnail(self.path, self.size)
+                if thumbnail is not None:
+                    ThumbnailService.store(thumbnail, self.cache_file)
+        except Exception as e:
+            logger.warning("サムネイル作成エラー: %s: %s", self.path, e)
+            thumbnail = None
+        self.signals.finished.emit(self.path, thumbnail if thumbnail is not None else QImage())
+
+class ThumbnailService(QObject):
+    """会話履歴用のサムネイルをバックグラウンドで作成・ディスクにキャッシュする
+
+    キーは (ファイルパス, 更新時刻, ファイルサイズ, サムネイルサイズ)。
+    """
+
+    # サムネイルの準備ができたとき（元画像のパス, QImage）
+    thumbnail_ready = Signal(str, QImage)
+    # サムネイルを作れなかったとき（元画像のパス）
+    thumbnail_failed = Signal(str)
+
+    def __init__(self, cache_dir=None, size=None, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir or Config.THUMBNAIL_DIRECTORY
+        self.size = size or Config.THUMBNAIL_SIZE
+        self._pending = {}  # 元画像のパス -> ワーカー（シグナルの受信まで保持する）
+
+        # 大きな画像のデコードでビューア用のスレッドプールを塞がないように専用にする
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers or Config.THUMBNAIL_WORKERS)
+        # キャッシュのディレクトリは最初にサムネイルを保存するときに作る（UIの構築中にディスクを触らないように）
+
+    def cache_file(self, path):
+        """サムネイルのキャッシュファイルのパス（元画像が読めなければNone）"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{self.size}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.png")
+
+    def request(self, path):
+        """サムネイルを要求する
+
+        メモリ上にあればすぐにQImageを返す。なければNoneを返し、
+        作成後に thumbnail_ready（失敗時は thumbnail_failed）を発行する。
+        """
+        cache_file = self.cache_file(path)
+        if cache_file is None:
+            self.thumbnail_failed.emit(path)
+            return None
+
+        # メモリ上のサムネイルはデコード済み画像と同じキャッシュ（メモリ上限）で管理する
+        thumbnail = decoded_images.get(("thumbnail", cache_file))
+        if thumbnail is not None:
+            return thumbnail
+
+        if path not in self._pending:
+            worker = ThumbnailWorker(path, cache_file, self.size)
+            worker.signals.finished.connect(self._on_worker_finished)
+            self._pending[path] = worker
+            self.pool.start(worker)
+        return None
+
+    def _on_worker_finished(self, path, thumbnail):
+        """ワーカーの結果を受け取る（UIスレッド）"""
+        worker = self._pending.pop(path, None)
+        if thumbnail.isNull():
+            self.thumbnail_failed.emit(path)
+            return
+
+        if worker is not None:
+            decoded_images.put(("thumbnail", worker.cache_file), thumbnail, DecodedImageCache.qimage_bytes(thumbnail))
+        self.thumbnail_ready.emit(path, thumbnail)
+
+    def pending_count(self):
+        """作成待ちのサムネイル数"""
+        return len(self._pending)
+
+    @staticmethod
+    def load_cached(cache_file):
+        """ディスクキャッシュからサムネイルを読み込む（なければNone）"""
+        if not os.path.exists(cache_file):
+            return None
+        thumbnail = QImage(cache_file)
+        return None if thumbnail.isNull() else thumbnail
+
+    @staticmethod
+    def create_thumbnail(path, size):
+        """縮小しながらデコードしてサムネイルを作成（JPEGなどは全画素をデコードしない）"""
+        # タイルストアとPILは使うときに読み込む（UIの構築時に読み込まないように）
+        from utils.tile_store import TileStore
+        if TileStore.is_manifest(path):
+            # 元のバイト列が保存してあれば、組み立てずにそれを縮小デコードする
+            original_path = TileStore().original_path(path)
+            if original_path is None:
+                return ThumbnailService.create_tile_thumbnail(path, size)
+            path = original_path
+
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        original = reader.size()
+        if original.isValid() and max(original.width(), original.height()) > size:
+            reader.setScaledSize(original.scaled(QSize(size, size), Qt.KeepAspectRatio))
+        thumbnail = reader.read()
+        if thumbnail.isNull():
+            logger.warning("サムネイル作成エラー: %s: %s", path, reader.errorString())
+            return None
+        return thumbnail
+
+    @staticmethod
+    def create_tile_thumbnail(path, size):
+        """タイルストアの画像を組み立て直してサムネイルを作成"""
+        from utils.tile_store import TileStore
+        image = TileStore().load(path)
+        image.thumbnail((size, size))
+        image = image.convert("RGBA")
+        data = image.tobytes("raw", "RGBA")
+        # copyでPILのバッファから切り離す
+        return QImage(data, image.width, image.height, QImage.Format_RGBA8888).copy()
+
+    @staticmethod
+    def store(thumbnail, cache_file):
+        """サムネイルを一時ファイル経由で保存（書きかけのファイルを読まないように）"""
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        if thumbnail.save(tmp_file, "PNG"):
+            os.replace(tmp_file, cache_file)
+            return True
+        return False
@@ -0,0 +1,273 @@
+import io
+import time
+import asyncio
+import logging
+import threading
+import httpx
+from PIL import Image
+from utils.config import Config
+from utils.encoded_image import EncodedImage
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class PreparedUpload:
+    """送信用にエンコードした画像"""
+
+    def __init__(self, data, mime_type, size, original_size, encode_seconds, quality=None):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.original_size = original_size
+        self.encode_seconds = encode_seconds
+        self.quality = quality
+
+    def get_stats(self):
+        """リクエストごとの送信サイズとエンコード時間"""
+        return {
+            "bytes": len(self.data),
+            "mime_type": self.mime_type,
+            "size": self.size,
+            "original_size": self.original_size,
+            "quality": self.quality,
+            "encode_seconds": self.encode_seconds,
+        }
+
+class DeferredUpload:
+    """送信用のエンコードを初めて必要になるまで行わない送信画像（PreparedUpload と同じように使える）
+
+    アップロード済みの参照で送る間は data を参照しないので、元の画像をエンコードしない。
+    """
+
+    def __init__(self, encoder, image):
+        self.image = image
+        self._encoder = encoder
+        self._prepared = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_prepared(self):
+        return self._prepared is not None
+
+    def prepare(self):
+        """送信用にエンコードする（済んでいれば同じものを返す）"""
+        with self._lock:
+            if self._prepared is None:
+                self._prepared = self._encoder.prepare(self.image)
+            return self._prepared
+
+    async def prepare_async(self):
+        """prepare の非同期版（エンコードはイベントループの外で行う）"""
+        if self._prepared is not None:
+            return self._prepared
+        return await asyncio.get_running_loop().run_in_executor(None, self.prepare)
+
+    @property
+    def data(self):
+        return self.prepare().data
+
+    @property
+    def mime_type(self):
+        return self.prepare().mime_type
+
+    @property
+    def size(self):
+        """送信する画像のサイズ（エンコード前は元の画像のサイズ）"""
+        prepared = self._prepared
+        return prepared.size if prepared is not None else self.image.size
+
+    def get_stats(self):
+        """リクエストごとの送信サイズとエンコード時間（エンコードせずに参照で送った場合は0）"""
+        if self._prepared is not None:
+            return self._prepared.get_stats()
+        return {
+            "bytes": 0,
+            "mime_type": None,
+            "size": None,
+            "original_size": self.image.size,
+            "quality": None,
+            "encode_seconds": 0.0,
+        }
+
+class _TimedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """リクエスト本文の送信にかかった時間を計測するストリーム"""
+
+    def __init__(self, stream, callback):
+        self._stream = stream
+        self._callback = callback
+
+    def __iter__(self):
+        started = time.perf_counter()
+        sent = 0
+        for chunk in self._stream:
+            sent += len(chunk)
+            yield chunk
+        self._callback(sent, time.perf_counter() - started)
+
+    async def __aiter__(self):
+        started = time.perf_counter()
+        sent = 0
+        async for chunk in self._stream:
+            sent += len(chunk)
+            yield chunk
+        self._callback(sent, time.perf_counter() - started)
+
+    def close(self):
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+    async def aclose(self):
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+class UploadEncoder:
+    """送信する画像の解像度・形式・画質を決める（容量上限と実測帯域に合わせる）"""
+
+    # 不透明な写真向け / 透過画像向けの画質の候補（高い順）
+    JPEG_QUALITIES = [92, 85, 75, 65, 50]
+    WEBP_QUALITIES = [90, 80, 70, 55]
+    # 再エンコードせずにそのまま送れる形式
+    PASSTHROUGH_TYPES = ("image/png", "image/jpeg", "image/webp")
+    # 画質を下げても収まらない場合の縮小率
+    DOWNSCALE_STEP = 0.75
+    # 帯域の計測に使う最小の送信サイズ（小さいリクエストは誤差が大きい）
+    MIN_MEASURE_BYTES = 64 * 1024
+
+    def __init__(self, max_edge=None, max_bytes=None, target_seconds=None, min_bytes=None):
+        self.max_edge = max_edge or Config.UPLOAD_MAX_EDGE
+        self.max_bytes = max_bytes or Config.UPLOAD_MAX_BYTES
+        self.target_seconds = target_seconds or Config.UPLOAD_TARGET_SECONDS
+        self.min_bytes = min_bytes or Config.UPLOAD_MIN_BYTES
+        self.bandwidth = None  # 実測した送信帯域（バイト/秒、指数移動平均）
+        self._lock = threading.Lock()
+
+    def record_upload(self, sent_bytes, seconds):
+        """送信にかかった時間から帯域の推定値を更新"""
+        if sent_bytes < self.MIN_MEASURE_BYTES or seconds <= 0:
+            return
+        measured = sent_bytes / seconds
+        with self._lock:
+            if self.bandwidth is None:
+                self.bandwidth = measured
+            else:
+                self.bandwidth = self.bandwidth * 0.7 + measured * 0.3
+        logger.debug("送信帯域を計測: %.0fKB/s (推定 %.0fKB/s)", measured / 1024, self.bandwidth / 1024)
+
+    def on_request(self, request):
+        """httpx.Client の request イベントフック"""
+        request.stream = _TimedStream(request.stream, self.record_upload)
+
+    async def on_async_request(self, request):
+        """httpx.AsyncClient の request イベントフック"""
+        request.stream = _TimedStream(request.stream, self.record_upload)
+
+    def get_byte_budget(self):
+        """今回の送信に使える最大バイト数"""
+        budget = self.max_bytes
+        with self._lock:
+            bandwidth = self.bandwidth
+        if bandwidth:
+            # base64化で約4/3倍になる分を見込んで目標時間内に送れるサイズにする
+            budget = min(budget, int(bandwidth * self.target_seconds * 3 / 4))
+        return max(budget, self.min_bytes)
+
+    def defer(self, image):
+        """エンコードを必要になるまで行わない送信画像を返す"""
+        return DeferredUpload(self, image)
+
+    def prepare(self, image):
+        """画像を送信用にエンコード（EncodedImage が条件内ならデコードせずそのまま使う）"""
+        with metrics.span("prepare") as span:
+            upload = self._prepare(image)
+            span.set(bytes=len(upload.data), mime_type=upload.mime_type)
+        return upload
+
+    def _prepare(self, image):
+        started = time.perf_counter()
+        original_size = image.size
+        budget = self.get_byte_budget()
+
+        if isinstance(image, EncodedImage):
+            if (image.mime_type in self.PASSTHROUGH_TYPES
+                    and len(image.data) <= budget and max(original_size) <= self.max_edge):
+                upload = PreparedUpload(image.data, image.mime_type, original_size, original_size,
+                                        time.perf_counter() - started)
+                logger.debug("送信画像をそのまま使用: %s, %s, %.0fKB", original_size, image.mime_type, len(image.data) / 1024)
+                return upload
+            image = image.to_pil()
+
+        has_alpha = self._has_alpha(image)
+        working = self._fit_edge(image, self.max_edge)
+        if working.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            working = working.convert("RGBA" if has_alpha else "RGB")
+
+        while True:
+            encoded = self._encode_within_budget(working, has_alpha, budget)
+            if encoded is not None:
+                break
+            # 最低画質でも収まらない場合は縮小してやり直す
+            new_edge = int(max(working.size) * self.DOWNSCALE_STEP)
+            if new_edge < 64:
+                encoded = self._encode(working, "WEBP" if has_alpha else "JPEG",
+                                       (self.WEBP_QUALITIES if has_alpha else self.JPEG_QUALITIES)[-1])
+                break
+            working = self._fit_edge(working, new_edge)
+
+        data, mime_type, quality = encoded
+        upload = PreparedUpload(data, mime_type, working.size, original_size,
+                                time.perf_counter() - started, quality)
+        logger.debug("送信画像を準備: %s -> %s, %s, %.0fKB (上限 %.0fKB), エンコード %.0fms",
+                     original_size, working.size, mime_type, len(data) / 1024, budget / 1024,
+                     upload.encode_seconds * 1000)
+        return upload
+
+    def _encode_within_budget(self, image, has_alpha, budget):
+        """形式と画質の候補を順に試し、上限に収まった最初のものを返す"""
+        # 色数の少ない画像（図・スクリーンショット等）や透過画像はまず可逆のPNGを試す
+        if has_alpha or image.getcolors(maxcolors=256) is not None:
+            candidate = self._encode(image, "PNG")
+            if len(candidate[0]) <= budget:
+                return candidate
+
+        if has_alpha:
+            formats = [("WEBP", quality) for quality in self.WEBP_QUALITIES]
+        else:
+            formats = [("JPEG", quality) for quality in self.JPEG_QUALITIES]
+
+        for image_format, quality in formats:
+            candidate = self._encode(image, image_format, quality)
+            if len(candidate[0]) <= budget:
+                return candidate
+        return None
+
+    @staticmethod
+    def _encode(image, image_format, quality=None):
+        """指定形式でエンコードして (データ, MIMEタイプ, 画質) を返す"""
+        buffer = io.BytesIO()
+        if image_format == "PNG":
+            image.save(buffer, format="PNG", compress_level=Config.UPLOAD_PNG_COMPRESS_LEVEL)
+        elif image_format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(buffer, format="JPEG", quality=quality)
+        else:
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            image.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue(), "image/" + image_format.lower(), quality
+
+    @staticmethod
+    def _fit_edge(image, max_edge):
+        """長辺が max_edge を超える場合は縮小したコピーを返す"""
+        if max(image.size) <= max_edge:
+            return image
+        scale = max_edge / float(max(image.size))
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if UploadEncoder._has_alpha(image) else "RGB")
+        return image.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+    @staticmethod
+    def _has_alpha(image):
+        """透過情報を持つ画像かどうか"""
+        return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
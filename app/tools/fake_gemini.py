@@ -0,0 +1,541 @@
+import io
+import re
+import json
+import math
+import time
+import base64
+import itertools
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+class FakeGeminiError(Exception):
+    """疑似サーバーが返すAPIエラー"""
+
+    def __init__(self, code, message, retry_after=None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+        # 再試行までの秒数の指定（クォータ超過の 429 のみ）
+        self.retry_after = retry_after
+
+class FakeGeminiSettings:
+    """疑似Geminiの動作設定"""
+
+    def __init__(self, latency="fixed:0.5", error_rate=0.0, payload="bytes",
+                 image_size=(1024, 1024), image_format="PNG", text="編集しました。", seed=None,
+                 quota_rpm=None, quota_burst=1, file_ttl=48 * 3600):
+        """
+        latency: 応答遅延の分布
+            "fixed:秒" / "uniform:最小,最大" / "normal:平均,標準偏差" / "lognormal:中央値,シグマ"
+        error_rate: エラー（429/500）を返す確率
+        payload: inline_data.data の形式 "bytes" または "base64"（HTTPサーバーでは常にbase64）
+        image_size: 返す画像のサイズ (幅, 高さ)
+        image_format: 返す画像の形式 "PNG" / "JPEG" / "WEBP"
+        quota_rpm: 1分あたりのリクエスト数の上限（超えると retry_after 付きの 429 を返す。Noneなら無制限）
+        quota_burst: 上限内で続けて受け付けるリクエスト数
+        file_ttl: アップロードされたファイルの保持秒数（過ぎたファイルを参照すると 403 を返す）
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload = payload
+        self.image_size = tuple(image_size)
+        self.image_format = image_format.upper()
+        self.text = text
+        self.seed = seed
+        self.quota_rpm = quota_rpm
+        self.quota_burst = quota_burst
+        self.file_ttl = file_ttl
+
+    @staticmethod
+    def parse_size(value):
+        """"1024x768" 形式のサイズ指定を解析"""
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+
+class FakeGeminiBackend:
+    """疑似Geminiの応答生成（クライアントとHTTPサーバーで共有）"""
+
+    # ストリーミング時、遅延のうちテキストの最初のチャンクが届くまでの割合
+    STREAM_FIRST_CHUNK_RATIO = 0.3
+    # アップロードされたファイルのURIの既定の接頭辞（HTTPサーバーではサーバーのURLを使う）
+    FILE_BASE_URL = "https://generativelanguage.googleapis.com"
+
+    def __init__(self, settings=None):
+        self.settings = settings or FakeGeminiSettings()
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._latency_sampler = self._build_latency_sampler(self.settings.latency)
+        self.mime_type, self.image_bytes = self._render_image()
+        self.image_base64 = base64.b64encode(self.image_bytes).decode("ascii")
+        self.request_count = 0
+        self.error_count = 0
+        self.rate_limited_count = 0
+        self.request_bytes = 0
+        # アップロードされたファイル（URI -> 有効期限のエポック秒）
+        self.files = {}
+        self.upload_count = 0
+        self.upload_bytes = 0
+        self._file_ids = itertools.count(1)
+        # クォータ（トークンバケット）
+        self._quota = float(self.settings.quota_burst)
+        self._quota_updated = time.monotonic()
+
+    def _build_latency_sampler(self, spec):
+        """遅延分布の指定から乱数生成関数を作成"""
+        name, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v]
+        rnd = self._random
+
+        if name == "fixed":
+            return lambda: values[0]
+        if name == "uniform":
+            return lambda: rnd.uniform(values[0], values[1])
+        if name == "normal":
+            return lambda: max(0.0, rnd.gauss(values[0], values[1]))
+        if name == "lognormal":
+            # 中央値とシグマで指定（mu = log(中央値)）
+            mu = math.log(values[0])
+            return lambda: rnd.lognormvariate(mu, values[1])
+        raise ValueError(f"未対応の遅延分布です: {spec}")
+
+    def _render_image(self):
+        """応答用の画像を一度だけエンコードしておく"""
+        width, height = self.settings.image_size
+        # 圧縮が効きすぎないようにノイズ入りの画像を作る
+        image = Image.effect_noise((width, height), 64).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.settings.image_format)
+        mime_type = "image/" + self.settings.image_format.lower()
+        return mime_type, buffer.getvalue()
+
+    def _check_quota(self):
+        """クォータを超えていれば 429 のエラーを返す（ロック内で呼ぶ）"""
+        if not self.settings.quota_rpm:
+            return None
+        rate = self.settings.quota_rpm / 60.0
+        now = time.monotonic()
+        self._quota = min(float(self.settings.quota_burst), self._quota + (now - self._quota_updated) * rate)
+        self._quota_updated = now
+        if self._quota < 1.0:
+            self.rate_limited_count += 1
+            return FakeGeminiError(429, "RESOURCE_EXHAUSTED", retry_after=(1.0 - self._quota) / rate)
+        self._quota -= 1.0
+        return None
+
+    def next_outcome(self, request_size=0, file_uris=()):
+        """リクエストを記録し、(遅延秒, エラー or None) を返す（参照したファイルがなければすぐに 403 を返す）"""
+        with self._lock:
+            self.request_count += 1
+            self.request_bytes += request_size
+            file_error = self._check_files(file_uris)
+            if file_error:
+                return 0.0, file_error
+            quota_error = self._check_quota()
+            if quota_error:
+                # クォータ超過はすぐに返す
+                return 0.0, quota_error
+            latency = self._latency_sampler()
+            if self._random.random() < self.settings.error_rate:
+                self.error_count += 1
+                error = self._random.choice([
+                    FakeGeminiError(429, "RESOURCE_EXHAUSTED"),
+                    FakeGeminiError(500, "INTERNAL"),
+                ])
+                return latency, error
+        return latency, None
+
+    def _check_files(self, file_uris):
+        """参照したファイルが存在しないか期限切れなら 403 のエラーを返す（ロック内で呼ぶ）"""
+        now = time.time()
+        for uri in file_uris:
+            expires_at = self.files.get(uri)
+            if expires_at is None or expires_at <= now:
+                self.error_count += 1
+                # 本物と同じく、参照先のファイルを含むメッセージを返す
+                name = uri.rsplit("/v1beta/", 1)[-1]
+                return FakeGeminiError(
+                    403, f"You do not have permission to access the File {name} or it may not exist.")
+        return None
+
+    def upload_file(self, size, mime_type, base_url=None):
+        """ファイルのアップロードを記録し、REST API と同じ形式のファイル情報を返す"""
+        with self._lock:
+            name = f"files/fake-{next(self._file_ids)}"
+            uri = f"{base_url or self.FILE_BASE_URL}/v1beta/{name}"
+            expires_at = time.time() + self.settings.file_ttl
+            self.files[uri] = expires_at
+            self.upload_count += 1
+            self.upload_bytes += size
+        expiration = datetime.fromtimestamp(expires_at, timezone.utc).isoformat().replace("+00:00", "Z")
+        return {
+            "name": name,
+            "uri": uri,
+            "mimeType": mime_type,
+            "sizeBytes": str(size),
+            "state": "ACTIVE",
+            "expirationTime": expiration,
+        }
+
+    def expire_files(self):
+        """アップロードされたファイルをすべて期限切れにする（参照の再アップロードの確認用）"""
+        with self._lock:
+            self.files.clear()
+
+    def build_response(self, payload=None):
+        """SDKと同じ candidates → content → parts 形式のレスポンスを作成"""
+        payload = payload or self.settings.payload
+        data = self.image_base64 if payload == "base64" else self.image_bytes
+        parts = [
+            SimpleNamespace(text=self.settings.text, inline_data=None),
+            SimpleNamespace(text=None, inline_data=SimpleNamespace(data=data, mime_type=self.mime_type)),
+        ]
+        content = SimpleNamespace(parts=parts, role="model")
+        return SimpleNamespace(candidates=[SimpleNamespace(content=content, finish_reason="STOP")])
+
+    def build_stream_chunks(self, payload=None):
+        """ストリーミング用にテキストと画像を別々のチャンクに分けたレスポンスを作成
+
+        実際のAPIと同じく、最後に終了理由だけを持つ（パートのない）チャンクを送る。
+        """
+        response = self.build_response(payload)
+        candidate = response.candidates[0]
+        chunks = [
+            SimpleNamespace(candidates=[SimpleNamespace(
+                content=SimpleNamespace(parts=[part], role="model"), finish_reason=None,
+            )])
+            for part in candidate.content.parts
+        ]
+        chunks.append(SimpleNamespace(candidates=[SimpleNamespace(
+            content=SimpleNamespace(parts=None, role="model"), finish_reason=candidate.finish_reason,
+        )]))
+        return chunks
+
+    def build_stream_chunks_json(self):
+        """streamGenerateContent のSSEで送る、テキストと画像を別々にしたチャンクのJSON"""
+        parts = self.build_response_json()["candidates"][0]["content"]["parts"]
+        chunks = [
+            {"candidates": [{"content": {"role": "model", "parts": [part]}}], "modelVersion": "fake-gemini"}
+            for part in parts
+        ]
+        chunks.append({"candidates": [{"content": {"role": "model"}, "finishReason": "STOP"}],
+                       "modelVersion": "fake-gemini"})
+        return chunks
+
+    def build_response_json(self):
+        """REST API と同じ形式のレスポンスJSONを作成"""
+        return {
+            "candidates": [{
+                "content": {
+                    "role": "model",
+                    "parts": [
+                        {"text": self.settings.text},
+                        {"inlineData": {"mimeType": self.mime_type, "data": self.image_base64}},
+                    ],
+                },
+                "finishReason": "STOP",
+            }],
+            "modelVersion": "fake-gemini",
+        }
+
+    @staticmethod
+    def estimate_request_size(contents):
+        """送信内容のおおよそのバイト数を計算"""
+        size = 0
+        for item in contents or []:
+            if isinstance(item, str):
+                size += len(item.encode("utf-8"))
+            elif isinstance(item, Image.Image):
+                size += item.width * item.height * len(item.getbands())
+            elif isinstance(item, (bytes, bytearray)):
+                size += len(item)
+            elif getattr(item, "inline_data", None) is not None:
+                # types.Part.from_bytes で作られたパート
+                size += len(item.inline_data.data)
+            elif getattr(item, "file_data", None) is not None:
+                # types.Part.from_uri で作られたパート（送るのはURIのみ）
+                size += len(item.file_data.file_uri.encode("utf-8"))
+        return size
+
+    @staticmethod
+    def file_uris(contents):
+        """送信内容が参照しているファイルのURI"""
+        return [item.file_data.file_uri for item in contents or []
+                if getattr(item, "file_data", None) is not None]
+
+    def next_outcome_for(self, contents):
+        """送信内容からリクエストを記録し、(遅延秒, エラー or None) を返す"""
+        return self.next_outcome(self.estimate_request_size(contents), self.file_uris(contents))
+
+class _FakeFiles:
+    """client.files 相当（upload のみ）"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def upload(self, file, config=None):
+        # file はファイルオブジェクト、config は {"mime_type": ...} のみ扱う
+        size = len(file.read())
+        info = self._backend.upload_file(size, (config or {}).get("mime_type") or "application/octet-stream")
+        return SimpleNamespace(name=info["name"], uri=info["uri"], mime_type=info["mimeType"],
+                               size_bytes=size, state=info["state"],
+                               expiration_time=datetime.fromisoformat(info["expirationTime"].replace("Z", "+00:00")))
+
+class _FakeAsyncFiles(_FakeFiles):
+    """client.aio.files 相当（upload のみ）"""
+
+    async def upload(self, file, config=None):
+        return super().upload(file, config)
+
+class _FakeModels:
+    """client.models 相当"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def generate_content(self, model, contents, config=None):
+        latency, error = self._backend.next_outcome_for(contents)
+        time.sleep(latency)
+        if error:
+            raise error
+        return self._backend.build_response()
+
+    def generate_content_stream(self, model, contents, config=None):
+        latency, error = self._backend.next_outcome_for(contents)
+        first_delay = latency * FakeGeminiBackend.STREAM_FIRST_CHUNK_RATIO
+        time.sleep(first_delay)
+        if error:
+            raise error
+        chunks = self._backend.build_stream_chunks()
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep((latency - first_delay) / (len(chunks) - 1))
+            yield chunk
+
+class _FakeAsyncModels:
+    """client.aio.models 相当"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def generate_content(self, model, contents, config=None):
+        latency, error = self._backend.next_outcome_for(contents)
+        await asyncio.sleep(latency)
+        if error:
+            raise error
+        return self._backend.build_response()
+
+    async def generate_content_stream(self, model, contents, config=None):
+        latency, error = self._backend.next_outcome_for(contents)
+        first_delay = latency * FakeGeminiBackend.STREAM_FIRST_CHUNK_RATIO
+        await asyncio.sleep(first_delay)
+        if error:
+            raise error
+        chunks = self._backend.build_stream_chunks()
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep((latency - first_delay) / (len(chunks) - 1))
+                yield chunk
+        return stream()
+
+class FakeGenerativeModel:
+    """バックアップモデル（google.generativeai.GenerativeModel）の代わりに使える疑似モデル（通信なし）"""
+
+    def __init__(self, settings=None, backend=None):
+        self.backend = backend or FakeGeminiBackend(settings)
+
+    def _build_response(self):
+        """parts と text を持つ GenerateContentResponse 形式のレスポンスを作成"""
+        parts = self.backend.build_response("bytes").candidates[0].content.parts
+        return SimpleNamespace(parts=parts, text=self.backend.settings.text)
+
+    def generate_content(self, contents, **options):
+        latency, error = self.backend.next_outcome(self.backend.estimate_request_size(contents))
+        time.sleep(latency)
+        if error:
+            raise error
+        return self._build_response()
+
+    async def generate_content_async(self, contents, **options):
+        latency, error = self.backend.next_outcome(self.backend.estimate_request_size(contents))
+        await asyncio.sleep(latency)
+        if error:
+            raise error
+        return self._build_response()
+
+class FakeGeminiClient:
+    """genai.Client の代わりに使える疑似クライアント（通信なし）"""
+
+    def __init__(self, settings=None, backend=None):
+        self.backend = backend or FakeGeminiBackend(settings)
+        self.models = _FakeModels(self.backend)
+        self.files = _FakeFiles(self.backend)
+        self.aio = SimpleNamespace(models=_FakeAsyncModels(self.backend), files=_FakeAsyncFiles(self.backend))
+
+class FakeGeminiServer:
+    """generateContent・streamGenerateContent（SSE）と Files API（再開可能アップロード）のREST APIを模したローカルHTTPサーバー
+
+    genai.Client(api_key="fake", http_options={"base_url": server.base_url}) で接続できる。
+    """
+
+    PATH_PATTERN = re.compile(r"^/[^/]+/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)")
+    UPLOAD_PATH_PATTERN = re.compile(r"^/upload/[^/]+/files")
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        self.backend = FakeGeminiBackend(settings)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """SDKに渡すベースURL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        """バックエンドを参照するリクエストハンドラーを作成"""
+        backend = self.backend
+        pattern = self.PATH_PATTERN
+        upload_pattern = self.UPLOAD_PATH_PATTERN
+        server = self
+        # アップロード中のファイル（upload_id -> {"mime_type", "size", "received"}）
+        uploads = {}
+        upload_ids = itertools.count(1)
+        uploads_lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+
+                if upload_pattern.match(self.path):
+                    self._handle_upload(body)
+                    return
+                match = pattern.match(self.path)
+                if not match:
+                    self._send_json(404, {"error": {"code": 404, "message": "Not Found", "status": "NOT_FOUND"}})
+                    return
+
+                streaming = match.group("method") == "streamGenerateContent"
+                latency, error = backend.next_outcome(length, self._file_uris(body))
+                # ストリーミングでは最初のチャンクまでの分だけ待ち、残りはチャンクの間に待つ
+                first_delay = latency * FakeGeminiBackend.STREAM_FIRST_CHUNK_RATIO if streaming else latency
+                time.sleep(first_delay)
+                if error:
+                    status = {429: "RESOURCE_EXHAUSTED", 403: "PERMISSION_DENIED"}.get(error.code, "INTERNAL")
+                    body = {"error": {"code": error.code, "message": error.message, "status": status}}
+                    headers = {}
+                    if error.retry_after is not None:
+                        # 本物と同じく RetryInfo で再試行までの時間を返す
+                        body["error"]["details"] = [{
+                            "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                            "retryDelay": f"{error.retry_after:.3f}s",
+                        }]
+                        headers["Retry-After"] = str(max(1, round(error.retry_after)))
+                    self._send_json(error.code, body, headers)
+                    return
+
+                if streaming:
+                    self._send_stream(backend.build_stream_chunks_json(), latency - first_delay)
+                else:
+                    self._send_json(200, backend.build_response_json())
+
+            def _send_stream(self, chunks, remaining_delay):
+                """チャンクをSSE（data: 行）として chunked 転送で送る"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, chunk in enumerate(chunks):
+                    if i:
+                        time.sleep(remaining_delay / (len(chunks) - 1))
+                    data = f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            @staticmethod
+            def _file_uris(body):
+                """リクエストが参照しているファイルのURI（fileData を含むときだけJSONを解析する）"""
+                if b'"fileData"' not in body:
+                    return []
+                request = json.loads(body)
+                # SDK は fileData の中身を snake_case で送る（本物はどちらも受け付ける）
+                return [part["fileData"].get("fileUri") or part["fileData"].get("file_uri")
+                        for content in request.get("contents", [])
+                        for part in content.get("parts", []) if "fileData" in part]
+
+            def _handle_upload(self, body):
+                """再開可能アップロード（開始 → upload → upload, finalize）を処理する"""
+                command = self.headers.get("X-Goog-Upload-Command", "")
+                if command == "start":
+                    file = json.loads(body or b"{}").get("file", {})
+                    with uploads_lock:
+                        upload_id = next(upload_ids)
+                        uploads[upload_id] = {
+                            "mime_type": file.get("mimeType") or self.headers.get("X-Goog-Upload-Header-Content-Type"),
+                            "received": 0,
+                        }
+                    upload_url = f"{server.base_url}/upload/v1beta/files?upload_id={upload_id}"
+                    self._send_json(200, {}, {"X-Goog-Upload-URL": upload_url, "X-Goog-Upload-Status": "active"})
+                    return
+
+                upload_id = int(parse_qs(urlparse(self.path).query).get("upload_id", ["0"])[0])
+                with uploads_lock:
+                    upload = uploads.get(upload_id)
+                    if upload is None:
+                        self._send_json(404, {"error": {"code": 404, "message": "Not Found", "status": "NOT_FOUND"}},
+                                        {"X-Goog-Upload-Status": "final"})
+                        return
+                    upload["received"] += len(body)
+                    if "finalize" not in command:
+                        self._send_json(200, {}, {"X-Goog-Upload-Status": "active"})
+                        return
+                    del uploads[upload_id]
+                file = backend.upload_file(upload["received"], upload["mime_type"], server.base_url)
+                self._send_json(200, {"file": file}, {"X-Goog-Upload-Status": "final"})
+
+            def do_HEAD(self):
+                # 接続の事前確立（HttpTransport.warm_up）用。本物と同じく404を返し、接続は閉じない
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _send_json(self, code, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # 負荷試験中にアクセスログを出さない
+                pass
+
+        return Handler
+
+    def start(self):
+        """バックグラウンドスレッドでサーバーを起動"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="FakeGeminiServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
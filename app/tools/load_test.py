@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# app/ をインポートパスに追加（python app/tools/load_test.py で実行できるように）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.config import Config
+from utils.encoded_image import EncodedImage
+from tools.fake_gemini import FakeGeminiSettings, FakeGeminiClient, FakeGeminiServer, FakeGenerativeModel
+
+def percentile(values, p):
+    """パーセンタイル値を計算（線形補間）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+class LoadTest:
+    """modify_image → save_edited_image → add_message の一連の処理に負荷をかける"""
+
+    STAGES = ["encode", "api", "save", "persist", "total"]
+
+    def __init__(self, gemini_service, thread_manager, image_service, input_image, distinct_prompts=None,
+                 stream_loop=None):
+        self.gemini_service = gemini_service
+        # ストリーミングで受信するときは AsyncGeminiService をこのイベントループ上で実行する
+        self.stream_loop = stream_loop
+        self.thread_manager = thread_manager
+        self.image_service = image_service
+        self.input_image = input_image
+        # 指示テキストの種類数（キャッシュ効果を測るときは小さくする）
+        self.distinct_prompts = distinct_prompts or sys.maxsize
+        # ThreadManager/ImageServiceはスレッドセーフではないため保存処理は直列化する
+        self._save_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.timings = {stage: [] for stage in self.STAGES}
+        self.ttfb = []
+        self.failures = 0
+        self.upload_bytes = 0
+
+    def _edit_once(self, index):
+        """1回分の編集を実行して各段階の所要時間を記録"""
+        started = time.perf_counter()
+        instruction_text = f"負荷試験 {index % self.distinct_prompts}"
+        if self.stream_loop is not None:
+            request = self.gemini_service.modify_image_async(
+                self.input_image, instruction_text, on_progress=lambda event: None)
+            result = asyncio.run_coroutine_threadsafe(request, self.stream_loop).result()
+        else:
+            result = self.gemini_service.modify_image(self.input_image, instruction_text)
+        api_done = time.perf_counter()
+
+        if not result.get("image"):
+            with self._stats_lock:
+                self.failures += 1
+            return
+
+        with self._save_lock:
+            save_started = time.perf_counter()
+            image_path = self.image_service.save_edited_image(result["image"])
+            saved = time.perf_counter()
+            self.thread_manager.add_message("assistant", result.get("text", ""), image_path)
+            persisted = time.perf_counter()
+
+        upload = result.get("upload") or {}
+        ttfb = (result.get("timing") or {}).get("ttfb")
+        with self._stats_lock:
+            if ttfb is not None:
+                self.ttfb.append(ttfb)
+            self.upload_bytes += upload.get("bytes", 0)
+            self.timings["encode"].append(upload.get("encode_seconds", 0.0))
+            self.timings["api"].append(api_done - started - upload.get("encode_seconds", 0.0))
+            self.timings["save"].append(saved - save_started)
+            self.timings["persist"].append(persisted - saved)
+            self.timings["total"].append(persisted - started)
+
+    def run(self, requests, concurrency):
+        """指定回数の編集を並列に実行し、経過時間を返す"""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(self._edit_once, range(requests)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        """レイテンシ分布とスループットを表示"""
+        completed = len(self.timings["total"])
+        print(f"完了: {completed}件, 失敗: {self.failures}件, 経過時間: {elapsed:.2f}秒")
+        print(f"スループット: {completed / elapsed if elapsed else 0.0:.2f} edits/sec")
+        print(f"平均送信サイズ: {self.upload_bytes / completed / 1024 if completed else 0.0:.0f}KB")
+        print(f"{'段階':<10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+        for stage in self.STAGES:
+            values = self.timings[stage]
+            print(f"{stage:<10}"
+                  f"{percentile(values, 50) * 1000:>10.1f}"
+                  f"{percentile(values, 95) * 1000:>10.1f}"
+                  f"{percentile(values, 99) * 1000:>10.1f}")
+        if self.ttfb:
+            print(f"{'ttfb':<10}"
+                  f"{percentile(self.ttfb, 50) * 1000:>10.1f}"
+                  f"{percentile(self.ttfb, 95) * 1000:>10.1f}"
+                  f"{percentile(self.ttfb, 99) * 1000:>10.1f}")
+
+def main(argv=None):
+    """負荷試験のエントリーポイント（通信は一切行わない）"""
+    parser = argparse.ArgumentParser(description="疑似Geminiを使って画像編集パイプラインの負荷試験を行います")
+    parser.add_argument("--requests", type=int, default=50, help="編集リクエストの総数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時実行数")
+    parser.add_argument("--mode", choices=["client", "http"], default="client",
+                        help="client: プロセス内の疑似クライアント / http: ローカルHTTPサーバー経由で実際のSDKを使用")
+    parser.add_argument("--latency", default="lognormal:1.0,0.4", help="応答遅延の分布 (例: fixed:0.5, uniform:0.2,1.0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラー応答の割合")
+    parser.add_argument("--stream", action="store_true",
+                        help="アプリと同じく AsyncGeminiService のストリーミング（streamGenerateContent）で受信する")
+    parser.add_argument("--payload", choices=["bytes", "base64"], default="bytes", help="画像データの形式")
+    parser.add_argument("--image-size", default="1024x1024", help="応答画像のサイズ")
+    parser.add_argument("--image-format", default="PNG", help="応答画像の形式")
+    parser.add_argument("--input-size", default="1024x1024", help="入力画像のサイズ")
+    parser.add_argument("--backup-latency", default=None,
+                        help="疑似バックアップモデルの応答遅延の分布（指定するとバックアップモデルとヘッジ実行を有効にする）")
+    parser.add_argument("--backup-error-rate", type=float, default=0.0, help="疑似バックアップモデルのエラー応答の割合")
+    parser.add_argument("--hedge-delay", type=float, default=None, help="バックアップにも送るまでの待ち時間（秒）")
+    parser.add_argument("--quota-rpm", type=float, default=None,
+                        help="疑似サーバーのクォータ（1分あたりのリクエスト数。超えると 429 を返す）")
+    parser.add_argument("--quota-burst", type=int, default=1, help="疑似サーバーのクォータ内で続けて受け付ける件数")
+    parser.add_argument("--rate-limit-rpm", type=float, default=None,
+                        help="クライアント側の送信枠（1分あたりのリクエスト数。既定はクォータと同じ）")
+    parser.add_argument("--no-rate-limit", action="store_true", help="クライアント側の送信枠を使わない（再試行のみ）")
+    parser.add_argument("--cache", action="store_true", help="レスポンスキャッシュを有効にする")
+    parser.add_argument("--no-file-upload", action="store_true",
+                        help="入力画像を Files API にアップロードせず、毎回画像データを直接送る")
+    parser.add_argument("--distinct-prompts", type=int, default=None, help="指示テキストの種類数（既定は全件別々）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード")
+    parser.add_argument("--verbose", action="store_true", help="サービスのログを表示する")
+    parser.add_argument("--metrics", action="store_true",
+                        help="段階ごとの所要時間を記録して表示し、トレースとPrometheus形式で書き出す")
+    args = parser.parse_args(argv)
+    # 既定では警告以上のみ表示する
+    Config.configure_logging("INFO" if args.verbose else "WARNING")
+
+    settings = FakeGeminiSettings(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        payload=args.payload,
+        image_size=FakeGeminiSettings.parse_size(args.image_size),
+        image_format=args.image_format,
+        seed=args.seed,
+        quota_rpm=args.quota_rpm,
+        quota_burst=args.quota_burst,
+    )
+
+    # 送信枠はクォータに合わせる（どちらも指定がなければ実質無制限）
+    Config.RATE_LIMIT_ENABLED = not args.no_rate_limit
+    Config.RATE_LIMIT_RPM = args.rate_limit_rpm or args.quota_rpm or 1000000
+    Config.RATE_LIMIT_TPM = None
+    Config.RATE_LIMIT_BURST = args.quota_burst
+    # 再試行の回数は十分にとり、クォータ超過で失敗しないようにする
+    Config.RETRY_MAX_ATTEMPTS = 20
+
+    # 保存先を一時ディレクトリに切り替え、実際の履歴を汚さない
+    work_dir = tempfile.mkdtemp(prefix="gemini_load_")
+    Config.SAVE_DIRECTORY = work_dir
+    Config.THREADS_DIRECTORY = os.path.join(work_dir, "threads")
+    Config.THREAD_DB_FILE = os.path.join(work_dir, "threads.db")
+    Config.CACHE_DIRECTORY = os.path.join(work_dir, "cache")
+    Config.TILE_STORE_DIRECTORY = os.path.join(work_dir, "store")
+    Config.RESPONSE_CACHE_ENABLED = args.cache
+    Config.FILE_UPLOAD_ENABLED = not args.no_file_upload
+    if args.hedge_delay is not None:
+        Config.HEDGE_DELAY_SECONDS = args.hedge_delay
+    Config.ensure_directories()
+
+    from services.gemini_service import GeminiService
+    from services.async_gemini_service import AsyncGeminiService
+    from services.image_service import ImageService
+    from models.thread_manager import ThreadManager
+    from utils.metrics import metrics
+    from utils.image_cache import decoded_images
+    if args.metrics:
+        metrics.enable()
+
+    server = None
+    transport = None
+    if args.mode == "http":
+        from google import genai
+        from google.genai import types
+        from services.http_transport import HttpTransport
+        server = FakeGeminiServer(settings).start()
+        # アプリと同じ接続プールを使い、接続の再利用率も表示する
+        transport = HttpTransport()
+        client = genai.Client(api_key="fake-key", http_options=types.HttpOptions(
+            base_url=server.base_url,
+            httpx_client=transport.client,
+            httpx_async_client=transport.async_client,
+        ))
+        backend = server.backend
+    else:
+        client = FakeGeminiClient(settings)
+        backend = client.backend
+
+    backup_model = None
+    if args.backup_latency:
+        backup_model = FakeGenerativeModel(FakeGeminiSettings(
+            latency=args.backup_latency,
+            error_rate=args.backup_error_rate,
+            image_size=FakeGeminiSettings.parse_size(args.image_size),
+            image_format=args.image_format,
+            seed=args.seed,
+        ))
+    stream_loop = None
+    if args.stream:
+        # 非同期版はアプリの AsyncBridge と同じく1つのイベントループを専用スレッドで回して使う
+        stream_loop = asyncio.new_event_loop()
+        threading.Thread(target=stream_loop.run_forever, name="LoadTestLoop", daemon=True).start()
+        gemini_service = AsyncGeminiService(max_concurrency=args.concurrency, client=client, backup_model=backup_model)
+    else:
+        gemini_service = GeminiService(client=client, backup_model=backup_model)
+    gemini_service.transport = transport
+    # 疑似バックアップモデルを指定しない場合は、実際のAPIに接続しないようにバックアップを無効にする
+    gemini_service.backup_enabled = backup_model is not None
+
+    # アプリと同じくエンコード済みの画像を入力にする（アップロード済みの参照はこの内容のハッシュで引く）
+    input_image = EncodedImage.from_pil(
+        Image.effect_noise(FakeGeminiSettings.parse_size(args.input_size), 64).convert("RGB"))
+
+    print(f"負荷試験開始: {args.requests}件, 同時実行数={args.concurrency}, モード={args.mode}{'（ストリーミング）' if args.stream else ''}, 保存先={work_dir}")
+    thread_manager = ThreadManager()
+    image_service = ImageService(thread_manager)
+    load_test = LoadTest(gemini_service, thread_manager, image_service, input_image, args.distinct_prompts,
+                         stream_loop)
+    elapsed = load_test.run(args.requests, args.concurrency)
+    if stream_loop is not None:
+        stream_loop.call_soon_threadsafe(stream_loop.stop)
+
+    if server:
+        server.stop()
+
+    if gemini_service.response_cache:
+        print(f"キャッシュ: {gemini_service.response_cache.get_stats()}")
+
+    load_test.report(elapsed)
+    print(f"疑似サーバー: リクエスト {backend.request_count}件, エラー {backend.error_count}件, "
+          f"クォータ超過 {backend.rate_limited_count}件, 送信量 {backend.request_bytes / 1024 / 1024:.1f}MB, "
+          f"アップロード {backend.upload_count}件 ({backend.upload_bytes / 1024 / 1024:.1f}MB)")
+    if gemini_service.file_uploads is not None:
+        stats = gemini_service.get_file_upload_stats()
+        print(f"ファイル参照: アップロード {stats['uploads']}件, 再利用 {stats['reused']}件 "
+              f"({stats['reused_bytes'] / 1024 / 1024:.1f}MB 分の送信を省略), "
+              f"失敗 {stats['failures']}件, 期限切れ {stats['invalidated']}件")
+    for model_name, stats in gemini_service.get_rate_limit_stats().items():
+        print(f"送信枠 {model_name}: 待ち {stats['throttled']}件 (計 {stats['throttled_seconds']:.1f}秒, "
+              f"最大待ち行列 {stats['max_waiting']}), 429 {stats['rate_limited']}件, 再試行 {stats['retries']}件")
+    for model_name, stats in gemini_service.get_model_stats().items():
+        print(f"モデル {model_name}: リクエスト {stats['requests']}件, 成功率 {(stats['success_rate'] or 0.0) * 100:.0f}%, "
+              f"p50 {(stats['latency_p50'] or 0.0) * 1000:.0f}ms, 状態 {stats['state']}")
+    if transport is not None:
+        stats = transport.get_stats()
+        print(f"接続: リクエスト {stats['requests']}件, 新規接続 {stats['new_connections']}件, "
+              f"再利用率 {stats['reuse_ratio'] * 100:.0f}%")
+    stats = decoded_images.get_stats()
+    print(f"デコード済み画像: {stats['bytes'] / 1024 / 1024:.0f}MB (最大 {stats['peak_bytes'] / 1024 / 1024:.0f}MB, "
+          f"上限 {stats['max_bytes'] / 1024 / 1024:.0f}MB), {stats['entries']}件, 破棄 {stats['evictions']}件")
+    if args.metrics:
+        print(f"{'計測区間':<16}{'件数':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'最大(ms)':>10}")
+        for stage, stats in sorted(metrics.get_stats().items()):
+            print(f"{stage:<16}{stats['count']:>8}{stats['p50'] * 1000:>10.1f}"
+                  f"{stats['p95'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}")
+        paths = metrics.export(os.path.join(work_dir, "metrics"))
+        print("計測結果: " + ", ".join(paths.values()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
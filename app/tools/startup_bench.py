@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+
+# app/ をインポートパスに追加（python app/tools/startup_bench.py で実行できるように）
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from models.thread_store import ThreadStore
+
+STARTUP_BENCH_ENV = "GEMINI_IMG_EDITOR_STARTUP_BENCH"
+
+def seed_threads(home, thread_count, messages_per_thread):
+    """ベンチマーク用のホームディレクトリにスレッドを作成"""
+    db_path = os.path.join(home, "Pictures", "GeminiImgEditor", "threads.db")
+    store = ThreadStore(db_path)
+    now = datetime.datetime.now().isoformat()
+    for i in range(thread_count):
+        thread_id = f"thread_{i + 1:02d}"
+        store.create_thread(thread_id, f"スレッド {i + 1}", now)
+        for j in range(messages_per_thread):
+            store.append_message(thread_id, "user" if j % 2 == 0 else "assistant", f"メッセージ {j + 1}", now)
+    store.close()
+
+def run_once(env, timeout):
+    """アプリを1回起動し、起動からの各時刻（秒）を返す"""
+    started = time.time()
+    process = subprocess.run(
+        [sys.executable, os.path.join(APP_DIR, "main.py")],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, timeout=timeout
+    )
+    result = {}
+    for line in process.stdout.splitlines():
+        parts = line.split()
+        if len(parts) != 3 or parts[0] != "STARTUP":
+            continue
+        name, value = parts[1], float(parts[2])
+        # 段階の所要時間はそのまま、時刻は起動からの経過時間にする
+        result[name] = value if name.startswith("step:") else value - started
+    if "first_paint" not in result or "ready" not in result:
+        raise RuntimeError(f"起動時間を取得できませんでした (終了コード {process.returncode}):\n{process.stderr[-2000:]}")
+    return result
+
+def main(argv=None):
+    """起動時間のベンチマーク（最初の描画まで / 操作可能になるまで）"""
+    parser = argparse.ArgumentParser(description="アプリの起動時間（最初の描画・操作可能になるまで）を計測します")
+    parser.add_argument("--runs", type=int, default=5, help="起動回数")
+    parser.add_argument("--threads", type=int, default=0, help="事前に作成するスレッド数")
+    parser.add_argument("--messages", type=int, default=10, help="スレッドあたりのメッセージ数")
+    parser.add_argument("--use-profile", action="store_true", help="一時ディレクトリではなく実際の保存データで起動する")
+    parser.add_argument("--platform", default=None, help="Qtのプラットフォーム（例: offscreen）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="1回の起動の制限時間（秒）")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env[STARTUP_BENCH_ENV] = "1"
+    # APIキーがないと警告ダイアログで止まるため、ダミーを設定する（通信は行わない）
+    env.setdefault("GOOGLE_API_KEY", "startup-bench")
+    if args.platform:
+        env["QT_QPA_PLATFORM"] = args.platform
+    if not args.use_profile:
+        home = tempfile.mkdtemp(prefix="gemini_startup_")
+        env["HOME"] = home
+        env["USERPROFILE"] = home
+        if args.threads:
+            seed_threads(home, args.threads, args.messages)
+        print(f"保存先: {home} (スレッド {args.threads}件)")
+
+    runs = []
+    for i in range(args.runs):
+        result = run_once(env, args.timeout)
+        runs.append(result)
+        print(f"{i + 1}回目: 最初の描画 {result['first_paint'] * 1000:.0f}ms, 操作可能 {result['ready'] * 1000:.0f}ms")
+
+    print(f"{'指標':<20} {'中央値(ms)':>10} {'最小(ms)':>10} {'最大(ms)':>10}")
+    names = ["first_paint", "ready"] + sorted(name for name in runs[0] if name.startswith("step:"))
+    for name in names:
+        values = [run[name] * 1000 for run in runs if name in run]
+        print(f"{name:<20} {statistics.median(values):>10.0f} {min(values):>10.0f} {max(values):>10.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
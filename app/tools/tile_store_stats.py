@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import argparse
+
+# app/ をインポートパスに追加（python app/tools/tile_store_stats.py で実行できるように）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.config import Config
+from utils.tile_store import TileStore
+
+def main(argv=None):
+    """タイルストアの重複排除の効果を表示する"""
+    parser = argparse.ArgumentParser(description="画像の版を保存するタイルストアの使用量と重複排除率を表示します")
+    parser.add_argument("--save-dir", default=None, help="マニフェストのあるディレクトリ（既定は保存ディレクトリ）")
+    parser.add_argument("--store-dir", default=None, help="タイルストアのディレクトリ")
+    args = parser.parse_args(argv)
+
+    save_dir = args.save_dir or Config.SAVE_DIRECTORY
+    store_dir = args.store_dir or (os.path.join(args.save_dir, "store") if args.save_dir else None)
+    stats = TileStore(store_dir).stats(save_dir)
+
+    print(f"画像: {stats['images']}件")
+    print(f"タイル: 参照 {stats['logical_tiles']}件 / 保存 {stats['unique_tiles']}件 (重複排除率 {stats['dedup_ratio']:.2f}x)")
+    print(f"容量: 非圧縮 {stats['logical_bytes'] / 1024 / 1024:.1f}MB / ディスク {stats['stored_bytes'] / 1024 / 1024:.1f}MB "
+          f"({stats['space_ratio']:.2f}x)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
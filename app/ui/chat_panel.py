@@ -1,96 +1,27 @@
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, 
-    QPushButton, QLabel, QComboBox, QScrollArea, 
-    QSizePolicy, QSpacerItem
+    QPushButton, QLabel, QComboBox, QCheckBox, QSpinBox
 )
-from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QPixmap, QImage
+from PySide6.QtCore import Signal
 
-class MessageWidget(QWidget):
-    """メッセージ表示用ウィジェット"""
-    def __init__(self, message, is_user=True, image=None, parent=None):
-        super().__init__(parent)
-        self.setup_ui(message, is_user, image)
-    
-    def setup_ui(self, message, is_user, image):
-        """UIの初期化"""
-        # メインレイアウト
-        main_layout = QVBoxLayout(self)
-        main_layout.setContentsMargins(10, 10, 10, 10)
-        
-        # 水平レイアウト - メッセージの左右位置を調整するため
-        h_layout = QHBoxLayout()
-        
-        # メッセージウィジェットのコンテナ
-        msg_container = QWidget()
-        msg_layout = QVBoxLayout(msg_container)
-        msg_layout.setContentsMargins(10, 10, 10, 10)
-        
-        # メッセージの背景色を設定
-        if is_user:
-            msg_container.setStyleSheet("background-color: #e1f5fe; color: #000000; border-radius: 10px;")
-        else:
-            msg_container.setStyleSheet("background-color: #66bb6a; color: #000000; border-radius: 10px;")
-        
-        # テキストメッセージ
-        message_label = QLabel(message)
-        message_label.setWordWrap(True)
-        message_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        # メッセージラベルが適切な幅を持つように設定
-        message_label.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
-        message_label.setMinimumWidth(100)
-        msg_layout.addWidget(message_label)
-        
-        # 画像があれば表示
-        if image:
-            if isinstance(image, str):
-                # 画像ファイルパス
-                pixmap = QPixmap(image)
-                image_label = QLabel()
-                image_label.setPixmap(pixmap.scaled(
-                    300, 300,
-                    Qt.KeepAspectRatio,
-                    Qt.SmoothTransformation
-                ))
-                msg_layout.addWidget(image_label)
-            elif isinstance(image, QPixmap) or isinstance(image, QImage):
-                # ピクセルマップまたはQImage
-                image_label = QLabel()
-                if isinstance(image, QImage):
-                    pixmap = QPixmap.fromImage(image)
-                else:
-                    pixmap = image
-                image_label.setPixmap(pixmap.scaled(
-                    300, 300,
-                    Qt.KeepAspectRatio,
-                    Qt.SmoothTransformation
-                ))
-                msg_layout.addWidget(image_label)
-        
-        # コンテナの最大幅を制限
-        msg_container.setMaximumWidth(500)
-        
-        # 左右のスペーサーを使って位置を調整
-        if is_user:
-            h_layout.addStretch(1)  # 左側にスペーサーを追加（右寄せ）
-            h_layout.addWidget(msg_container)
-        else:
-            h_layout.addWidget(msg_container)
-            h_layout.addStretch(1)  # 右側にスペーサーを追加（左寄せ）
-        
-        main_layout.addLayout(h_layout)
+from services.thumbnail_service import ThumbnailService
+from ui.transcript_view import TranscriptModel, TranscriptView
+from utils.config import Config
 
 class ChatPanel(QWidget):
     """チャットパネルコンポーネント"""
     
     # メッセージが送信されたときのシグナル
     message_sent = Signal(str)
+    cancel_requested = Signal()
     new_thread_requested = Signal()
     thread_changed = Signal(str)
     open_save_dir_requested = Signal()
     
     def __init__(self, parent=None):
         super().__init__(parent)
+        # 会話履歴の画像はサムネイルをバックグラウンドで作成して表示する
+        self.thumbnail_service = ThumbnailService(parent=self)
         self.setup_ui()
     
     def setup_ui(self):
@@ -119,19 +50,11 @@ class ChatPanel(QWidget):
         
         main_layout.addLayout(toolbar_layout)
         
-        # メッセージ表示エリア
-        self.messages_area = QScrollArea()
-        self.messages_area.setWidgetResizable(True)
-        self.messages_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.messages_area.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        
-        self.messages_container = QWidget()
-        self.messages_layout = QVBoxLayout(self.messages_container)
-        self.messages_layout.setAlignment(Qt.AlignTop)
-        self.messages_layout.setSpacing(10)
-        
-        self.messages_area.setWidget(self.messages_container)
-        main_layout.addWidget(self.messages_area)
+        # メッセージ表示エリア（全履歴をモデルに持ち、見えている行だけを描画する）
+        self.messages_model = TranscriptModel(self.thumbnail_service, self)
+        self.messages_view = TranscriptView()
+        self.messages_view.setModel(self.messages_model)
+        main_layout.addWidget(self.messages_view)
         
         # 入力エリア
         input_layout = QHBoxLayout()
@@ -146,8 +69,34 @@ class ChatPanel(QWidget):
         self.send_button.setEnabled(False)  # 初期状態は無効
         input_layout.addWidget(self.send_button)
         
+        # 処理中のみ表示するキャンセルボタン（このスレッドの待機中・実行中の編集を全て取り消す）
+        self.cancel_button = QPushButton("キャンセル")
+        self.cancel_button.clicked.connect(self._on_cancel_clicked)
+        self.cancel_button.setVisible(False)
+        input_layout.addWidget(self.cancel_button)
+        
         main_layout.addLayout(input_layout)
         
+        # 編集ジョブの状態（処理中も入力は受け付け、送信した編集は順番に実行される）
+        status_layout = QHBoxLayout()
+        
+        self.job_status_label = QLabel()
+        status_layout.addWidget(self.job_status_label)
+        status_layout.addStretch()
+        
+        # 同じ指示で並行して生成し、結果を見比べて採用するバリエーション数
+        status_layout.addWidget(QLabel("バリエーション:"))
+        self.variant_spin = QSpinBox()
+        self.variant_spin.setRange(1, Config.MAX_VARIANTS)
+        self.variant_spin.setValue(1)
+        status_layout.addWidget(self.variant_spin)
+        
+        # 他のスレッドの編集より先に実行する
+        self.priority_checkbox = QCheckBox("優先して実行")
+        status_layout.addWidget(self.priority_checkbox)
+        
+        main_layout.addLayout(status_layout)
+        
         # メッセージ入力時にボタンの有効/無効を切り替え
         self.message_input.textChanged.connect(self._on_input_changed)
         
@@ -166,6 +115,10 @@ class ChatPanel(QWidget):
             self.message_sent.emit(message)
             self.message_input.clear()
     
+    def _on_cancel_clicked(self):
+        """キャンセルボタンがクリックされたときの処理"""
+        self.cancel_requested.emit()
+    
     def _on_new_thread_clicked(self):
         """新規会話ボタンがクリックされたときの処理"""
         self.new_thread_requested.emit()
@@ -213,14 +166,7 @@ class ChatPanel(QWidget):
     
     def clear_messages(self):
         """メッセージを全てクリア"""
-        for i in reversed(range(self.messages_layout.count())):
-            item = self.messages_layout.itemAt(i)
-            if item:
-                widget = item.widget()
-                if widget:
-                    widget.deleteLater()
-                else:
-                    self.messages_layout.removeItem(item)
+        self.messages_model.clear()
     
     def add_user_message(self, message, image=None):
         """ユーザーメッセージを追加"""
@@ -232,45 +178,54 @@ class ChatPanel(QWidget):
     
     def add_message(self, message, is_user=True, image=None):
         """メッセージを追加"""
-        message_widget = MessageWidget(message, is_user, image)
-        
-        # メッセージが多すぎる場合は一部削除
-        if self.messages_layout.count() > 100:  # 最大メッセージ数
-            # 最初の方のメッセージを削除
-            for i in range(min(10, self.messages_layout.count() - 90)):
-                item = self.messages_layout.itemAt(0)
-                if item:
-                    widget = item.widget()
-                    if widget:
-                        widget.deleteLater()
-                    self.messages_layout.removeItem(item)
-        
-        self.messages_layout.addWidget(message_widget)
-        
-        # スクロールエリアを最下部にスクロール
-        self.messages_area.verticalScrollBar().setValue(
-            self.messages_area.verticalScrollBar().maximum()
-        )
-    
-    def set_processing_state(self, is_processing):
-        """処理中の状態を設定"""
-        self.send_button.setEnabled(not is_processing)
-        self.message_input.setEnabled(not is_processing)
-        if is_processing:
-            self.send_button.setText("処理中...")
+        self.messages_model.add_message(message, is_user, image)
+        
+        # 最下部にスクロール
+        self.messages_view.scrollToBottom()
+    
+    def retry_failed_images(self):
+        """サムネイルを作れなかった画像を読み込み直す"""
+        self.messages_model.retry_failed_images()
+    
+    def begin_assistant_message(self):
+        """ストリーミングで受信する応答用の空のメッセージを追加し、その行番号を返す"""
+        self.add_message("", False)
+        return self.messages_model.rowCount() - 1
+    
+    def append_message_text(self, row, text):
+        """メッセージにテキストを追記"""
+        current = self.messages_model.message(row)["text"] or ""
+        self.messages_model.update_message(row, text=current + text)
+    
+    def set_message_image(self, row, image, text=None):
+        """メッセージの画像（とテキスト）を設定"""
+        self.messages_model.update_message(row, text=text, image=image)
+    
+    def set_job_state(self, running, queued):
+        """現在のスレッドの編集ジョブの件数（実行中・待機中）を表示"""
+        active = running + queued
+        self.cancel_button.setVisible(active > 0)
+        if active:
+            self.job_status_label.setText(f"処理中: 実行中 {running} 件 / 待機 {queued} 件")
         else:
-            self.send_button.setText("送信")
+            self.job_status_label.clear()
+    
+    def variant_count(self):
+        """1回の送信で生成するバリエーション数"""
+        return self.variant_spin.value()
+    
+    def is_priority_requested(self):
+        """「優先して実行」が選ばれているかどうか"""
+        return self.priority_checkbox.isChecked()
     
     def load_conversation_history(self, conversations):
         """会話履歴をロード"""
-        self.clear_messages()
-        
+        messages = []
         for message in conversations:
             role = message.get("role", "")
-            content = message.get("content", "")
-            image_path = message.get("image_path")
-            
-            if role == "user":
-                self.add_user_message(content, image_path)
-            elif role == "assistant":
-                self.add_assistant_message(content, image_path)
+            if role not in ("user", "assistant"):
+                continue
+            messages.append((message.get("content", ""), role == "user", message.get("image_path")))
+        
+        self.messages_model.set_messages(messages)
+        self.messages_view.scrollToBottom()
@@ -1,16 +1,24 @@
+import logging
 from PySide6.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QHBoxLayout, 
-    QPushButton, QFileDialog, QSizePolicy
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout,
+    QPushButton, QFileDialog, QSizePolicy, QStackedWidget
 )
-from PySide6.QtGui import QPixmap, QImage, QDragEnterEvent, QDropEvent
+from PySide6.QtGui import QImage, QDragEnterEvent, QDropEvent
 from PySide6.QtCore import Qt, Signal, QMimeData
 
+from ui.pyramid_view import PyramidImageView
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
 class ImageView(QWidget):
     """画像表示コンポーネント"""
     
     # 画像が読み込まれたときのシグナル
     image_loaded = Signal(str)
     
+    PLACEHOLDER_TEXT = "ここに画像をドラッグ＆ドロップするか、「画像を開く」をクリックしてください"
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.image_path = None
@@ -31,39 +39,61 @@ class ImageView(QWidget):
         
         toolbar_layout.addStretch()
         
+        # 表示倍率
+        self.zoom_label = QLabel("")
+        toolbar_layout.addWidget(self.zoom_label)
+        
+        # 全体表示ボタン
+        self.fit_button = QPushButton("全体表示")
+        self.fit_button.clicked.connect(self.fit_to_window)
+        toolbar_layout.addWidget(self.fit_button)
+        
+        # 等倍表示ボタン
+        self.actual_size_button = QPushButton("100%")
+        self.actual_size_button.clicked.connect(self.zoom_actual_size)
+        toolbar_layout.addWidget(self.actual_size_button)
+        
         main_layout.addLayout(toolbar_layout)
         
-        # 画像表示領域
-        self.image_label = QLabel("ここに画像をドラッグ＆ドロップするか、「画像を開く」をクリックしてください")
+        # 画像表示領域（未読み込み時は案内ラベル、読み込み後はズーム・パン可能なビューア）
+        self.stack = QStackedWidget()
+        self.stack.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        
+        self.image_label = QLabel(self.PLACEHOLDER_TEXT)
         self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.image_label.setStyleSheet("border: 2px dashed #aaa; border-radius: 5px;")
-        main_layout.addWidget(self.image_label)
+        self.stack.addWidget(self.image_label)
+        
+        self.viewer = PyramidImageView()
+        self.viewer.zoom_changed.connect(self._on_zoom_changed)
+        self.stack.addWidget(self.viewer)
+        
+        main_layout.addWidget(self.stack)
         
         # ドラッグ＆ドロップの設定
         self.setAcceptDrops(True)
         
         self.setLayout(main_layout)
     
+    def _show_qimage(self, qimage):
+        """QImageをビューアに表示"""
+        with metrics.span("display", width=qimage.width(), height=qimage.height()):
+            if not self.viewer.set_qimage(qimage):
+                return False
+        self.stack.setCurrentWidget(self.viewer)
+        return True
+    
     def set_image(self, image_path):
         """画像を設定"""
         if not image_path:
             return False
-            
-        pixmap = QPixmap(image_path)
-        if pixmap.isNull():
-            print(f"エラー: 画像を読み込めませんでした: {image_path}")
+        
+        qimage = QImage(image_path)
+        if qimage.isNull():
+            logger.error("画像を読み込めませんでした: %s", image_path)
             return False
-            
-        # 表示領域のサイズに合わせてリサイズ
-        pixmap = pixmap.scaled(
-            self.image_label.width(), 
-            self.image_label.height(),
-            Qt.KeepAspectRatio, 
-            Qt.SmoothTransformation
-        )
         
-        self.image_label.setPixmap(pixmap)
+        self._show_qimage(qimage)
         self.image_path = image_path
         self.image_loaded.emit(image_path)
         return True
@@ -72,25 +102,44 @@ class ImageView(QWidget):
         """PIL画像を設定"""
         if not pil_image:
             return False
-            
-        # PIL ImageをQImageに変換
+        
+        # PIL ImageをQImageに変換（copyでPILのバッファから切り離す）
         img = pil_image.convert("RGBA")
         data = img.tobytes("raw", "RGBA")
-        qimage = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
+        qimage = QImage(data, img.width, img.height, QImage.Format_RGBA8888).copy()
         
-        # QImageをQPixmapに変換
-        pixmap = QPixmap.fromImage(qimage)
+        return self._show_qimage(qimage)
+    
+    def set_encoded_image(self, encoded_image):
+        """エンコード済み画像を設定（QImageへ一度だけデコードする）"""
+        if not encoded_image:
+            return False
         
-        # 表示領域のサイズに合わせてリサイズ
-        pixmap = pixmap.scaled(
-            self.image_label.width(), 
-            self.image_label.height(),
-            Qt.KeepAspectRatio, 
-            Qt.SmoothTransformation
-        )
+        qimage = encoded_image.to_qimage()
+        if qimage is None:
+            logger.error("画像データをデコードできませんでした")
+            return False
         
-        self.image_label.setPixmap(pixmap)
-        return True
+        return self._show_qimage(qimage)
+    
+    def clear_image(self):
+        """表示中の画像を消去して案内を表示"""
+        self.image_path = None
+        self.viewer.clear()
+        self.zoom_label.setText("")
+        self.stack.setCurrentWidget(self.image_label)
+    
+    def fit_to_window(self):
+        """画像全体を表示"""
+        self.viewer.fit_to_window()
+    
+    def zoom_actual_size(self):
+        """等倍で表示"""
+        self.viewer.zoom_to(1.0)
+    
+    def _on_zoom_changed(self, scale):
+        """表示倍率の表示を更新"""
+        self.zoom_label.setText(f"{scale * 100:.0f}%")
     
     def open_image(self):
         """画像をファイルダイアログで開く"""
@@ -123,20 +172,6 @@ class ImageView(QWidget):
                 self.set_image(file_path)
                 event.acceptProposedAction()
     
-    def resizeEvent(self, event):
-        """リサイズイベント - 画像を再表示"""
-        super().resizeEvent(event)
-        
-        if hasattr(self, 'image_path') and self.image_path:
-            pixmap = QPixmap(self.image_path)
-            pixmap = pixmap.scaled(
-                self.image_label.width(), 
-                self.image_label.height(),
-                Qt.KeepAspectRatio, 
-                Qt.SmoothTransformation
-            )
-            self.image_label.setPixmap(pixmap)
-    
     def get_image_path(self):
         """現在表示中の画像パスを取得"""
         return self.image_path
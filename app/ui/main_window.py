@@ -1,71 +1,129 @@
 import os
 import sys
+import logging
 import threading
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-    QSplitter, QMessageBox, QApplication
+    QSplitter, QMessageBox, QApplication, QLabel
 )
-from PySide6.QtCore import Qt, QThreadPool, QRunnable, Slot, Signal, QObject
-from PySide6.QtGui import QPixmap
+from PySide6.QtCore import Qt, Signal, QTimer
 
 # 相対パスを使用したインポート
+# （google.genai などの重いモジュールは ServiceInitializer がバックグラウンドで読み込む）
 from ui.image_view import ImageView
 from ui.chat_panel import ChatPanel
-from services.gemini_service import GeminiService
-from services.image_service import ImageService
-from models.thread_manager import ThreadManager
+from ui.variant_picker import VariantPicker
+from services.async_bridge import AsyncBridge
+from services.edit_scheduler import EditScheduler
+from services.persistence_queue import PersistenceQueue
+from services.service_initializer import ServiceInitializer
 from utils.file_manager import FileManager
 from utils.config import Config
+from utils.metrics import metrics
+from utils.image_cache import decoded_images
 
-class WorkerSignals(QObject):
-    """ワーカーシグナル定義"""
-    finished = Signal(dict)
-    error = Signal(str)
-
-class ImageEditWorker(QRunnable):
-    """画像編集処理用ワーカー"""
-    
-    def __init__(self, gemini_service, image, instruction):
-        super().__init__()
-        self.gemini_service = gemini_service
-        self.image = image
-        self.instruction = instruction
-        self.signals = WorkerSignals()
-    
-    @Slot()
-    def run(self):
-        try:
-            # 画像編集処理を実行
-            result = self.gemini_service.modify_image(self.image, self.instruction)
-            self.signals.finished.emit(result)
-        except Exception as e:
-            self.signals.error.emit(str(e))
+logger = logging.getLogger(__name__)
 
 class MainWindow(QMainWindow):
     """メインウィンドウ"""
     
+    # ウィンドウが最初に描画されたとき
+    first_painted = Signal()
+    # サービスの初期化が終わり、操作できるようになったとき
+    services_ready = Signal()
+    
+    # 画像メモリの使用量の表示を更新する間隔
+    MEMORY_UPDATE_INTERVAL_MS = 2000
+    
     def __init__(self):
         super().__init__()
-        print("MainWindow初期化開始")
-        
-        # モデルの初期化
-        print("ThreadManager初期化")
-        self.thread_manager = ThreadManager()
-        
-        # サービスの初期化
-        print("GeminiService初期化")
-        self.gemini_service = GeminiService()
-        print("ImageService初期化")
-        self.image_service = ImageService(self.thread_manager)
-        
-        # スレッドプール
-        self.thread_pool = QThreadPool()
+        logger.debug("MainWindow初期化開始")
+        
+        # 保存処理はバックグラウンドの書き込みキューで行う
+        self.persistence = PersistenceQueue(self)
+        self.persistence.failed.connect(self.on_persist_failed)
+        
+        # サービスは ServiceInitializer がバックグラウンドで構築し、完了までは None
+        self.thread_manager = None
+        self.gemini_service = None
+        self.image_service = None
+        self._painted = False
+        
+        # 非同期処理のブリッジ（API呼び出しは1本のイベントループで多重化する）
+        self.async_bridge = AsyncBridge(self)
+        # 画像編集ジョブのスケジューラ（サービスの初期化後に作成）
+        self.scheduler = None
+        # ストリーミング中の応答を表示している行と、途中で表示した画像（ジョブIDがキー。表示中のスレッドの分のみ）
+        self._stream_rows = {}
+        self._stream_images = {}
         
         # UIの初期化
-        print("UI初期化")
+        logger.debug("UI初期化")
         self.setup_ui()
         self.setup_connections()
         
+        # 初期化が終わるまでは操作できないようにする
+        self.set_services_ready(False)
+        self.initializer = ServiceInitializer(writer=self.persistence, parent=self)
+        self.initializer.progress.connect(self.statusBar().showMessage)
+        self.initializer.ready.connect(self.on_services_ready)
+        self.initializer.failed.connect(self.on_services_failed)
+        
+        # イベントループが始まってから初期化を開始し、ウィンドウの表示を先に行う
+        QTimer.singleShot(0, self.initializer.start)
+    
+    def is_ready(self):
+        """サービスの初期化が終わっているかどうか"""
+        return self.image_service is not None
+    
+    def set_services_ready(self, ready):
+        """サービスの準備状態に合わせて操作の可否を切り替える"""
+        self.image_view.setEnabled(ready)
+        self.chat_panel.setEnabled(ready)
+        if not ready:
+            self.statusBar().showMessage("初期化中...")
+        else:
+            self.update_job_state()
+    
+    def update_job_state(self):
+        """編集ジョブの件数を表示（チャットパネルは現在のスレッド、ステータスバーは全スレッド）"""
+        running, queued = self.scheduler.active_count(self.thread_manager.current_thread_id)
+        self.chat_panel.set_job_state(running, queued)
+        
+        total_running, total_queued = self.scheduler.active_count()
+        if total_running or total_queued:
+            self.statusBar().showMessage(f"画像編集: 実行中 {total_running} 件 / 待機 {total_queued} 件")
+        else:
+            self.statusBar().clearMessage()
+    
+    def on_services_ready(self, services):
+        """バックグラウンドでのサービス構築が完了したときの処理"""
+        self.thread_manager = services["thread_manager"]
+        self.image_service = services["image_service"]
+        self.gemini_service = services["gemini_service"]
+        
+        # 編集ジョブはスレッドごとに順番に、スレッドをまたいで並行して実行する
+        self.scheduler = EditScheduler(
+            self.async_bridge, self.gemini_service, self.thread_manager, self.image_service, parent=self
+        )
+        self.scheduler.job_started.connect(self.on_job_started)
+        self.scheduler.job_progress.connect(self.on_job_progress)
+        self.scheduler.variant_ready.connect(self.on_variant_ready)
+        self.scheduler.variants_ready.connect(self.on_variants_ready)
+        self.scheduler.job_finished.connect(self.on_job_finished)
+        self.scheduler.job_failed.connect(self.on_job_error)
+        self.scheduler.job_cancelled.connect(self.on_job_cancelled)
+        self.scheduler.state_changed.connect(self.update_job_state)
+        
+        # 起動時に既存のスレッドがあれば会話履歴を読み込む
+        self.load_current_thread()
+        self.set_services_ready(True)
+        
+        # 最初の編集で接続の確立を待たないように、APIを呼ぶイベントループ上で先に接続しておく
+        if Config.HTTP_WARMUP and Config.API_KEY:
+            self.async_bridge.submit(self.gemini_service.warm_up_async())
+        self.services_ready.emit()
+        
         # 設定の検証
         if not Config.validate_config():
             QMessageBox.warning(
@@ -73,9 +131,18 @@ class MainWindow(QMainWindow):
                 "設定エラー",
                 "Google API キーが設定されていません。環境変数 GOOGLE_API_KEY を設定してください。"
             )
-        
-        # 起動時に既存のスレッドがあれば会話履歴を読み込む
-        self.load_current_thread()
+    
+    def on_services_failed(self, error_message):
+        """サービスの構築に失敗したときの処理"""
+        self.statusBar().showMessage("初期化に失敗しました")
+        QMessageBox.critical(self, "初期化エラー", f"サービスの初期化に失敗しました: {error_message}")
+    
+    def paintEvent(self, event):
+        """最初の描画を通知する"""
+        super().paintEvent(event)
+        if not self._painted:
+            self._painted = True
+            self.first_painted.emit()
     
     def setup_ui(self):
         """UIの初期化"""
@@ -92,9 +159,15 @@ class MainWindow(QMainWindow):
         # 分割ウィジェット
         self.splitter = QSplitter(Qt.Horizontal)
         
-        # 画像表示エリア
+        # 画像表示エリア（下にバリエーションの選択パネルを表示する）
+        image_area = QWidget()
+        image_layout = QVBoxLayout(image_area)
+        image_layout.setContentsMargins(0, 0, 0, 0)
         self.image_view = ImageView()
-        self.splitter.addWidget(self.image_view)
+        image_layout.addWidget(self.image_view)
+        self.variant_picker = VariantPicker()
+        image_layout.addWidget(self.variant_picker)
+        self.splitter.addWidget(image_area)
         
         # チャットパネル
         self.chat_panel = ChatPanel()
@@ -104,6 +177,23 @@ class MainWindow(QMainWindow):
         self.splitter.setSizes([700, 300])
         
         main_layout.addWidget(self.splitter)
+        
+        # デコード済み画像のメモリ使用量（ステータスバーの右端に常に表示）
+        self.memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self.memory_timer = QTimer(self)
+        self.memory_timer.timeout.connect(self.update_memory_usage)
+        self.memory_timer.start(self.MEMORY_UPDATE_INTERVAL_MS)
+        self.update_memory_usage()
+    
+    def update_memory_usage(self):
+        """デコード済み画像のキャッシュの使用量を表示"""
+        stats = decoded_images.get_stats()
+        self.memory_label.setText(
+            f"画像メモリ: {stats['bytes'] / 1024 / 1024:.0f}MB / {stats['max_bytes'] / 1024 / 1024:.0f}MB")
+        self.memory_label.setToolTip(
+            f"{stats['entries']} 件, ヒット {stats['hits']} / ミス {stats['misses']}, 破棄 {stats['evictions']} 件, "
+            f"最大 {stats['peak_bytes'] / 1024 / 1024:.0f}MB")
     
     def setup_connections(self):
         """シグナル/スロット接続"""
@@ -112,6 +202,12 @@ class MainWindow(QMainWindow):
         
         # メッセージ送信
         self.chat_panel.message_sent.connect(self.on_message_sent)
+        self.chat_panel.cancel_requested.connect(self.on_cancel_requested)
+        
+        # バリエーションの選択
+        self.variant_picker.variant_chosen.connect(self.on_variant_chosen)
+        self.variant_picker.discard_requested.connect(self.on_variants_discarded)
+        self.variant_picker.variant_previewed.connect(self.image_view.set_encoded_image)
         
         # スレッド管理
         self.chat_panel.new_thread_requested.connect(self.on_new_thread_requested)
@@ -131,74 +227,162 @@ class MainWindow(QMainWindow):
         self.chat_panel.load_conversation_history(conversations)
         
         # 最新の画像があれば読み込み
-        self.image_service.load_latest_image()
-        current_image = self.image_service.get_current_image()
+        current_image = self.image_service.get_thread_image(current_thread_id)
         if current_image:
-            self.image_view.set_pil_image(current_image)
+            self.image_view.set_encoded_image(current_image)
     
     def on_image_loaded(self, image_path):
         """画像が読み込まれたときの処理"""
         # 画像サービスで画像を読み込み
         if self.image_service.load_image(image_path):
-            print(f"画像を読み込みました: {image_path}")
+            logger.info("画像を読み込みました: %s", image_path)
+            
+            # 読み込んだ画像もスレッドに保存し、再起動後や別スレッドから戻ったときに復元できるようにする
+            stored_path = self.image_service.store_input_image()
+            if stored_path:
+                text = f"画像を開きました: {os.path.basename(image_path)}"
+                self.thread_manager.add_message("user", text, stored_path)
+                self.persistence.barrier(
+                    lambda: self.chat_panel.add_user_message(text, stored_path)
+                )
     
     def on_message_sent(self, message):
         """メッセージが送信されたときの処理"""
-        # 処理中状態に設定
-        self.chat_panel.set_processing_state(True)
-        
-        # ユーザーメッセージをスレッドに追加
-        self.thread_manager.add_message("user", message)
+        thread_id = self.thread_manager.current_thread_id
         
-        # 現在の画像を取得
-        current_image = self.image_service.get_current_image()
-        if not current_image:
-            # 画像がなければエラーメッセージ
+        # 画像がなければエラーメッセージ（先行する編集があれば、その結果を入力にする）
+        running, queued = self.scheduler.active_count(thread_id)
+        if not running and not queued and not self.image_service.get_thread_image(thread_id):
+            self.thread_manager.add_message("user", message)
             self.chat_panel.add_assistant_message("画像が読み込まれていません。画像を開いてください。")
-            self.chat_panel.set_processing_state(False)
             return
         
-        # 画像編集ワーカーを作成
-        worker = ImageEditWorker(self.gemini_service, current_image, message)
-        
-        # 完了時の処理
-        worker.signals.finished.connect(self.on_image_edit_finished)
-        
-        # エラー時の処理
-        worker.signals.error.connect(self.on_image_edit_error)
-        
-        # ワーカーを開始
-        self.thread_pool.start(worker)
+        # 画像編集ジョブを投入（処理中でも次の指示を受け付け、同じスレッドの編集は順番に実行される）
+        # 指示はチャットパネルに表示するだけで、スレッドには結果と一緒に EditScheduler が保存する
+        if self.chat_panel.is_priority_requested():
+            priority = EditScheduler.PRIORITY_HIGH
+        else:
+            priority = EditScheduler.PRIORITY_NORMAL
+        self.scheduler.submit(thread_id, message, priority, variants=self.chat_panel.variant_count())
+    
+    def on_cancel_requested(self):
+        """現在のスレッドの待機中・実行中の画像編集をキャンセル"""
+        self.scheduler.cancel_thread(self.thread_manager.current_thread_id)
+    
+    def is_current_thread(self, thread_id):
+        """表示中のスレッドかどうか"""
+        return thread_id == self.thread_manager.current_thread_id
+    
+    def on_job_started(self, job_id, thread_id):
+        """画像編集ジョブが始まったときの処理（バリエーションを生成する場合は選択パネルに枠を用意する）"""
+        if not self.is_current_thread(thread_id):
+            return
+        job = self.scheduler.get_running_job(thread_id)
+        if job is not None and job["variants"] > 1:
+            self.variant_picker.start(job_id, job["variants"])
+    
+    def on_variant_ready(self, job_id, thread_id, index, result):
+        """バリエーションが1件届いたときの処理"""
+        if self.is_current_thread(thread_id) and self.variant_picker.job_id == job_id:
+            self.variant_picker.set_variant(index, result)
+    
+    def on_variants_ready(self, job_id, thread_id, indices):
+        """バリエーションが揃い、採用待ちになったときの処理"""
+        if not self.is_current_thread(thread_id):
+            return
+        if self.variant_picker.job_id == job_id:
+            self.variant_picker.set_choosable(indices)
+        self.chat_panel.add_assistant_message(
+            f"バリエーションを{len(indices)}件生成しました。採用する案を選んでください。"
+        )
+    
+    def on_variant_chosen(self, job_id, index):
+        """バリエーションが採用されたときの処理（結果は on_job_finished で表示する）"""
+        self.scheduler.choose_variant(job_id, index)
+    
+    def on_variants_discarded(self, job_id):
+        """バリエーションを全て破棄するときの処理"""
+        self.scheduler.discard_variants(job_id)
+    
+    def clear_variant_picker(self, job_id):
+        """選択パネルに表示中のジョブが終わったら閉じる"""
+        if self.variant_picker.job_id == job_id:
+            self.variant_picker.clear()
+    
+    def on_job_progress(self, job_id, thread_id, event):
+        """ストリーミング中の応答を受け取ったときの処理"""
+        if not self.is_current_thread(thread_id):
+            return
+        if event["type"] == "text":
+            # 最初のテキストで応答の吹き出しを作り、以降は追記する
+            if job_id not in self._stream_rows:
+                self._stream_rows[job_id] = self.chat_panel.begin_assistant_message()
+            self.chat_panel.append_message_text(self._stream_rows[job_id], event["text"])
+        elif event["type"] == "image":
+            # 画像は保存を待たずにすぐ表示する
+            self._stream_images[job_id] = event["image"]
+            self.image_view.set_encoded_image(event["image"])
     
-    def on_image_edit_finished(self, result):
+    def on_job_finished(self, job_id, thread_id, result):
+        """画像編集ジョブが完了したときの処理（結果の保存は EditScheduler が済ませている）"""
+        stream_row = self._stream_rows.pop(job_id, None)
+        stream_image = self._stream_images.pop(job_id, None)
+        self.clear_variant_picker(job_id)
+        if not self.is_current_thread(thread_id):
+            # 表示していないスレッドの結果は、切り替えたときに会話履歴から表示される
+            return
+        self.on_image_edit_finished(result, stream_row, stream_image)
+    
+    def on_job_error(self, job_id, thread_id, error_message):
+        """画像編集ジョブでエラーが発生したときの処理"""
+        self._stream_rows.pop(job_id, None)
+        self._stream_images.pop(job_id, None)
+        self.clear_variant_picker(job_id)
+        if self.is_current_thread(thread_id):
+            self.on_image_edit_error(error_message)
+    
+    def on_job_cancelled(self, job_id, thread_id):
+        """画像編集ジョブがキャンセルされたときの処理"""
+        self._stream_rows.pop(job_id, None)
+        self._stream_images.pop(job_id, None)
+        self.clear_variant_picker(job_id)
+        if self.is_current_thread(thread_id):
+            self.chat_panel.add_assistant_message("画像編集をキャンセルしました。")
+    
+    def on_image_edit_finished(self, result, stream_row=None, stream_image=None):
         """画像編集が完了したときの処理"""
         response_text = result.get("text", "")
         response_image = result.get("image")
+        image_path = result.get("image_path")
         
         if not response_image:
-            self.chat_panel.add_assistant_message("画像の生成に失敗しました: " + response_text)
-            self.chat_panel.set_processing_state(False)
+            if stream_row is not None:
+                self.chat_panel.set_message_image(stream_row, None, "画像の生成に失敗しました: " + response_text)
+            else:
+                self.chat_panel.add_assistant_message("画像の生成に失敗しました: " + response_text)
             return
         
-        # 編集結果を表示
-        self.image_view.set_pil_image(response_image)
-        
-        # 編集結果を保存
-        image_path = self.image_service.save_edited_image(response_image)
-        
-        # 応答メッセージをスレッドに追加
-        self.thread_manager.add_message("assistant", response_text, image_path)
-        
-        # 応答をチャットパネルに表示
-        self.chat_panel.add_assistant_message(response_text, image_path)
+        # 編集結果を表示（ストリーミング中に表示済みならそのまま）
+        if response_image is not stream_image:
+            self.image_view.set_encoded_image(response_image)
         
-        # 処理中状態を解除
-        self.chat_panel.set_processing_state(False)
+        # 応答の画像は画像ファイルが書き終わってからチャットパネルに表示（サムネイルを作れるように）
+        if stream_row is not None:
+            self.persistence.barrier(
+                lambda: self.chat_panel.set_message_image(stream_row, image_path, response_text)
+            )
+        else:
+            self.persistence.barrier(
+                lambda: self.chat_panel.add_assistant_message(response_text, image_path)
+            )
     
     def on_image_edit_error(self, error_message):
         """画像編集でエラーが発生したときの処理"""
         self.chat_panel.add_assistant_message(f"エラーが発生しました: {error_message}")
-        self.chat_panel.set_processing_state(False)
+    
+    def on_persist_failed(self, job_id, error_message):
+        """バックグラウンドの保存に失敗したときの処理"""
+        self.chat_panel.add_assistant_message(f"保存に失敗しました: {error_message}")
     
     def on_new_thread_requested(self):
         """新規会話が要求されたときの処理"""
@@ -215,32 +399,68 @@ class MainWindow(QMainWindow):
         self.chat_panel.clear_messages()
         
         # 画像表示をクリア
-        self.image_view.image_path = None
-        self.image_view.image_label.setText("ここに画像をドラッグ＆ドロップするか、「画像を開く」をクリックしてください")
-        self.image_view.image_label.setPixmap(QPixmap())  # 空のQPixmapを設定
+        self.image_view.clear_image()
         
         # 画像サービスの状態をリセット
-        self.image_service.current_image = None
-        self.image_service.current_image_path = None
+        self.image_service.clear_thread_image(current_thread_id)
+        
+        # 他のスレッドの編集は続けたまま、表示だけ切り替える
+        self.reset_stream_display()
+        self.update_job_state()
     
     def on_thread_changed(self, thread_id):
         """スレッドが変更されたときの処理"""
         # 現在のスレッドを変更
         if self.thread_manager.set_current_thread(thread_id):
-            # 会話履歴を読み込み
+            # 会話履歴を読み込み（書き込み待ちのメッセージはメモリ上から補われ、書き込みの完了は待たない）
             conversations = self.thread_manager.get_conversation_history()
             self.chat_panel.load_conversation_history(conversations)
+            if self.persistence.pending_count():
+                # 書き込み待ちの画像はまだファイルがなくサムネイルを作れないので、書き終えたら作り直す
+                # （会話履歴ごと読み込み直すと、まだ保存していない指示や受信中の応答の表示が消える）
+                self.persistence.barrier(self.chat_panel.retry_failed_images)
             
             # 最新の画像があれば読み込み
-            self.image_service.load_latest_image()
-            current_image = self.image_service.get_current_image()
+            current_image = self.image_service.get_thread_image(thread_id)
             if current_image:
-                self.image_view.set_pil_image(current_image)
+                self.image_view.set_encoded_image(current_image)
             else:
                 # 画像がなければ表示をクリア
-                self.image_view.image_path = None
-                self.image_view.image_label.setText("ここに画像をドラッグ＆ドロップするか、「画像を開く」をクリックしてください")
-                self.image_view.image_label.setPixmap(QPixmap())  # 空のQPixmapを設定
+                self.image_view.clear_image()
+            
+            # このスレッドで実行中の編集があれば、受信済みの分から表示を続ける
+            # （実行中・待機中の指示は結果と一緒に保存されるので、会話履歴にはまだない）
+            self.reset_stream_display()
+            job = self.scheduler.get_running_job(thread_id)
+            if job is not None:
+                self.chat_panel.add_user_message(job["instruction"])
+            if job is not None and job["variants"] > 1:
+                # バリエーションは届いている分を選択パネルに並べ直す
+                self.variant_picker.start(job["job_id"], job["variants"])
+                for index, result in enumerate(job["results"]):
+                    if result is not None:
+                        self.variant_picker.set_variant(index, result)
+                if job["choosing"]:
+                    self.variant_picker.set_choosable(
+                        [index for index, result in enumerate(job["results"]) if result and result.get("image")]
+                    )
+            elif job is not None:
+                if job["text"]:
+                    row = self.chat_panel.begin_assistant_message()
+                    self.chat_panel.append_message_text(row, job["text"])
+                    self._stream_rows[job["job_id"]] = row
+                if job["image"] is not None:
+                    self._stream_images[job["job_id"]] = job["image"]
+                    self.image_view.set_encoded_image(job["image"])
+            for instruction in self.scheduler.get_queued_instructions(thread_id):
+                self.chat_panel.add_user_message(instruction)
+            self.update_job_state()
+    
+    def reset_stream_display(self):
+        """ストリーミング中の応答とバリエーションの表示を破棄（会話履歴を読み直すと行番号が変わるため）"""
+        self._stream_rows.clear()
+        self._stream_images.clear()
+        self.variant_picker.clear()
     
     def on_open_save_dir(self):
         """保存フォルダを開く"""
@@ -248,6 +468,17 @@ class MainWindow(QMainWindow):
     
     def closeEvent(self, event):
         """ウィンドウが閉じられるときの処理"""
-        # スレッドプールが終了するのを待つ
-        self.thread_pool.waitForDone()
+        # 待機中のジョブを破棄し、実行中のジョブをキャンセルしてイベントループを停止
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        self.async_bridge.shutdown()
+        # 保存待ちの書き込みを一定時間だけ待ってから終了
+        self.persistence.shutdown(Config.PERSIST_FLUSH_TIMEOUT)
+        # 計測が有効なら段階ごとの所要時間を書き出す
+        try:
+            paths = metrics.export()
+            if paths:
+                logger.info("計測結果を書き出しました: %s", ", ".join(paths.values()))
+        except OSError as e:
+            logger.error("計測結果の書き出しに失敗しました: %s", e)
         event.accept()
@@ -0,0 +1,319 @@
+import math
+import weakref
+import itertools
+from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsItem
+from PySide6.QtGui import QPixmap, QPainter, QColor
+from PySide6.QtCore import Qt, QRectF, Signal, QObject, QRunnable, QThreadPool, QTimer, Slot
+from utils.image_cache import decoded_images, DecodedImageCache
+
+class ImagePyramid:
+    """画像の縮小レベル（1/2ずつ）を作り、タイル単位でピクスマップを提供する
+
+    元画像（レベル0）以外の縮小レベルとタイルのピクスマップは自身では持たず、共有の DecodedImageCache に預ける
+    （メモリの上限を超えると古いものから捨てられ、次に描画するときに作り直す）。
+    """
+
+    TILE_SIZE = 512
+
+    _ids = itertools.count(1)
+
+    def __init__(self, qimage, levels=None, transform=Qt.SmoothTransformation):
+        """levelsを省略すると縮小レベルは必要になったときに作成する
+
+        transform は捨てられた縮小レベルを作り直すときの縮小方法。
+        """
+        self.width = qimage.width()
+        self.height = qimage.height()
+        self._source = qimage
+        self._transform = transform
+        self._owner = ("pyramid", next(self._ids))
+        # レベルごとの大きさ（画像を借りなくてもタイルの配置を計算できるようにする）
+        self._sizes = [(self.width, self.height)]
+        while max(self._sizes[-1]) > self.TILE_SIZE:
+            width, height = self._sizes[-1]
+            self._sizes.append((max(1, width // 2), max(1, height // 2)))
+        # このピラミッドが破棄されたら縮小レベルとタイルもキャッシュから取り除く
+        self._finalizer = weakref.finalize(self, decoded_images.discard_owner, self._owner)
+        if levels:
+            self._put_levels(levels)
+
+    @staticmethod
+    def build_levels(qimage, tile_size=TILE_SIZE, transform=Qt.SmoothTransformation):
+        """長辺がタイル1枚に収まるまで1/2ずつ縮小したレベルを作成
+
+        Qt.FastTransformation なら大きな画像でも一瞬で作れる（仮表示用）。
+        """
+        levels = [qimage]
+        current = qimage
+        while max(current.width(), current.height()) > tile_size:
+            current = current.scaled(
+                max(1, current.width() // 2),
+                max(1, current.height() // 2),
+                Qt.IgnoreAspectRatio,
+                transform
+            )
+            levels.append(current)
+        return levels
+
+    def set_levels(self, levels, transform=Qt.SmoothTransformation):
+        """縮小レベルを差し替える（古いレベルから作ったタイルは捨てる）"""
+        self._transform = transform
+        decoded_images.discard_owner(self._owner, "tile")
+        self._put_levels(levels)
+
+    def release(self):
+        """縮小レベルとタイルをキャッシュから取り除く（表示をやめたときに呼ぶ）"""
+        self._finalizer()
+
+    def _put_levels(self, levels):
+        """作成済みの縮小レベルをキャッシュに預ける（レベル0は元画像なので預けない）"""
+        for level, image in enumerate(levels[1:len(self._sizes)], 1):
+            decoded_images.put((self._owner, "level", level), image, DecodedImageCache.qimage_bytes(image))
+
+    @property
+    def level_count(self):
+        return len(self._sizes)
+
+    def level_image(self, level):
+        """縮小レベルの画像を取得（キャッシュになければ1つ上のレベルから作り直す）"""
+        if level == 0:
+            return self._source
+        return decoded_images.get_or_decode((self._owner, "level", level),
+                                            lambda: self._build_level(level), DecodedImageCache.qimage_bytes)
+
+    def _build_level(self, level):
+        width, height = self._sizes[level]
+        return self.level_image(level - 1).scaled(width, height, Qt.IgnoreAspectRatio, self._transform)
+
+    def level_for_scale(self, scale):
+        """表示倍率に対して画素が足りる最も小さいレベルを選ぶ"""
+        if scale <= 0:
+            return self.level_count - 1
+        if scale >= 1.0:
+            return 0
+        level = int(math.floor(math.log2(1.0 / scale)))
+        return min(level, self.level_count - 1)
+
+    def tile(self, level, tx, ty):
+        """タイルのピクスマップを取得（キャッシュになければ縮小レベルから切り出す）"""
+        return decoded_images.get_or_decode((self._owner, "tile", level, tx, ty),
+                                            lambda: self._build_tile(level, tx, ty), DecodedImageCache.pixmap_bytes)
+
+    def _build_tile(self, level, tx, ty):
+        width, height = self._sizes[level]
+        size = self.TILE_SIZE
+        rect = (tx * size, ty * size,
+                min(size, width - tx * size),
+                min(size, height - ty * size))
+        return QPixmap.fromImage(self.level_image(level).copy(*rect))
+
+    def paint(self, painter, exposed_rect, scale):
+        """表示範囲に掛かるタイルだけを、表示倍率に合ったレベルで描画"""
+        level = self.level_for_scale(scale)
+        width, height = self._sizes[level]
+        # レベル座標 → 元画像座標の倍率
+        fx = self.width / float(width)
+        fy = self.height / float(height)
+        size = self.TILE_SIZE
+
+        visible = exposed_rect.intersected(QRectF(0, 0, self.width, self.height))
+        if visible.isEmpty():
+            return
+
+        tx0 = max(0, int(visible.left() / fx) // size)
+        ty0 = max(0, int(visible.top() / fy) // size)
+        tx1 = min((width - 1) // size, int(visible.right() / fx) // size)
+        ty1 = min((height - 1) // size, int(visible.bottom() / fy) // size)
+
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                pixmap = self.tile(level, tx, ty)
+                target = QRectF(tx * size * fx, ty * size * fy,
+                                pixmap.width() * fx, pixmap.height() * fy)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+class PyramidBuildSignals(QObject):
+    """ピラミッド作成ワーカーのシグナル"""
+    # 世代番号 と 縮小レベルのリスト
+    finished = Signal(int, object)
+
+class PyramidBuildWorker(QRunnable):
+    """高画質の縮小レベルをUIスレッドの外で作成するワーカー"""
+
+    def __init__(self, generation, qimage):
+        super().__init__()
+        self.generation = generation
+        self.qimage = qimage
+        self.signals = PyramidBuildSignals()
+
+    @Slot()
+    def run(self):
+        levels = ImagePyramid.build_levels(self.qimage, ImagePyramid.TILE_SIZE, Qt.SmoothTransformation)
+        self.signals.finished.emit(self.generation, levels)
+
+class PyramidItem(QGraphicsItem):
+    """ピラミッド画像を描画するグラフィックスアイテム（座標は元画像の画素単位）"""
+
+    def __init__(self, pyramid):
+        super().__init__()
+        self.pyramid = pyramid
+        # option.exposedRect で再描画範囲を受け取る
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.pyramid.width, self.pyramid.height)
+
+    def paint(self, painter, option, widget=None):
+        scale = painter.worldTransform().m11()
+        self.pyramid.paint(painter, option.exposedRect, scale)
+
+class PyramidImageView(QGraphicsView):
+    """大きな画像をズーム・パンできるビューア（見えているタイルだけを描画する）"""
+
+    ZOOM_STEP = 1.25
+    MAX_ZOOM = 16.0
+    # リサイズ・ズームが止まってから高画質で描き直すまでの時間（ミリ秒）
+    SETTLE_DELAY_MS = 150
+
+    # 表示倍率が変わったとき（1.0 = 等倍）
+    zoom_changed = Signal(float)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._scene = QGraphicsScene(self)
+        self.setScene(self._scene)
+        self._item = None
+        self.fit_mode = True  # ウィンドウに合わせて表示中か
+        self._generation = 0  # 古いワーカーの結果を無視するための世代番号
+        self._workers = {}  # 実行中のワーカー（シグナルの受信まで保持する）
+
+        # 操作中は高速描画にし、止まったら高画質で描き直す
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(self.SETTLE_DELAY_MS)
+        self._settle_timer.timeout.connect(self._on_settled)
+
+        self.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.setResizeAnchor(QGraphicsView.AnchorViewCenter)
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
+        self.setBackgroundBrush(QColor("#303030"))
+        self.setAlignment(Qt.AlignCenter)
+        # ドラッグ＆ドロップは親のImageViewで受ける
+        self.setAcceptDrops(False)
+
+    def set_qimage(self, qimage):
+        """画像を設定して全体表示にする
+
+        まず高速な縮小で仮表示し、高画質の縮小レベルはバックグラウンドで作成して差し替える。
+        """
+        if qimage is None or qimage.isNull():
+            return False
+
+        self._generation += 1
+        levels = ImagePyramid.build_levels(qimage, ImagePyramid.TILE_SIZE, Qt.FastTransformation)
+        self.set_pyramid(ImagePyramid(qimage, levels, Qt.FastTransformation))
+
+        if len(levels) > 1:
+            worker = PyramidBuildWorker(self._generation, qimage)
+            worker.signals.finished.connect(self._on_levels_built)
+            self._workers[self._generation] = worker
+            QThreadPool.globalInstance().start(worker)
+        return True
+
+    def _on_levels_built(self, generation, levels):
+        """高画質の縮小レベルができたら差し替える"""
+        self._workers.pop(generation, None)
+        if generation != self._generation or not self._item:
+            return
+        self._item.pyramid.set_levels(levels)
+        self._item.update()
+
+    def set_pyramid(self, pyramid):
+        """作成済みのピラミッドを設定して全体表示にする"""
+        self._release_pyramid()
+        self._scene.clear()
+        self._item = PyramidItem(pyramid)
+        self._scene.addItem(self._item)
+        self._scene.setSceneRect(self._item.boundingRect())
+        self.fit_to_window()
+
+    def clear(self):
+        """画像を消去"""
+        self._generation += 1
+        self._release_pyramid()
+        self._scene.clear()
+        self._item = None
+
+    def _release_pyramid(self):
+        """表示中のピラミッドの縮小レベルとタイルをキャッシュから取り除く"""
+        if self._item:
+            self._item.pyramid.release()
+
+    def _begin_interaction(self):
+        """リサイズ・ズーム中は高速描画に切り替え、停止を待つタイマーを再開"""
+        self.setRenderHint(QPainter.SmoothPixmapTransform, False)
+        self._settle_timer.start()
+
+    def _on_settled(self):
+        """操作が止まったので高画質で描き直す"""
+        self.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        self.viewport().update()
+
+    def has_image(self):
+        """画像が設定されているか"""
+        return self._item is not None
+
+    def current_scale(self):
+        """現在の表示倍率"""
+        return self.transform().m11()
+
+    def fit_to_window(self):
+        """画像全体がビューに収まるように表示"""
+        if not self._item:
+            return
+        self.fit_mode = True
+        self.fitInView(self._item, Qt.KeepAspectRatio)
+        self.zoom_changed.emit(self.current_scale())
+
+    def zoom_to(self, scale):
+        """指定した倍率で表示（1.0 = 等倍）"""
+        if not self._item:
+            return
+        self.fit_mode = False
+        scale = max(self._min_scale(), min(self.MAX_ZOOM, scale))
+        factor = scale / self.current_scale()
+        self._begin_interaction()
+        self.scale(factor, factor)
+        self.zoom_changed.emit(self.current_scale())
+
+    def _min_scale(self):
+        """全体表示の倍率より小さくはしない"""
+        rect = self._item.boundingRect()
+        viewport = self.viewport().rect()
+        return min(1.0, min(viewport.width() / rect.width(), viewport.height() / rect.height()))
+
+    def wheelEvent(self, event):
+        """ホイールでマウス位置を中心にズーム"""
+        if not self._item:
+            return
+        steps = event.angleDelta().y() / 120.0
+        if steps:
+            self.zoom_to(self.current_scale() * (self.ZOOM_STEP ** steps))
+
+    def mouseDoubleClickEvent(self, event):
+        """ダブルクリックで全体表示と等倍を切り替え"""
+        if self.fit_mode:
+            self.zoom_to(1.0)
+        else:
+            self.fit_to_window()
+
+    def resizeEvent(self, event):
+        """全体表示中はウィンドウサイズに合わせ直す（変換行列の変更のみで画素は触らない）"""
+        super().resizeEvent(event)
+        if self._item:
+            # ドラッグ中は高速描画、止まってから高画質で1回だけ描き直す
+            self._begin_interaction()
+        if self.fit_mode:
+            self.fit_to_window()
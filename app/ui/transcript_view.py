@@ -0,0 +1,317 @@
+from PySide6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView, QApplication, QStyle
+from PySide6.QtGui import QPixmap, QImage, QColor, QPainter, QKeySequence
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize
+from utils.image_cache import decoded_images, DecodedImageCache
+
+class TranscriptModel(QAbstractListModel):
+    """会話履歴のモデル（全メッセージを保持し、サムネイルは表示される行の分だけ要求する）"""
+
+    IsUserRole = Qt.UserRole + 1
+    ImagePathRole = Qt.UserRole + 2
+    # 描画用のサムネイル（未作成ならサムネイルサービスに作成を依頼してNone）
+    ThumbnailRole = Qt.UserRole + 3
+    # サムネイルを作れなかったか
+    ImageFailedRole = Qt.UserRole + 4
+
+    def __init__(self, thumbnail_service=None, parent=None):
+        super().__init__(parent)
+        self.thumbnail_service = thumbnail_service
+        self._messages = []  # {"text", "is_user", "image_path", "pixmap"}
+        self._rows_by_path = {}  # 画像パス -> 行番号のリスト
+        self._failed = set()
+
+        if thumbnail_service is not None:
+            thumbnail_service.thumbnail_ready.connect(self._on_thumbnail_ready)
+            thumbnail_service.thumbnail_failed.connect(self._on_thumbnail_failed)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._messages):
+            return None
+        message = self._messages[index.row()]
+        path = message["image_path"]
+
+        if role == Qt.DisplayRole:
+            return message["text"]
+        if role == self.IsUserRole:
+            return message["is_user"]
+        if role == self.ImagePathRole:
+            return path
+        if role == self.ThumbnailRole:
+            if message["pixmap"] is not None:
+                return message["pixmap"]
+            if path is None or path in self._failed or self.thumbnail_service is None:
+                return None
+            return self.thumbnail_service.request(path)
+        if role == self.ImageFailedRole:
+            return path in self._failed
+        return None
+
+    def message(self, row):
+        """行のメッセージ（デリゲートがロールを介さずに参照する）"""
+        return self._messages[row]
+
+    def add_message(self, text, is_user=True, image=None):
+        """メッセージを末尾に追加"""
+        image_path = image if isinstance(image, str) else None
+        pixmap = None
+        if isinstance(image, (QPixmap, QImage)):
+            # メモリ上の画像は表示サイズに縮小したものだけを持つ
+            pixmap = QPixmap.fromImage(image) if isinstance(image, QImage) else image
+            pixmap = pixmap.scaled(MessageDelegate.IMAGE_BOX, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        row = len(self._messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._messages.append({"text": text, "is_user": is_user, "image_path": image_path, "pixmap": pixmap})
+        if image_path:
+            self._rows_by_path.setdefault(image_path, []).append(row)
+        self.endInsertRows()
+
+    def update_message(self, row, text=None, image=None):
+        """行のテキストや画像を差し替える（ストリーミング中の応答の追記に使う）"""
+        message = self._messages[row]
+        if text is not None:
+            message["text"] = text
+        if isinstance(image, str):
+            message["image_path"] = image
+            message["pixmap"] = None
+            self._rows_by_path.setdefault(image, []).append(row)
+        elif isinstance(image, (QPixmap, QImage)):
+            pixmap = QPixmap.fromImage(image) if isinstance(image, QImage) else image
+            message["pixmap"] = pixmap.scaled(MessageDelegate.IMAGE_BOX, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, self.ImagePathRole])
+
+    def set_messages(self, messages):
+        """メッセージをまとめて設定（(テキスト, ユーザーか, 画像パス) のリスト）"""
+        self.beginResetModel()
+        self._messages = []
+        self._rows_by_path = {}
+        # 作れなかったサムネイルも作り直す（書き込み待ちで画像がまだなかった場合など）
+        self._failed.clear()
+        for text, is_user, image_path in messages:
+            row = len(self._messages)
+            self._messages.append({"text": text, "is_user": is_user, "image_path": image_path, "pixmap": None})
+            if image_path:
+                self._rows_by_path.setdefault(image_path, []).append(row)
+        self.endResetModel()
+
+    def clear(self):
+        """メッセージを全て削除"""
+        self.set_messages([])
+
+    def retry_failed_images(self):
+        """作れなかったサムネイルを作り直す（書き込み待ちで画像のファイルがまだなかった場合など）"""
+        failed, self._failed = self._failed, set()
+        for path in failed:
+            for row in self._rows_by_path.get(path, []):
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [self.ThumbnailRole, self.ImageFailedRole])
+
+    def _on_thumbnail_ready(self, path, thumbnail):
+        """サムネイルができたら該当する行を再描画"""
+        for row in self._rows_by_path.get(path, []):
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [self.ThumbnailRole])
+
+    def _on_thumbnail_failed(self, path):
+        """サムネイルを作れなかった行を再描画"""
+        if path not in self._rows_by_path:
+            return
+        self._failed.add(path)
+        for row in self._rows_by_path[path]:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [self.ImageFailedRole])
+
+class MessageDelegate(QStyledItemDelegate):
+    """メッセージを吹き出しとして描画するデリゲート（表示中の行だけが描画される）"""
+
+    MARGIN = 10  # 行の外側の余白
+    PADDING = 10  # 吹き出しの内側の余白
+    SPACING = 6  # テキストと画像の間隔
+    MAX_BUBBLE_WIDTH = 500
+    MIN_TEXT_WIDTH = 100
+    # 画像の表示枠（サムネイルの到着で行の高さが変わらないように固定する）
+    IMAGE_BOX = QSize(300, 225)
+    USER_COLOR = QColor("#e1f5fe")
+    ASSISTANT_COLOR = QColor("#66bb6a")
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self._size_hints = {}  # 行番号 -> (幅, QSize)。行は末尾への追加のみなのでリセット時に消す
+
+    def clear_cache(self):
+        """行の高さのキャッシュを消す（モデルのリセット時）"""
+        self._size_hints.clear()
+
+    def invalidate_row(self, index):
+        """内容が変わった行の高さを計算し直させる"""
+        self._size_hints.pop(index.row(), None)
+        self.sizeHintChanged.emit(index)
+
+    def _image_size(self, message, max_width):
+        """画像の表示枠のサイズ（画像がなければNone）"""
+        if message["pixmap"] is not None:
+            return message["pixmap"].size()
+        if not message["image_path"]:
+            return None
+        return QSize(min(self.IMAGE_BOX.width(), max_width), self.IMAGE_BOX.height())
+
+    def _layout(self, option, message, width):
+        """吹き出し・テキスト・画像の配置を計算（行の左上を原点とする）"""
+        bubble_max = min(self.MAX_BUBBLE_WIDTH, width - 2 * self.MARGIN)
+        content_max = max(self.MIN_TEXT_WIDTH, bubble_max - 2 * self.PADDING)
+
+        text = message["text"] or ""
+        text_rect = option.fontMetrics.boundingRect(QRect(0, 0, content_max, 1000000),
+                                                    Qt.TextWordWrap, text) if text else QRect()
+        image_size = self._image_size(message, content_max)
+
+        content_width = max(self.MIN_TEXT_WIDTH, text_rect.width())
+        content_height = text_rect.height()
+        if image_size is not None:
+            content_width = max(content_width, image_size.width())
+            content_height += (self.SPACING if text else 0) + image_size.height()
+        content_width = min(content_width, content_max)
+
+        bubble_width = content_width + 2 * self.PADDING
+        bubble_height = content_height + 2 * self.PADDING
+        if message["is_user"]:
+            bubble_x = width - self.MARGIN - bubble_width  # 右寄せ
+        else:
+            bubble_x = self.MARGIN  # 左寄せ
+        bubble = QRect(bubble_x, self.MARGIN, bubble_width, bubble_height)
+
+        text_box = QRect(bubble.left() + self.PADDING, bubble.top() + self.PADDING,
+                         content_width, text_rect.height())
+        image_box = None
+        if image_size is not None:
+            top = text_box.bottom() + 1 + (self.SPACING if text else 0)
+            image_box = QRect(bubble.left() + self.PADDING, top, image_size.width(), image_size.height())
+        return bubble, text_box, image_box
+
+    def sizeHint(self, option, index):
+        width = self.view.viewport().width()
+        cached = self._size_hints.get(index.row())
+        if cached is not None and cached[0] == width:
+            return cached[1]
+        bubble, _, _ = self._layout(option, index.model().message(index.row()), width)
+        size = QSize(width, bubble.height() + 2 * self.MARGIN)
+        self._size_hints[index.row()] = (width, size)
+        return size
+
+    def paint(self, painter, option, index):
+        message = index.model().message(index.row())
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        painter.translate(option.rect.topLeft())
+        bubble, text_box, image_box = self._layout(option, message, option.rect.width())
+
+        # 吹き出し
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(self.USER_COLOR if message["is_user"] else self.ASSISTANT_COLOR)
+        painter.drawRoundedRect(bubble, 10, 10)
+        if option.state & QStyle.State_Selected:
+            # 選択中（コピー対象）の吹き出しは枠で示す
+            painter.setPen(option.palette.highlight().color())
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRoundedRect(bubble, 10, 10)
+
+        # テキスト
+        painter.setPen(QColor("#000000"))
+        painter.setFont(option.font)
+        painter.drawText(text_box, Qt.TextWordWrap, message["text"] or "")
+
+        # 画像（サムネイルが届くまでは仮表示）
+        if image_box is not None:
+            pixmap = self._pixmap(index, image_box.size())
+            if pixmap is not None:
+                painter.drawPixmap(image_box.topLeft(), pixmap)
+            else:
+                painter.setPen(Qt.NoPen)
+                painter.setBrush(QColor(0, 0, 0, 20))
+                painter.drawRoundedRect(image_box, 5, 5)
+                painter.setPen(QColor("#000000"))
+                if index.data(TranscriptModel.ImageFailedRole):
+                    label = "画像を表示できません"
+                else:
+                    label = "画像を読み込み中..."
+                painter.drawText(image_box, Qt.AlignCenter | Qt.TextWordWrap, label)
+        painter.restore()
+
+    def _pixmap(self, index, box):
+        """描画用のピクスマップ（縮小結果は共有の DecodedImageCache に預ける）"""
+        key = ("transcript", index.data(TranscriptModel.ImagePathRole))
+        pixmap = decoded_images.get(key)
+        if pixmap is not None and pixmap.width() <= box.width():
+            return pixmap
+
+        thumbnail = index.data(TranscriptModel.ThumbnailRole)
+        if thumbnail is None:
+            return None
+        if isinstance(thumbnail, QPixmap):
+            return thumbnail
+        pixmap = QPixmap.fromImage(thumbnail.scaled(box, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        return decoded_images.put(key, pixmap, DecodedImageCache.pixmap_bytes(pixmap))
+
+class TranscriptView(QListView):
+    """会話履歴の表示（見えている行だけを描画し、件数が増えてもウィジェットを作らない）"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setItemDelegate(MessageDelegate(self))
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(20)
+        # 幅が変わったら折り返しを計算し直す
+        self.setResizeMode(QListView.Adjust)
+        # 大量の行は少しずつレイアウトしてUIを止めない
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(200)
+
+        # 最下部を表示中は、レイアウトが進んで範囲が伸びても最下部に追従する
+        self._follow_bottom = True
+        self.verticalScrollBar().rangeChanged.connect(self._on_range_changed)
+        self.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+
+    def scrollToBottom(self):
+        """最下部にスクロールし、以降のレイアウト中も最下部に追従する"""
+        self._follow_bottom = True
+        self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+
+    def _on_range_changed(self, minimum, maximum):
+        if self._follow_bottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def _on_scrolled(self, value):
+        self._follow_bottom = value >= self.verticalScrollBar().maximum()
+
+    def setModel(self, model):
+        """モデルのリセット時に行の高さのキャッシュを消す"""
+        super().setModel(model)
+        model.modelAboutToBeReset.connect(self.itemDelegate().clear_cache)
+        model.dataChanged.connect(self._on_data_changed)
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        """テキストや画像が変わった行は高さを計算し直す（サムネイルの到着では変わらない）"""
+        if roles and Qt.DisplayRole not in roles and TranscriptModel.ImagePathRole not in roles:
+            return
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.itemDelegate().invalidate_row(self.model().index(row))
+
+    def keyPressEvent(self, event):
+        """選択したメッセージのテキストをコピー"""
+        if event.matches(QKeySequence.Copy):
+            rows = sorted(index.row() for index in self.selectedIndexes())
+            texts = [self.model().index(row).data(Qt.DisplayRole) or "" for row in rows]
+            if texts:
+                QApplication.clipboard().setText("\n\n".join(texts))
+            return
+        super().keyPressEvent(event)
@@ -0,0 +1,120 @@
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QToolButton
+from PySide6.QtGui import QPixmap, QIcon
+from PySide6.QtCore import Qt, Signal, QSize
+
+class VariantPicker(QWidget):
+    """同じ指示で並行して生成したバリエーションを横に並べ、採用する1つを選ぶパネル
+
+    結果は届いた順に枠へ表示し、全て揃うと「採用」ボタンを有効にする。
+    サムネイルをクリックするとメインの画像表示でプレビューする。
+    """
+
+    # ジョブID と バリエーション番号
+    variant_chosen = Signal(int, int)
+    # ジョブID
+    discard_requested = Signal(int)
+    # プレビューするエンコード済み画像
+    variant_previewed = Signal(object)
+
+    THUMBNAIL_SIZE = QSize(160, 160)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.job_id = None
+        self._images = {}  # バリエーション番号 -> エンコード済み画像
+        self._slots = []  # (サムネイルのボタン, 採用ボタン)
+        self.setup_ui()
+        self.setVisible(False)
+
+    def setup_ui(self):
+        """UIの初期化"""
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+
+        header_layout = QHBoxLayout()
+        self.title_label = QLabel()
+        header_layout.addWidget(self.title_label)
+        header_layout.addStretch()
+        self.discard_button = QPushButton("全て破棄")
+        self.discard_button.clicked.connect(self._on_discard_clicked)
+        header_layout.addWidget(self.discard_button)
+        main_layout.addLayout(header_layout)
+
+        self.slots_layout = QHBoxLayout()
+        main_layout.addLayout(self.slots_layout)
+
+    def start(self, job_id, count):
+        """生成中のバリエーションの枠を count 個用意する"""
+        self.clear()
+        self.job_id = job_id
+        self.title_label.setText(f"バリエーション {count} 件を生成中...")
+        self.discard_button.setEnabled(False)
+        for index in range(count):
+            slot_layout = QVBoxLayout()
+            thumbnail = QToolButton()
+            thumbnail.setText("生成中...")
+            thumbnail.setIconSize(self.THUMBNAIL_SIZE)
+            thumbnail.setFixedSize(self.THUMBNAIL_SIZE + QSize(8, 8))
+            thumbnail.setToolButtonStyle(Qt.ToolButtonTextOnly)
+            thumbnail.clicked.connect(lambda checked=False, index=index: self._on_thumbnail_clicked(index))
+            choose_button = QPushButton("採用")
+            choose_button.setEnabled(False)
+            choose_button.clicked.connect(lambda checked=False, index=index: self._on_choose_clicked(index))
+            slot_layout.addWidget(thumbnail)
+            slot_layout.addWidget(choose_button)
+            self.slots_layout.addLayout(slot_layout)
+            self._slots.append((thumbnail, choose_button))
+        self.slots_layout.addStretch()
+        self.setVisible(True)
+
+    def set_variant(self, index, result):
+        """届いたバリエーションを枠に表示（画像がなければ失敗として表示）"""
+        if not (0 <= index < len(self._slots)):
+            return
+        thumbnail, _ = self._slots[index]
+        image = result.get("image")
+        qimage = image.to_qimage() if image else None
+        if qimage is None:
+            thumbnail.setText("生成失敗")
+            thumbnail.setToolTip(result.get("text", ""))
+            return
+
+        self._images[index] = image
+        pixmap = QPixmap.fromImage(qimage).scaled(self.THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        thumbnail.setIcon(QIcon(pixmap))
+        thumbnail.setToolButtonStyle(Qt.ToolButtonIconOnly)
+        thumbnail.setToolTip(result.get("text", ""))
+
+    def set_choosable(self, indices):
+        """全て揃ったら、画像が得られたバリエーションの「採用」を有効にする"""
+        self.title_label.setText("採用するバリエーションを選んでください")
+        self.discard_button.setEnabled(True)
+        for index, (_, choose_button) in enumerate(self._slots):
+            choose_button.setEnabled(index in indices)
+
+    def clear(self):
+        """枠を全て取り除いて非表示にする"""
+        self.job_id = None
+        self._images = {}
+        self._slots = []
+        while self.slots_layout.count():
+            item = self.slots_layout.takeAt(0)
+            layout = item.layout()
+            if layout is not None:
+                while layout.count():
+                    widget = layout.takeAt(0).widget()
+                    if widget is not None:
+                        widget.deleteLater()
+        self.setVisible(False)
+
+    def _on_thumbnail_clicked(self, index):
+        if index in self._images:
+            self.variant_previewed.emit(self._images[index])
+
+    def _on_choose_clicked(self, index):
+        if self.job_id is not None:
+            self.variant_chosen.emit(self.job_id, index)
+
+    def _on_discard_clicked(self):
+        if self.job_id is not None:
+            self.discard_requested.emit(self.job_id)
@@ -1,17 +1,64 @@
 import os
 import json
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
 
 # .envファイルがあれば読み込む
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class Config:
     # APIキー設定
     API_KEY = os.environ.get("GOOGLE_API_KEY")
     
     # モデル設定
     MODEL_NAME = "gemini-2.0-flash-exp-image-generation"
+    BACKUP_MODEL_ENABLED = True  # 画像が得られなかったときにバックアップモデルで再試行
+    HEDGE_ENABLED = True  # 主モデルの応答が遅いときはバックアップモデルにも送り、先に画像を返したほうを使う
+    HEDGE_DELAY_SECONDS = 30.0  # バックアップにも送るまでの待ち時間（秒。記録が十分なら主モデルの p95 まで短くする）
+    HEDGE_MIN_SAMPLES = 10  # 待ち時間を主モデルの実績から決めるのに必要な成功件数
+    CIRCUIT_FAILURE_THRESHOLD = 3  # 連続でこの回数失敗したモデルには一定時間送らない
+    CIRCUIT_RESET_SECONDS = 60.0  # 送信を止めたモデルを再び試すまでの時間（秒）
+    MODEL_HEALTH_WINDOW = 50  # 成功率・レイテンシを集計する直近のリクエスト数
+    
+    # レート制限設定（プロセス全体でモデルごとに共有する。利用プランのクォータに合わせる）
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_RPM = 10  # 1分あたりのリクエスト数
+    RATE_LIMIT_TPM = 1000000  # 1分あたりのトークン数
+    RATE_LIMIT_BURST = 2  # 待たずに続けて送れるリクエスト数
+    RATE_LIMIT_UTILIZATION = 0.95  # クォータに対して送る割合（時計のずれで上限を超えないよう少し下げる）
+    RATE_LIMIT_OUTPUT_TOKENS = 1290  # 出力画像1枚のトークン数の見積もり
+    RATE_LIMITS = {}  # モデルごとの上書き {"モデル名": (RPM, TPM)}
+    RETRY_MAX_ATTEMPTS = 5  # 一時的なエラー（429・5xx・通信エラー）のときの最大試行回数
+    RETRY_BASE_SECONDS = 1.0  # 指数バックオフの初回の待ち時間（秒）
+    RETRY_MAX_SECONDS = 60.0  # バックオフの待ち時間の上限（秒）
+    
+    # リクエスト設定
+    MAX_CONCURRENT_REQUESTS = 4  # 同時に送信するリクエストの上限
+    REQUEST_TIMEOUT = 180  # 1リクエストあたりのタイムアウト（秒）
+    STREAMING_ENABLED = True  # 応答をストリーミングで受信し、テキストと画像を届いた時点で表示する
+    MAX_VARIANTS = 5  # 1回の編集で並行して生成するバリエーションの上限（1なら通常の編集）
+    
+    # 接続設定（API呼び出しのHTTP接続はプールして使い回す）
+    HTTP_POOL_SIZE = 8  # 接続プールの上限（同時に保持する接続数）
+    HTTP_KEEPALIVE_SECONDS = 120.0  # 使っていない接続を保持する時間（秒）
+    HTTP_WARMUP = True  # 起動時に接続とTLSハンドシェイクを済ませておく
+    HTTP_WARMUP_URL = "https://generativelanguage.googleapis.com/"
+    
+    # メモリ設定
+    DECODED_IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # デコード済み画像（表示用・編集用・サムネイル）に使うメモリの上限
+    
+    # 保存設定
+    PERSIST_FLUSH_TIMEOUT = 5.0  # 終了時に未保存の書き込みを待つ最大時間（秒）
+    PNG_COMPRESS_LEVEL = 6  # PNGで保存するときの圧縮レベル（0=最速・最大サイズ 〜 9=最小サイズ・最遅）
+    
+    # ログ・計測設定
+    LOG_LEVEL = os.environ.get("GEMINI_IMG_EDITOR_LOG_LEVEL", "INFO")  # DEBUG にすると応答の解析などの詳細も出力する
+    METRICS_ENABLED = False  # 処理の段階ごとの所要時間を記録し、終了時に書き出す
+    METRICS_ENV = "GEMINI_IMG_EDITOR_METRICS"  # この環境変数があれば設定に関わらず記録する
+    METRICS_MAX_TRACE_EVENTS = 100000  # トレースに保持する区間の上限（古いものから捨てる）
     
     # アプリケーション設定
     APP_NAME = "GeminiImgEditor"
@@ -22,18 +69,66 @@ class Config:
     
     # ファイル保存設定
     # 画像保存ディレクトリ
+    # （ディレクトリはインポート時ではなく ensure_directories() で作成する）
     SAVE_DIRECTORY = os.path.join(os.path.expanduser("~"), "Pictures", "GeminiImgEditor")
-    os.makedirs(SAVE_DIRECTORY, exist_ok=True)
     
     # スレッド情報保存ディレクトリ
     THREADS_DIRECTORY = os.path.join(SAVE_DIRECTORY, "threads")
-    os.makedirs(THREADS_DIRECTORY, exist_ok=True)
+    # スレッド・メッセージ・画像の版を保存するデータベース（旧形式のJSONは初回起動時に取り込む）
+    THREAD_DB_FILE = os.path.join(SAVE_DIRECTORY, "threads.db")
+    
+    # 計測結果（トレース・統計・Prometheus のテキストファイル）の書き出し先
+    METRICS_DIRECTORY = os.path.join(SAVE_DIRECTORY, "metrics")
+    
+    # 送信画像の設定
+    UPLOAD_MAX_EDGE = 2048  # 送信画像の長辺の上限（ピクセル）
+    UPLOAD_MAX_BYTES = 4 * 1024 * 1024  # 送信画像の容量上限
+    UPLOAD_MIN_BYTES = 256 * 1024  # 帯域が狭くてもこれ以下には絞らない
+    UPLOAD_TARGET_SECONDS = 2.0  # 実測帯域でこの時間内に送れる容量に抑える
+    UPLOAD_PNG_COMPRESS_LEVEL = 3  # 送信用PNGの圧縮レベル（速度優先）
+    
+    # レスポンスキャッシュ設定
+    RESPONSE_CACHE_ENABLED = True
+    CACHE_DIRECTORY = os.path.join(SAVE_DIRECTORY, "cache")
+    RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # キャッシュの上限サイズ
+    
+    # 送信画像のアップロード設定（Files API にアップロードし、同じ画像は参照で送る）
+    FILE_UPLOAD_ENABLED = True
+    FILE_UPLOAD_MIN_BYTES = 64 * 1024  # これより小さい画像はアップロードせず直接送る
+    FILE_UPLOAD_MIN_USES = 2  # 同じ画像を送るのがこの回数目になったらアップロードする（1回しか送らない画像は直接送る）
+    FILE_UPLOAD_TTL_SECONDS = 48 * 3600  # アップロードしたファイルの保持期間（応答に有効期限がない場合に使う）
+    FILE_UPLOAD_EXPIRY_MARGIN_SECONDS = 3600  # 有効期限までこれより短い参照は使わずにアップロードし直す
+    
+    # サムネイル設定
+    THUMBNAIL_DIRECTORY = os.path.join(SAVE_DIRECTORY, "thumbnails")
+    THUMBNAIL_SIZE = 300  # 会話履歴に表示するサムネイルの長辺（ピクセル）
+    THUMBNAIL_WORKERS = 2  # サムネイルを作成するワーカー数
+    
+    # 画像の版の保存設定（タイルに分割し、同じ内容のタイルは1回だけ保存する）
+    # 保存のたびにデコードと全タイルのPNGエンコードが必要になり、画素が完全に一致するタイルしか共有できないため既定は無効
+    TILE_STORE_ENABLED = False
+    TILE_STORE_DIRECTORY = os.path.join(SAVE_DIRECTORY, "store")
+    TILE_SIZE = 256  # タイルの一辺（ピクセル）
+    
+    @classmethod
+    def ensure_directories(cls):
+        """保存ディレクトリを作成（起動処理の中で一度呼ぶ）"""
+        os.makedirs(cls.SAVE_DIRECTORY, exist_ok=True)
+        os.makedirs(cls.THREADS_DIRECTORY, exist_ok=True)
+    
+    @classmethod
+    def configure_logging(cls, level=None):
+        """ログの出力レベルと形式を設定（起動時に一度呼ぶ）"""
+        logging.basicConfig(
+            level=getattr(logging, (level or cls.LOG_LEVEL).upper(), logging.INFO),
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        )
     
     # 設定のバリデーション
     @classmethod
     def validate_config(cls):
         """設定が有効かどうか確認"""
         if not cls.API_KEY:
-            print("警告: GOOGLE_API_KEYが設定されていません。環境変数を設定してください。")
+            logger.warning("GOOGLE_API_KEYが設定されていません。環境変数を設定してください。")
             return False
         return True
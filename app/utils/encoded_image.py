@@ -0,0 +1,134 @@
+import io
+import os
+import base64
+import hashlib
+import weakref
+import itertools
+from utils.metrics import metrics
+from utils.image_cache import decoded_images, DecodedImageCache
+
+class EncodedImage:
+    """エンコード済みの画像データ（バイト列を1つだけ保持し、必要になるまでデコードしない）
+
+    デコードした PIL画像・QImage は自身では持たず、共有の DecodedImageCache に預ける
+    （メモリの上限を超えると古いものから捨てられ、次に必要になったときにデコードし直す）。
+    """
+
+    MIME_EXTENSIONS = {
+        "image/png": "png",
+        "image/jpeg": "jpg",
+        "image/webp": "webp",
+        "image/gif": "gif",
+        "image/bmp": "bmp",
+    }
+
+    _ids = itertools.count(1)
+
+    def __init__(self, data, mime_type="image/png"):
+        self.data = data
+        self.mime_type = mime_type
+        self._size = None
+        self._digest = None
+        self._id = next(self._ids)
+        # このデータが破棄されたらデコード結果もキャッシュから取り除く
+        weakref.finalize(self, decoded_images.discard, (self._id, "pil"), (self._id, "qimage"))
+
+    @classmethod
+    def from_inline_data(cls, data, mime_type):
+        """APIレスポンスの inline_data から作成（文字列ならBase64デコード）"""
+        if isinstance(data, str):
+            # 前後の引用符などBase64以外の文字はデコード時に読み飛ばされる
+            data = base64.b64decode(data)
+        return cls(data, mime_type)
+
+    @classmethod
+    def from_file(cls, path):
+        """ファイルの内容をそのまま読み込む"""
+        with open(path, "rb") as f:
+            data = f.read()
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        mime_type = cls.mime_type_for_extension(ext)
+        return cls(data, mime_type)
+
+    @classmethod
+    def from_pil(cls, image, compress_level=1):
+        """PIL画像をPNGにエンコードして作成（デコード済みの画像はそのまま保持する）"""
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", compress_level=compress_level)
+        encoded = cls(buffer.getvalue(), "image/png")
+        encoded._size = image.size
+        decoded_images.put((encoded._id, "pil"), image, DecodedImageCache.pil_bytes(image))
+        return encoded
+
+    @classmethod
+    def mime_type_for_extension(cls, ext):
+        """拡張子からMIMEタイプを取得"""
+        ext = "jpg" if ext == "jpeg" else ext
+        for mime_type, known_ext in cls.MIME_EXTENSIONS.items():
+            if known_ext == ext:
+                return mime_type
+        return "application/octet-stream"
+
+    @property
+    def extension(self):
+        """MIMEタイプに対応する拡張子"""
+        return self.MIME_EXTENSIONS.get(self.mime_type, self.mime_type.split("/")[-1])
+
+    @property
+    def size(self):
+        """画像サイズ（ヘッダーのみ読み、画素はデコードしない）"""
+        if self._size is None:
+            from PIL import Image
+            with Image.open(io.BytesIO(self.data)) as image:
+                self._size = image.size
+        return self._size
+
+    def digest(self):
+        """MIMEタイプと内容のハッシュ（一度計算したら使い回す）"""
+        if self._digest is None:
+            digest = hashlib.sha256(f"{self.mime_type}\n".encode("utf-8"))
+            digest.update(self.data)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def to_pil(self):
+        """PIL画像にデコードする（キャッシュにあればデコードしない）
+
+        返した画像はキャッシュと共有するので、呼び出し側で変更しないこと。
+        """
+        return decoded_images.get_or_decode((self._id, "pil"), self._decode_pil, DecodedImageCache.pil_bytes)
+
+    def _decode_pil(self):
+        from PIL import Image
+        image = Image.open(io.BytesIO(self.data))
+        # 遅延読み込みのままキャッシュすると、共有した画像を複数のスレッドが同時にデコードしてしまう
+        # （キャッシュの容量も、まだデコードしていない画素の分を数えることになる）
+        with metrics.span("decode", mime_type=self.mime_type, bytes=len(self.data)):
+            image.load()
+        return image
+
+    def to_qimage(self):
+        """QImageにデコードする（キャッシュにあればデコードしない）"""
+        return decoded_images.get_or_decode((self._id, "qimage"), self._decode_qimage, DecodedImageCache.qimage_bytes)
+
+    def _decode_qimage(self):
+        from PySide6.QtGui import QImage
+        qimage = QImage()
+        with metrics.span("decode", mime_type=self.mime_type, bytes=len(self.data)):
+            if not qimage.loadFromData(self.data):
+                return None
+        return qimage
+
+    def matches_extension(self, path):
+        """保存先の拡張子がこの画像の形式と一致するか"""
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        return self.mime_type_for_extension(ext) == self.mime_type
+
+    def save(self, path):
+        """バイト列をそのままファイルに書き込む"""
+        with open(path, "wb") as f:
+            f.write(self.data)
+        return path
+
+    def __len__(self):
+        return len(self.data)
@@ -1,26 +1,63 @@
 import os
 import json
+import logging
 import shutil
 from datetime import datetime
-from PIL import Image
 from utils.config import Config
+from utils.encoded_image import EncodedImage
+from utils.metrics import metrics
 import glob
 
+logger = logging.getLogger(__name__)
+
 class FileManager:
     @staticmethod
-    def get_image_save_path(thread_id, edit_number=None):
+    def get_image_save_path(thread_id, edit_number=None, ext="png"):
         """画像ファイルの保存パスを取得"""
         base_dir = Config.SAVE_DIRECTORY
         if edit_number is not None:
             # 編集番号が指定されている場合は通常の保存パス
-            return os.path.join(base_dir, f"{thread_id}_edit_{edit_number:02d}.png")
+            return os.path.join(base_dir, f"{thread_id}_edit_{edit_number:02d}.{ext}")
         else:
-            # 編集番号が指定されていない場合は最新の編集結果
-            return os.path.join(base_dir, f"{thread_id}_latest.png")
+            # 編集番号が指定されていない場合は最新の編集結果（旧形式。現在は移行時の検出にのみ使う）
+            return os.path.join(base_dir, f"{thread_id}_latest.{ext}")
+    
+    @staticmethod
+    def get_input_save_path(thread_id, number, ext="png"):
+        """読み込んだ入力画像の保存パスを取得"""
+        return os.path.join(Config.SAVE_DIRECTORY, f"{thread_id}_input_{number:02d}.{ext}")
+    
+    @staticmethod
+    def get_variant_save_path(thread_id, edit_number, index, ext="png"):
+        """採用されなかったバリエーションの保存パスを取得（採用した版と同じ編集番号に枝番を付ける）"""
+        return os.path.join(Config.SAVE_DIRECTORY, f"{thread_id}_edit_{edit_number:02d}_v{index}.{ext}")
+    
+    @staticmethod
+    def image_extension(image):
+        """画像の保存形式の拡張子（タイルストアが有効ならマニフェスト）"""
+        if Config.TILE_STORE_ENABLED:
+            from utils.tile_store import TileStore
+            return TileStore.MANIFEST_EXTENSION
+        return image.extension if isinstance(image, EncodedImage) else "png"
+    
+    @staticmethod
+    def load_encoded_image(path):
+        """保存済みの画像をエンコード済み画像として読み込む（マニフェストは保存した元のバイト列を返す）"""
+        from utils.tile_store import TileStore
+        if TileStore.is_manifest(path):
+            return TileStore().load_encoded(path)
+        return EncodedImage.from_file(path)
     
     @staticmethod
     def save_image(image, filename=None, thread_id=None):
-        """画像を保存する"""
+        """画像を保存する（失敗時はNone）"""
+        with metrics.span("disk_save") as span:
+            file_path = FileManager._save_image(image, filename, thread_id)
+            span.set(path=file_path)
+        return file_path
+    
+    @staticmethod
+    def _save_image(image, filename, thread_id):
         try:
             # 保存ディレクトリの設定
             base_dir = Config.SAVE_DIRECTORY
@@ -41,15 +78,45 @@ class FileManager:
             else:
                 file_path = os.path.join(base_dir, filename)
             
-            # PILImageオブジェクトを保存
-            image.save(file_path)
-            print(f"画像を保存しました: {file_path}")
+            # 一時ファイルに書いてから置き換え、書きかけのファイルが残らないようにする
+            # （拡張子で保存形式を判定するため、一時ファイルも同じ拡張子にする）
+            from utils.tile_store import TileStore
+            if TileStore.is_manifest(file_path):
+                # タイルに分割して保存（マニフェストも一時ファイル経由で書く）
+                if isinstance(image, EncodedImage):
+                    TileStore().put(image.to_pil(), file_path, original=image)
+                else:
+                    TileStore().put(image, file_path)
+                logger.info("画像を保存しました: %s", file_path)
+                return file_path
+            
+            root, ext = os.path.splitext(file_path)
+            tmp_path = f"{root}.tmp{ext}"
+            if isinstance(image, EncodedImage):
+                if image.matches_extension(file_path):
+                    # 形式が同じならデコード・再エンコードせずにそのまま書き込む
+                    image.save(tmp_path)
+                else:
+                    FileManager._save_pil(image.to_pil(), tmp_path)
+            else:
+                # PILImageオブジェクトを保存
+                FileManager._save_pil(image, tmp_path)
+            os.replace(tmp_path, file_path)
+            logger.info("画像を保存しました: %s", file_path)
             
             return file_path
         except Exception as e:
-            print(f"画像保存エラー: {e}")
+            logger.error("画像保存エラー: %s", e)
             return None
     
+    @staticmethod
+    def _save_pil(image, file_path):
+        """PIL画像を保存（PNGは設定の圧縮レベルで保存する）"""
+        if file_path.lower().endswith(".png"):
+            image.save(file_path, compress_level=Config.PNG_COMPRESS_LEVEL)
+        else:
+            image.save(file_path)
+    
     @staticmethod
     def save_thread_data(thread_id, thread_data):
         """スレッドデータをJSONファイルとして保存"""
@@ -62,10 +129,10 @@ class FileManager:
             with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump(thread_data, f, ensure_ascii=False, indent=2)
             
-            print(f"スレッドデータを保存: {file_path}")
+            logger.debug("スレッドデータを保存: %s", file_path)
             return True
         except Exception as e:
-            print(f"スレッドデータ保存エラー: {e}")
+            logger.error("スレッドデータ保存エラー: %s", e)
             return False
     
     @staticmethod
@@ -76,16 +143,16 @@ class FileManager:
             file_path = os.path.join(threads_dir, f"{thread_id}.json")
             
             if not os.path.exists(file_path):
-                print(f"スレッドデータが存在しません: {thread_id}")
+                logger.debug("スレッドデータが存在しません: %s", thread_id)
                 return None
             
             with open(file_path, 'r', encoding='utf-8') as f:
                 thread_data = json.load(f)
             
-            print(f"スレッドデータを読み込み: {thread_id}")
+            logger.debug("スレッドデータを読み込み: %s", thread_id)
             return thread_data
         except Exception as e:
-            print(f"スレッドデータ読み込みエラー: {e}")
+            logger.error("スレッドデータ読み込みエラー: %s", e)
             return None
     
     @staticmethod
@@ -96,7 +163,7 @@ class FileManager:
             thread_files = [f for f in os.listdir(threads_dir) if f.endswith(".json")]
             return [os.path.splitext(f)[0] for f in thread_files]
         except Exception as e:
-            print(f"スレッドリストの取得に失敗しました: {e}")
+            logger.error("スレッドリストの取得に失敗しました: %s", e)
             return []
     
     @staticmethod
@@ -124,5 +191,5 @@ class FileManager:
             
             return threads
         except Exception as e:
-            print(f"スレッド一覧取得エラー: {e}")
+            logger.error("スレッド一覧取得エラー: %s", e)
             return []
@@ -0,0 +1,129 @@
+import logging
+import threading
+from collections import OrderedDict
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+class DecodedImageCache:
+    """デコード済み画像（PIL画像・QImage・サムネイル・ビューアの縮小レベルとタイル）をプロセス全体で共有するLRUキャッシュ
+
+    画素数から見積もったバイト数の合計が max_bytes を超えたら、最も長く使われていないものから捨てる。
+    各コンポーネントは自分でデコード結果を保持せず、必要なたびにここから借りる
+    （捨てられたものは次に必要になったときにもう一度デコードする）。
+    max_bytes を超える1枚の画像は保持せずにそのまま返す。
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or Config.DECODED_IMAGE_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # キー -> (画像, バイト数)
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def pil_bytes(image):
+        """デコード済みのPIL画像のおおよそのバイト数"""
+        return image.width * image.height * len(image.getbands())
+
+    @staticmethod
+    def qimage_bytes(image):
+        return image.sizeInBytes()
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def get(self, key):
+        """キャッシュにあれば返す（なければNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image, nbytes):
+        """画像を登録して返す（上限を超えた分は古いものから捨てる）"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            if nbytes > self.max_bytes:
+                return image
+            self._entries[key] = (image, nbytes)
+            self.bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self._evict()
+        return image
+
+    def get_or_decode(self, key, decode, size_of):
+        """キャッシュにあれば返し、なければ decode() の結果を登録して返す（Noneは登録しない）
+
+        デコードはロックの外で行うため、同じキーを同時に要求すると両方がデコードし、後のものが残る。
+        """
+        image = self.get(key)
+        if image is not None:
+            return image
+        image = decode()
+        if image is None:
+            return None
+        return self.put(key, image, size_of(image))
+
+    def discard(self, *keys):
+        """キーを取り除く（持ち主の画像データが破棄されたときに呼ぶ）"""
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.bytes -= entry[1]
+
+    def discard_owner(self, owner, kind=None):
+        """キーが (owner, kind, ...) のものをまとめて取り除く（kind を省略すると owner のものすべて）"""
+        with self._lock:
+            keys = [key for key in self._entries
+                    if key[0] == owner and (kind is None or key[1] == kind)]
+            for key in keys:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def set_max_bytes(self, max_bytes):
+        """上限を変更し、超えていれば古いものから捨てる"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _evict(self):
+        """上限に収まるまで古いものから捨てる（ロック内で呼ぶ）"""
+        while self.bytes > self.max_bytes and self._entries:
+            key, (_, nbytes) = self._entries.popitem(last=False)
+            self.bytes -= nbytes
+            self.evictions += 1
+            logger.debug("デコード済み画像を破棄: %s (%.1fMB)", key, nbytes / 1024 / 1024)
+
+    def get_stats(self):
+        """使用量（バイト）・上限・件数・ヒット率などの統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "peak_bytes": self.peak_bytes,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+            }
+
+# プロセス全体で共有するキャッシュ
+decoded_images = DecodedImageCache()
@@ -0,0 +1,93 @@
+import os
+import json
+import logging
+import hashlib
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class JobJournal:
+    """バッチ処理の進捗を記録するジャーナル（JSON Lines形式・追記のみ）"""
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    # スレッドを作成し、結果の保存を始めた（thread_id を記録してから保存する）
+    STATUS_SAVING = "saving"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, journal_path):
+        """ジャーナルを開き、既存の記録があれば読み込む"""
+        self.journal_path = journal_path
+        self.entries = {}  # key をキーとした最新の記録
+        self._lock = threading.Lock()
+
+        journal_dir = os.path.dirname(os.path.abspath(journal_path))
+        os.makedirs(journal_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(image_path, instruction):
+        """画像パスと指示テキストからジョブの識別キーを作成"""
+        source = f"{os.path.abspath(image_path)}\n{instruction}"
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """ジャーナルを読み込む（同じキーは後の記録で上書き）"""
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で中断された行は無視
+                    logger.warning("ジャーナルの壊れた行をスキップ: %s", line[:50])
+                    continue
+                self.entries[entry["key"]] = entry
+
+        logger.info("ジャーナルを読み込み: %s (%s件)", self.journal_path, len(self.entries))
+
+    def record(self, key, status, **fields):
+        """ジョブの状態を追記する"""
+        with self._lock:
+            entry = dict(self.entries.get(key, {}))
+            entry.update(fields)
+            entry["key"] = key
+            entry["status"] = status
+            entry["timestamp"] = datetime.now().isoformat()
+            if status == self.STATUS_RUNNING:
+                entry["attempts"] = entry.get("attempts", 0) + 1
+
+            # クラッシュしても記録が残るように毎回fsyncする
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.entries[key] = entry
+            return entry
+
+    def get_status(self, key):
+        """ジョブの最新状態を取得"""
+        entry = self.entries.get(key)
+        return entry["status"] if entry else self.STATUS_PENDING
+
+    def is_done(self, key):
+        """ジョブが完了済みかどうか"""
+        return self.get_status(key) == self.STATUS_DONE
+
+    def summary(self, keys=None):
+        """状態ごとの件数を取得（keys指定時はそのジョブのみ集計）"""
+        if keys is None:
+            keys = self.entries.keys()
+        counts = {}
+        for key in keys:
+            status = self.get_status(key)
+            counts[status] = counts.get(status, 0) + 1
+        return counts
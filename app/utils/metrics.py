@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from utils.config import Config
+
+class Histogram:
+    """処理時間（秒）のヒストグラム（上限値ごとの件数・合計・最大）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は上限なし（+Inf）
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percentile):
+        """パーセンタイルの近似値（該当するバケット内で線形補間し、最大値で頭打ちにする。記録がなければNone）"""
+        if not self.count:
+            return None
+        target = self.count * percentile / 100
+        total = 0
+        for index, count in enumerate(self.counts):
+            if count and total + count >= target:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (target - total) / count)
+            total += count
+        return self.max
+
+    def get_stats(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "buckets": dict(zip([str(bucket) for bucket in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+class _Span:
+    """計測中の区間（with を抜けたときに Metrics に記録する）"""
+
+    __slots__ = ("_metrics", "name", "attrs", "_started")
+
+    def __init__(self, metrics, name, attrs):
+        self._metrics = metrics
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """区間の途中で分かった属性を追加（トレースにのみ出力する）"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.record(self.name, self._started, time.perf_counter() - self._started,
+                             self.attrs, error=exc_type is not None)
+        return False
+
+class _NullSpan:
+    """計測が無効なときに返す何もしない区間（全ての呼び出しで同じものを使う）"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Metrics:
+    """処理の段階ごとの所要時間を記録し、ヒストグラム・Chromeトレース・Prometheus形式で書き出す
+
+    段階は prepare（送信画像の準備）・api_wait（API呼び出し）・decode・display・disk_save・persist など。
+    無効なときは span が共有の空の区間を返すだけなので、呼び出し側は常に with metrics.span(...) と書いてよい。
+    トレースは直近 max_events 件だけ保持する。
+    """
+
+    # 1ms 〜 2分
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+    PROMETHEUS_PREFIX = "gemini_img_editor"
+
+    def __init__(self, enabled=False, max_events=None):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+        self._events = deque(maxlen=max_events or Config.METRICS_MAX_TRACE_EVENTS)
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name, **attrs):
+        """段階 name の所要時間を計る区間（with で使う。attrs はトレースの引数になる）"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, attrs)
+
+    def observe(self, name, seconds, started=None, **attrs):
+        """別の方法で計った所要時間を段階 name として記録（started を省略すると今終わったとみなす）"""
+        if not self.enabled:
+            return
+        if started is None:
+            started = time.perf_counter() - seconds
+        self.record(name, started, seconds, attrs)
+
+    def record(self, name, started, seconds, attrs=None, error=False):
+        """計測結果を記録（started は perf_counter の値）"""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": "stage",
+            "ph": "X",
+            "ts": (started - self._origin) * 1e6,
+            "dur": seconds * 1e6,
+            "pid": self._pid,
+            "tid": thread.ident,
+            "args": dict(attrs or {}, error=True) if error else (attrs or {}),
+        }
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.BUCKETS)
+            histogram.observe(seconds)
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            self._events.append(event)
+
+    def get_stats(self):
+        """段階ごとの件数・合計・平均・p50/p95・最大・エラー件数"""
+        with self._lock:
+            stats = {name: histogram.get_stats() for name, histogram in self._histograms.items()}
+            for name in stats:
+                stats[name]["errors"] = self._errors.get(name, 0)
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+            self._events.clear()
+
+    def export_chrome_trace(self, path):
+        """Chromeトレース形式（chrome://tracing や Perfetto で開ける JSON）で書き出す"""
+        with self._lock:
+            events = list(self._events)
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": thread_names[tid]}}
+            for tid in {event["tid"] for event in events} if tid in thread_names
+        ]
+        self._write_atomic(path, json.dumps({"traceEvents": metadata + events, "displayTimeUnit": "ms"},
+                                            ensure_ascii=False))
+        return path
+
+    def export_json(self, path):
+        """段階ごとの統計を JSON で書き出す"""
+        self._write_atomic(path, json.dumps(self.get_stats(), ensure_ascii=False, indent=2))
+        return path
+
+    def write_prometheus(self, path):
+        """Prometheus のテキスト形式で書き出す（node_exporter の textfile コレクター向けに一時ファイル経由で置き換える）"""
+        name = f"{self.PROMETHEUS_PREFIX}_stage_seconds"
+        errors_name = f"{self.PROMETHEUS_PREFIX}_stage_errors_total"
+        lines = [f"# HELP {name} Time spent in each processing stage.", f"# TYPE {name} histogram"]
+        stats = self.get_stats()
+        for stage, stage_stats in sorted(stats.items()):
+            cumulative = 0
+            for bucket, count in stage_stats["buckets"].items():
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bucket}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {stage_stats["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {stage_stats["count"]}')
+        lines += [f"# HELP {errors_name} Stages that ended with an exception.", f"# TYPE {errors_name} counter"]
+        for stage, stage_stats in sorted(stats.items()):
+            lines.append(f'{errors_name}{{stage="{stage}"}} {stage_stats["errors"]}')
+        self._write_atomic(path, "\n".join(lines) + "\n")
+        return path
+
+    def export(self, directory=None):
+        """トレース・統計・Prometheus の3つを directory に書き出し、パスを返す（無効なら何もしない）"""
+        if not self.enabled:
+            return None
+        directory = directory or Config.METRICS_DIRECTORY
+        os.makedirs(directory, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        return {
+            "trace": self.export_chrome_trace(os.path.join(directory, f"trace_{timestamp}.json")),
+            "stats": self.export_json(os.path.join(directory, "stages.json")),
+            "prometheus": self.write_prometheus(os.path.join(directory, "gemini_img_editor.prom")),
+        }
+
+    @staticmethod
+    def _write_atomic(path, text):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+# プロセス全体で共有する計測（設定か環境変数で有効にする）
+metrics = Metrics(enabled=Config.METRICS_ENABLED or bool(os.environ.get(Config.METRICS_ENV)))
@@ -0,0 +1,203 @@
+import os
+import io
+import glob
+import json
+import logging
+import hashlib
+import threading
+from PIL import Image
+from utils.config import Config
+from utils.encoded_image import EncodedImage
+
+logger = logging.getLogger(__name__)
+
+class TileStore:
+    """画像をタイルに分割し、同じ内容のタイルを1回だけ保存するストア（内容アドレス方式）
+
+    画像ごとにタイルのハッシュを並べたマニフェスト（*.tiles）を書き、読み込み時に組み立て直す。
+    編集で変わらなかった部分のタイルは前の版と共有される。
+    タイルは画素の完全一致でのみ共有するので、組み立て直した画像は元の画素と同じになる。
+    元のエンコード済みのバイト列も（同じ内容は1回だけ）保存し、読み込み時は組み立て・再エンコードせずにそれを返す。
+    """
+
+    MANIFEST_EXTENSION = "tiles"
+    MANIFEST_VERSION = 2
+    # そのまま保存できるモード（それ以外はRGB/RGBAに変換する）
+    STORED_MODES = ("1", "L", "LA", "RGB", "RGBA")
+
+    def __init__(self, store_dir=None, tile_size=None):
+        self.store_dir = store_dir or Config.TILE_STORE_DIRECTORY
+        self.tile_size = tile_size or Config.TILE_SIZE
+        self.tiles_dir = os.path.join(self.store_dir, "tiles")
+        self.originals_dir = os.path.join(self.store_dir, "originals")
+        os.makedirs(self.tiles_dir, exist_ok=True)
+
+    @classmethod
+    def is_manifest(cls, path):
+        """マニフェストのパスかどうか"""
+        return bool(path) and path.lower().endswith(f".{cls.MANIFEST_EXTENSION}")
+
+    def _tile_path(self, digest):
+        """タイルの保存パス（ハッシュの先頭2文字でディレクトリを分ける）"""
+        return os.path.join(self.tiles_dir, digest[:2], f"{digest}.png")
+
+    def _original_path(self, original):
+        """元のバイト列の保存パス（マニフェストの original から）"""
+        digest = original["digest"]
+        return os.path.join(self.originals_dir, digest[:2], f"{digest}.{original['extension']}")
+
+    @staticmethod
+    def _write_atomic(path, data):
+        """一時ファイルに書いてから置き換える（並列に書いても壊れたファイルを残さない）"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _put_tile(self, tile):
+        """タイルを保存してハッシュを返す（同じ内容がすでにあれば書かない）"""
+        digest = hashlib.sha256()
+        digest.update(f"{tile.mode}:{tile.width}x{tile.height}\n".encode("utf-8"))
+        digest.update(tile.tobytes())
+        digest = digest.hexdigest()
+
+        tile_path = self._tile_path(digest)
+        if not os.path.exists(tile_path):
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            buffer = io.BytesIO()
+            tile.save(buffer, "PNG", compress_level=Config.PNG_COMPRESS_LEVEL)
+            self._write_atomic(tile_path, buffer.getvalue())
+        return digest
+
+    def _put_original(self, original):
+        """元のエンコード済み画像のバイト列を保存し、マニフェストに書く情報を返す（同じ内容があれば書かない）"""
+        entry = {
+            "digest": hashlib.sha256(original.data).hexdigest(),
+            "mime_type": original.mime_type,
+            "extension": original.extension,
+        }
+        path = self._original_path(entry)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, original.data)
+        return entry
+
+    def put(self, image, manifest_path, original=None):
+        """PIL画像をタイルに分けて保存し、マニフェストを書く（マニフェストのパスを返す）
+
+        original（EncodedImage）を渡すと元のバイト列も保存し、load_encoded でそのまま返せるようにする。
+        """
+        if image.mode not in self.STORED_MODES:
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        image.load()
+
+        width, height = image.size
+        size = self.tile_size
+        tiles = []
+        for top in range(0, height, size):
+            for left in range(0, width, size):
+                tile = image.crop((left, top, min(left + size, width), min(top + size, height)))
+                tiles.append(self._put_tile(tile))
+
+        manifest = {
+            "version": self.MANIFEST_VERSION,
+            "mode": image.mode,
+            "width": width,
+            "height": height,
+            "tile_size": size,
+            "tiles": tiles,
+        }
+        if original is not None:
+            manifest["original"] = self._put_original(original)
+        self._write_atomic(manifest_path, json.dumps(manifest).encode("utf-8"))
+        return manifest_path
+
+    @staticmethod
+    def read_manifest(manifest_path):
+        """マニフェストを読み込む"""
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self, manifest_path):
+        """マニフェストから画像を組み立て直す"""
+        manifest = self.read_manifest(manifest_path)
+        width, height, size = manifest["width"], manifest["height"], manifest["tile_size"]
+        columns = (width + size - 1) // size
+
+        image = Image.new(manifest["mode"], (width, height))
+        for index, digest in enumerate(manifest["tiles"]):
+            with Image.open(self._tile_path(digest)) as tile:
+                image.paste(tile, ((index % columns) * size, (index // columns) * size))
+        return image
+
+    def original_path(self, manifest_path):
+        """保存してある元のバイト列のパス（なければNone）"""
+        original = self.read_manifest(manifest_path).get("original")
+        if original is None:
+            return None
+        path = self._original_path(original)
+        return path if os.path.exists(path) else None
+
+    def load_encoded(self, manifest_path):
+        """エンコード済み画像として読み込む（元のバイト列があればそのまま、なければ組み立ててPNGにする）"""
+        original = self.read_manifest(manifest_path).get("original")
+        if original is not None:
+            try:
+                with open(self._original_path(original), "rb") as f:
+                    return EncodedImage(f.read(), original["mime_type"])
+            except OSError as e:
+                logger.warning("元の画像を読み込めないため、タイルから組み立てます: %s: %s", manifest_path, e)
+        return EncodedImage.from_pil(self.load(manifest_path))
+
+    def stats(self, manifest_dir=None):
+        """重複排除の効果を集計する
+
+        logical_tiles はマニフェストが参照するタイルの延べ数、unique_tiles は保存されているタイル数。
+        dedup_ratio はその比で、space_ratio は非圧縮の画素量に対する実際のディスク使用量（元のバイト列を含む）の比。
+        """
+        manifest_dir = manifest_dir or Config.SAVE_DIRECTORY
+        manifests = glob.glob(os.path.join(glob.escape(manifest_dir), f"*.{self.MANIFEST_EXTENSION}"))
+
+        logical_tiles = 0
+        logical_bytes = 0
+        manifest_bytes = 0
+        referenced = set()
+        originals = set()
+        for manifest_path in manifests:
+            try:
+                manifest = self.read_manifest(manifest_path)
+                manifest_bytes += os.path.getsize(manifest_path)
+            except (OSError, ValueError) as e:
+                logger.warning("マニフェスト読み込みエラー: %s: %s", manifest_path, e)
+                continue
+            logical_tiles += len(manifest["tiles"])
+            logical_bytes += manifest["width"] * manifest["height"] * Image.getmodebands(manifest["mode"])
+            referenced.update(manifest["tiles"])
+            if "original" in manifest:
+                originals.add(self._original_path(manifest["original"]))
+
+        tile_bytes = 0
+        for digest in referenced:
+            try:
+                tile_bytes += os.path.getsize(self._tile_path(digest))
+            except OSError:
+                continue
+
+        original_bytes = 0
+        for path in originals:
+            try:
+                original_bytes += os.path.getsize(path)
+            except OSError:
+                continue
+
+        stored_bytes = tile_bytes + original_bytes + manifest_bytes
+        return {
+            "images": len(manifests),
+            "logical_tiles": logical_tiles,
+            "unique_tiles": len(referenced),
+            "dedup_ratio": logical_tiles / len(referenced) if referenced else 1.0,
+            "logical_bytes": logical_bytes,
+            "stored_bytes": stored_bytes,
+            "space_ratio": logical_bytes / stored_bytes if stored_bytes else 1.0,
+        }